@@ -0,0 +1,45 @@
+# benchmark_finalize.py
+"""Compares the native pikepdf finalizer with the cpdf -squeeze pass on the lossless mode.
+
+Usage: python pdf_testing/benchmark_finalize.py [file.pdf ...] (defaults to the PDFs in this folder)
+"""
+import sys
+import tempfile
+import logging
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from constants import ToolNotFound
+from pdf_optimizer import PdfOptimizer
+from utils import find_cpdf
+
+def run(pdf_path, native, cpdf_path, repeats=3):
+    best = None
+    for _ in range(repeats):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            optimizer = PdfOptimizer(None, cpdf_path, None, native_finalize=native, fast_web_view=True)
+            report = optimizer.optimize_lossless(pdf_path, Path(temp_dir) / "out.pdf")
+        if best is None or report['wall_seconds'] < best['wall_seconds']:
+            best = report
+    return best
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    files = sys.argv[1:] or sorted(str(p) for p in Path(__file__).parent.glob("*.pdf"))
+    try:
+        cpdf_path = find_cpdf()
+    except ToolNotFound:
+        cpdf_path = None
+        print("cpdf not found: only the native finalizer is measured.")
+
+    for pdf_path in files:
+        for native in ((True, False) if cpdf_path else (True,)):
+            report = run(pdf_path, native, cpdf_path)
+            passes = [s for s in report['stages'] if s['stage'] in ('finalize', 'pikepdf_save', 'cpdf')]
+            detail = ", ".join(f"{s['stage']} {s['wall_seconds']:.3f}s" for s in passes)
+            print(f"{Path(pdf_path).name:<20} {'native' if native else 'cpdf':<7} "
+                  f"{report['wall_seconds']:7.3f}s {report['bytes_out']:>10} bytes  ({detail})")
+
+if __name__ == "__main__":
+    main()
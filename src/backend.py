@@ -1,9 +1,14 @@
 import os
 import sys
 import subprocess
+import signal
 import logging
 import shutil
 import tempfile
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 import pikepdf
 import re
@@ -11,17 +16,23 @@ from PIL import Image
 from io import BytesIO
 
 from pdf_optimizer import PdfOptimizer
+from telemetry import write_sidecar
+from gs_engine import run_ghostscript
+from race import race_candidates
+from journal import BatchJournal, file_digest
+from schedule import order_jobs, SCHEDULE_INPUT
+from memory import estimate_peak_memory, memory_budget, memory_report, MemoryAdmission, PeakRss, MB
 from constants import (SPLIT_SINGLE, SPLIT_EVERY_N, SPLIT_CUSTOM, STAMP_IMAGE,
                        POS_TOP_LEFT, POS_TOP_CENTER, POS_TOP_RIGHT,
                        POS_MIDDLE_LEFT, POS_CENTER, POS_MIDDLE_RIGHT,
                        POS_BOTTOM_LEFT, POS_BOTTOM_CENTER, POS_BOTTOM_RIGHT,
-                       META_LOAD, META_SAVE, ProcessingError)
+                       META_LOAD, META_SAVE, ProcessingError, TaskCancelled)
 
 from utils import (resource_path, find_ghostscript, find_cpdf, find_pngquant,
                    find_jpegoptim, find_ect, find_oxipng, format_size,
                    get_pdf_metadata, run_command)
 
-from contextlib import contextmanager
+from contextlib import contextmanager, nullcontext
 
 @contextmanager
 def task_context(q, success_msg="Task complete.", error_prefix="Task failed"):
@@ -196,7 +207,7 @@ def generate_preview(gs_path, cpdf_path, pdf_path, operation, options):
 
         try:
             render_cmd = [gs_path, "-sDEVICE=png16m", "-r96", "-dNOPAUSE", "-dBATCH", "-dSAFER", f"-sOutputFile={preview_image_path}", str(modified_pdf)]
-            run_command(render_cmd)
+            run_ghostscript(render_cmd)
         except Exception as e:
             logging.error(f"Failed to render preview image with Ghostscript: {e}")
             return None
@@ -210,142 +221,384 @@ def generate_preview(gs_path, cpdf_path, pdf_path, operation, options):
         return Image.open(BytesIO(image_data))
 
 
-def run_compress_task(params, mode, q):
-    with task_context(q, success_msg=None, error_prefix="Compress task failed"):
-        optimizer = PdfOptimizer(
-            gs_path=params['gs_path'],
-            cpdf_path=params['cpdf_path'],
-            pngquant_path=params['pngquant_path'],
-            jpegoptim_path=params['jpegoptim_path'],
-            ect_path=params['ect_path'],
-            oxipng_path=params.get('oxipng_path'),
-            q=q,
-            darken_text=params['darken_text'],
-            remove_open_action=params.get('remove_open_action'),
-            fast_web_view=params.get('fast_web_view'),
-            fast_mode=params.get('fast_mode'),
-            safe_mode=params.get('safe_mode'),
-            lossless_encoding=params.get('lossless_encoding', False),
-            preserve_ocr=params.get('preserve_ocr', True),
-            detect_duplicate_images=params.get('detect_duplicate_images', True),
-            convert_to_grayscale=params.get('convert_to_grayscale', False),
-            convert_to_cmyk=params.get('convert_to_cmyk', False),
-            downsample_threshold_enabled=params.get('downsample_threshold_enabled', False),
-            quantize_colors=params.get('quantize_colors', False),
-            quantize_level=params.get('quantize_level', 4),
-            pdfa_compression=params.get('pdfa_compression', False),
-            pdfa_dpi=params.get('pdfa_dpi', 300)
-        )
+def optimizer_options(params):
+    """PdfOptimizer keyword arguments for a compress task's params."""
+    return dict(
+        gs_path=params['gs_path'],
+        cpdf_path=params['cpdf_path'],
+        pngquant_path=params['pngquant_path'],
+        jpegoptim_path=params['jpegoptim_path'],
+        ect_path=params['ect_path'],
+        oxipng_path=params.get('oxipng_path'),
+        darken_text=params['darken_text'],
+        remove_open_action=params.get('remove_open_action'),
+        fast_web_view=params.get('fast_web_view'),
+        fast_mode=params.get('fast_mode'),
+        safe_mode=params.get('safe_mode'),
+        lossless_encoding=params.get('lossless_encoding', False),
+        preserve_ocr=params.get('preserve_ocr', True),
+        detect_duplicate_images=params.get('detect_duplicate_images', True),
+        convert_to_grayscale=params.get('convert_to_grayscale', False),
+        convert_to_cmyk=params.get('convert_to_cmyk', False),
+        downsample_threshold_enabled=params.get('downsample_threshold_enabled', False),
+        quantize_colors=params.get('quantize_colors', False),
+        quantize_level=params.get('quantize_level', 4),
+        pdfa_compression=params.get('pdfa_compression', False),
+        pdfa_dpi=params.get('pdfa_dpi', 300),
+        image_workers=params.get('image_workers', 1),
+        image_cache=params.get('image_cache', False),
+        image_cache_dir=params.get('image_cache_dir'),
+        image_cache_max_mb=params.get('image_cache_max_mb', 512),
+        image_triage=params.get('image_triage', True),
+        triage_min_pixels=params.get('triage_min_pixels', 1024),
+        triage_min_gain=params.get('triage_min_gain', 512),
+        effort=params.get('effort'),
+        time_budget=params.get('time_budget'),
+        batch_time_budget=params.get('batch_time_budget'),
+        gs_library=params.get('gs_library', False),
+        gs_workers=params.get('gs_workers', 1),
+        native_finalize=params.get('native_finalize', True),
+        preflight=params.get('preflight', False),
+        jpeg_ssim_target=params.get('jpeg_ssim_target'),
+        placement_dpi=params.get('placement_dpi'),
+        tool_timeouts=params.get('tool_timeouts'),
+        document_timeout=params.get('document_timeout')
+    )
+
+
+def worker_optimizer_options(params):
+    """optimizer_options for a worker process: libgs is used unless params turn it off, since a
+    crash there loses one file rather than the app."""
+    return {**optimizer_options(params), 'gs_library': params.get('gs_library', True)}
+
+
+def _compress_file(params, optimizer, input_file, output_file, q):
+    """Compresses one file of a batch with optimizer.
+
+    Returns {'size': bytes it adds to the batch's output total, 'output': name written or
+    None, 'skipped': True when only_if_smaller kept it from being saved, 'bytes_in'}, plus
+    'fallback' with the error when processing failed and the original was copied instead.
+    """
+    compression_mode = params.get('mode', 'Lossy')
+    only_if_smaller = params.get('only_if_smaller', False)
+    original_size = 0
+    try:
+        original_size = input_file.stat().st_size
+    except FileNotFoundError:
+         logging.error(f"Input file not found: {input_file}")
+         raise ProcessingError(f"Input file not found: {input_file.name}")
 
-        output_path = Path(params['output_path'])
-        total_in_size = 0
-        files_skipped = 0
-        processed_filenames = []
+    def saved(size):
+        return {'size': size, 'output': output_file.name, 'skipped': False, 'bytes_in': original_size}
 
-        def process_a_file(input_file, output_file):
-            nonlocal files_skipped
-            compression_mode = params.get('mode', 'Lossy')
-            only_if_smaller = params.get('only_if_smaller', False)
-            original_size = 0
-            try:
-                original_size = input_file.stat().st_size
-            except FileNotFoundError:
-                 logging.error(f"Input file not found: {input_file}")
-                 raise ProcessingError(f"Input file not found: {input_file.name}")
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_out:
+        temp_output_path = Path(temp_out.name)
 
+    try:
+        if compression_mode == 'Lossless':
+            if params.get('true_lossless', False):
+                report = optimizer.optimize_true_lossless(input_file, temp_output_path, strip_metadata=params['strip_metadata'])
+            else:
+                report = optimizer.optimize_lossless(input_file, temp_output_path, strip_metadata=params['strip_metadata'])
+        elif compression_mode == 'PDF/A':
+            report = optimizer.optimize_pdfa(input_file, temp_output_path)
+        elif compression_mode == 'Remove Images':
+            report = optimizer.optimize_text_only(input_file, temp_output_path, strip_metadata=params['strip_metadata'])
+        elif params.get('best_of'):
+            job = {'dpi': params['dpi'], 'strip_metadata': params['strip_metadata'],
+                   'remove_interactive': params['remove_interactive'], 'use_bicubic': params['use_bicubic']}
+            report = race_candidates(worker_optimizer_options(params), input_file, temp_output_path, job, q, cancel=optimizer.cancel)
+        else:
+            report = optimizer.optimize_lossy(
+                input_file, temp_output_path, params['dpi'],
+                strip_metadata=params['strip_metadata'],
+                remove_interactive=params['remove_interactive'],
+                use_bicubic=params['use_bicubic']
+            )
 
-            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_out:
-                temp_output_path = Path(temp_out.name)
+        if report and params.get('telemetry_sidecar'):
+            write_sidecar(report, output_file)
 
-            try:
-                if compression_mode == 'Lossless':
-                    if params.get('true_lossless', False):
-                        optimizer.optimize_true_lossless(input_file, temp_output_path, strip_metadata=params['strip_metadata'])
-                    else:
-                        optimizer.optimize_lossless(input_file, temp_output_path, strip_metadata=params['strip_metadata'])
-                elif compression_mode == 'PDF/A':
-                    optimizer.optimize_pdfa(input_file, temp_output_path)
-                elif compression_mode == 'Remove Images':
-                    optimizer.optimize_text_only(input_file, temp_output_path, strip_metadata=params['strip_metadata'])
-                else:
-                    optimizer.optimize_lossy(
-                        input_file, temp_output_path, params['dpi'],
-                        strip_metadata=params['strip_metadata'],
-                        remove_interactive=params['remove_interactive'],
-                        use_bicubic=params['use_bicubic']
-                    )
-
-                if not temp_output_path.exists() or temp_output_path.stat().st_size == 0:
-                    logging.warning(f"Processing failed for {input_file.name}, temp file is empty. Copying original.")
-                    shutil.copy2(input_file, output_file)
-                    processed_filenames.append(output_file.name)
-                    return original_size
-
-                new_size = temp_output_path.stat().st_size
-
-                if compression_mode == 'PDF/A':
-                    shutil.move(str(temp_output_path), output_file)
-                    processed_filenames.append(output_file.name)
-                    return new_size
-
-                if new_size < original_size:
-                    shutil.move(str(temp_output_path), output_file)
-                    processed_filenames.append(output_file.name)
-
-                    if params.get('delete_original') and input_file.resolve() != output_file.resolve():
-                        try:
-                            os.remove(input_file)
-                            logging.info(f"Deleted original file: {input_file.name}")
-                        except Exception as del_err:
-                            logging.error(f"Failed to delete original file {input_file.name}: {del_err}")
-
-                    return new_size
-                else:
-                    if only_if_smaller:
-                        files_skipped += 1
-                        logging.info(f"Skipping save for {input_file.name}, new size {new_size} >= original size {original_size}")
-                        return 0 # Indicate no output size contribution
-                    else:
-                        shutil.copy2(input_file, output_file)
-                        processed_filenames.append(output_file.name)
-                        logging.info(f"Saving original for {input_file.name}, new size {new_size} >= original size {original_size}")
-                        return original_size
-
-            except Exception as proc_err:
-                 logging.error(f"Error processing {input_file.name}: {proc_err}", exc_info=True)
-                 try:
-                     if not output_file.exists():
-                          shutil.copy2(input_file, output_file)
-                          processed_filenames.append(output_file.name)
-                          logging.info(f"Copied original {input_file.name} due to processing error.")
-                          return original_size # Count original size if copied
-                 except Exception as copy_err:
-                      logging.error(f"Could not copy original {input_file.name} after error: {copy_err}")
-                 raise proc_err
-            finally:
-                if temp_output_path.exists():
-                    os.remove(temp_output_path)
-            return 0 # Return 0 size contribution if error wasn't handled by copying original
+        if not temp_output_path.exists() or temp_output_path.stat().st_size == 0:
+            logging.warning(f"Processing failed for {input_file.name}, temp file is empty. Copying original.")
+            shutil.copy2(input_file, output_file)
+            return saved(original_size)
 
+        new_size = temp_output_path.stat().st_size
+
+        if compression_mode == 'PDF/A':
+            shutil.move(str(temp_output_path), output_file)
+            return saved(new_size)
+
+        if new_size < original_size:
+            shutil.move(str(temp_output_path), output_file)
+
+            if params.get('delete_original') and input_file.resolve() != output_file.resolve():
+                try:
+                    os.remove(input_file)
+                    logging.info(f"Deleted original file: {input_file.name}")
+                except Exception as del_err:
+                    logging.error(f"Failed to delete original file {input_file.name}: {del_err}")
+
+            return saved(new_size)
+        else:
+            if only_if_smaller:
+                logging.info(f"Skipping save for {input_file.name}, new size {new_size} >= original size {original_size}")
+                return {'size': 0, 'output': None, 'skipped': True, 'bytes_in': original_size} # No output size contribution
+            else:
+                shutil.copy2(input_file, output_file)
+                logging.info(f"Saving original for {input_file.name}, new size {new_size} >= original size {original_size}")
+                return saved(original_size)
+
+    except Exception as proc_err:
+         logging.error(f"Error processing {input_file.name}: {proc_err}", exc_info=True)
+         try:
+             if not output_file.exists():
+                  shutil.copy2(input_file, output_file)
+                  logging.info(f"Copied original {input_file.name} due to processing error.")
+                  return {**saved(original_size), 'fallback': str(proc_err)} # Count original size if copied
+         except Exception as copy_err:
+              logging.error(f"Could not copy original {input_file.name} after error: {copy_err}")
+         raise proc_err
+    finally:
+        if temp_output_path.exists():
+            os.remove(temp_output_path)
+
+def _output_paths(input_files, output_path):
+    """Output path per input file; inputs sharing a name get ' (2)', ' (3)'... so none overwrites another."""
+    taken, outputs = set(), []
+    for input_file in input_files:
+        name, n = input_file.name, 1
+        while name.lower() in taken:
+            n += 1
+            name = f"{input_file.stem} ({n}){input_file.suffix}"
+        taken.add(name.lower())
+        outputs.append(output_path / name)
+    return outputs
+
+class _FileQueue:
+    """Stands in for the progress queue inside a batch worker: tags each message with its file's index."""
+
+    def __init__(self, events, index):
+        self.events = events
+        self.index = index
+
+    def put(self, message):
+        self.events.put((self.index,) + tuple(message))
+
+# Per-process state of a batch worker, set up once by _init_batch_worker.
+_batch_worker = {}
+
+def _init_batch_worker(params, events, batch_deadline, cancel):
+    if cancel is not None:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches the workers through the token
+    _batch_worker['params'] = params
+    _batch_worker['events'] = events
+    _batch_worker['optimizer'] = PdfOptimizer(q=None, batch_deadline=batch_deadline, cancel=cancel,
+                                              **worker_optimizer_options(params))
+
+def _compress_measured(params, optimizer, input_file, output_file, q):
+    """_compress_file, or its error, with the observed peak RSS as 'peak_rss' when a memory budget is set."""
+    with PeakRss() if params.get('memory_budget_mb') is not None else nullcontext() as rss:
+        try:
+            outcome = _compress_file(params, optimizer, input_file, output_file, q)
+        except Exception as e:
+            outcome = {'error': str(e)}
+        except TaskCancelled as e:
+            outcome = {'error': str(e), 'cancelled': True}
+    if rss is not None:
+        outcome['peak_rss'] = rss.peak
+    return outcome
+
+def _compress_in_worker(index, input_file, output_file, position):
+    """Batch worker entry point: compresses one file and returns its outcome, or its error."""
+    params, optimizer = _batch_worker['params'], _batch_worker['optimizer']
+    q = optimizer.q = _FileQueue(_batch_worker['events'], index)
+    q.put(('status', f"Processing ({position})..."))
+    skipped_before = optimizer.triage_stats['skipped']
+    outcome = _compress_measured(params, optimizer, Path(input_file), Path(output_file), q)
+    outcome['triage'] = {'skipped': optimizer.triage_stats['skipped'] - skipped_before,
+                         'fastest_job_seconds': optimizer.triage_stats['fastest_job_seconds']}
+    return outcome
+
+def _batch_worker_count(params, file_count):
+    workers = params.get('max_workers', 1)
+    workers = workers if workers else (os.cpu_count() or 1)
+    return max(1, min(workers, file_count))
+
+def _run_batch_in_pool(params, optimizer, files, outputs, indices, q, on_done, estimate=None, budget=None):
+    """Compresses files[i] for i in indices in a process pool, calling on_done(i, outcome) as each one finishes.
+
+    Each worker keeps one PdfOptimizer for all its files. Their progress messages come back
+    through an event queue and reach q prefixed with the (unique) output name of their file.
+    With a memory budget (bytes), estimate(i) gives a file's estimated peak memory and files
+    start only while their estimates fit in the budget.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    events = ctx.Queue()
+    total = len(files)
+
+    def forward():
+        while (event := events.get()) is not None:
+            index, msg_type, value = event
+            if msg_type == 'status':
+                q.put(('status', f"{outputs[index].name}: {value}"))
+    forwarder = threading.Thread(target=forward, daemon=True)
+    forwarder.start()
+
+    # Workers share the batch's time budget instead of each starting their own.
+    batch_deadline = time.time() + optimizer.batch_time_budget if optimizer.batch_time_budget else None
+    workers = _batch_worker_count(params, len(indices))
+    q.put(('status', f"Processing {len(indices)} files with {workers} workers..."))
+    admission = MemoryAdmission(budget) if budget else None
+    waiting, futures, held = list(reversed(indices)), {}, set()
+
+    def submit_ready(executor):
+        # Only as many files as workers are handed to the pool, so admission decides what runs next.
+        while waiting and len(futures) < workers:
+            if optimizer.cancel is not None and optimizer.cancel.cancelled:
+                return
+            i = waiting[-1]
+            if admission:
+                if not admission.fits(estimate(i)):
+                    if i not in held:
+                        held.add(i)
+                        q.put(('status', f"Waiting for memory to start {outputs[i].name} "
+                                         f"({admission.in_use // MB} of {admission.budget // MB} MB in use)..."))
+                    return
+                admission.start(estimate(i))
+            waiting.pop()
+            futures[executor.submit(_compress_in_worker, i, str(files[i]), str(outputs[i]), f"{i+1}/{total}")] = i
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_batch_worker,
+                                 initargs=(params, events, batch_deadline, optimizer.cancel)) as executor:
+            submit_ready(executor)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = futures.pop(future)
+                    try:
+                        outcome = future.result()
+                    except Exception as e:
+                        # The worker process died (crash, out of memory): only its file fails.
+                        logging.error(f"Worker failed on {files[i].name}: {e}")
+                        outcome = {'error': str(e)}
+                    if admission:
+                        admission.finish(estimate(i))
+                    optimizer.add_triage_stats(outcome.pop('triage', None))
+                    on_done(i, outcome)
+                submit_ready(executor)
+    finally:
+        events.put(None)
+        forwarder.join()
+
+def run_compress_task(params, mode, q, cancel=None):
+    """Compresses params['input_files'] into params['output_path'], reporting through q.
+
+    Setting the cancel token (utils.CancelToken) stops the batch: running tools are killed,
+    files not yet started are left alone and the final message says how far it got.
+    """
+    with task_context(q, success_msg=None, error_prefix="Compress task failed"):
+        optimizer = PdfOptimizer(q=q, cancel=cancel, **optimizer_options(params))
+
+        output_path = Path(params['output_path'])
         pdf_files_paths = [Path(f) for f in params['input_files']]
         total_in_size = sum(f.stat().st_size for f in pdf_files_paths if f.is_file())
         output_path.mkdir(parents=True, exist_ok=True)
         total_files = len(pdf_files_paths)
         if total_files == 0: raise ProcessingError(f"No PDF files found in list.")
+        output_paths = _output_paths(pdf_files_paths, output_path)
+        journal = BatchJournal(output_path, params) if params.get('journal') else None
+        content_hashes = {}
+        estimates = {} if params.get('memory_budget_mb') is not None else None
+        budget = memory_budget(params) if estimates is not None else None
+        memory_observed = {}
+
+        def estimate(index):
+            if index not in estimates:
+                try:
+                    estimates[index] = estimate_peak_memory(pdf_files_paths[index], params)
+                except OSError:
+                    estimates[index] = 0  # Missing file: fails at once when processed
+            return estimates[index]
 
         errors_occurred = 0
+        files_skipped = 0
         total_out_size = 0
-        for i, pdf_file in enumerate(pdf_files_paths):
-            output_file_path = output_path / pdf_file.name
-            q.put(('status', f"Processing {pdf_file.name} ({i+1}/{total_files})..."))
-            try:
-                size = process_a_file(pdf_file, output_file_path)
-                total_out_size += size
-            except Exception:
+        completed = 0
+        resumed = 0
+        cancelled = 0
+        # Finished files wait here until every file before them in the list is reported, so
+        # results come out in input order whatever order the files ran in.
+        unreported, next_report = {}, 0
+
+        def report(index, outcome):
+            pdf_file = pdf_files_paths[index]
+            if 'error' in outcome:
+                q.put(('status', f"Error processing {pdf_file.name} ({index+1}/{total_files})..."))
+            q.put(('file', {'index': index, 'input': str(pdf_file), **outcome}))
+
+        def on_done(index, outcome):
+            nonlocal errors_occurred, files_skipped, total_out_size, completed, next_report, cancelled
+            completed += 1
+            pdf_file = pdf_files_paths[index]
+            if journal and index in content_hashes and not outcome.get('resumed') and not outcome.get('cancelled'):
+                journal.record(pdf_file, *content_hashes[index], outcome)
+            if outcome.get('cancelled'):
+                cancelled += 1
+            elif 'error' in outcome:
                 errors_occurred += 1
-                q.put(('status', f"Error processing {pdf_file.name} ({i+1}/{total_files})..."))
-            finally:
-                q.put(('overall', ((i + 1) / total_files) * 100))
+            else:
+                total_out_size += outcome['size']
+                files_skipped += outcome['skipped']
+            if estimates is not None and not outcome.get('resumed'):
+                memory_observed[index] = outcome.pop('peak_rss', None)
+                outcome['memory'] = {'estimated': estimate(index), 'observed': memory_observed[index]}
+            unreported[index] = outcome
+            while next_report in unreported:
+                report(next_report, unreported.pop(next_report))
+                next_report += 1
+            q.put(('overall', (completed / total_files) * 100))
+
+        pending = list(range(total_files))
+        if journal:
+            # Hashed before processing: the output may replace the input, or delete_original remove it.
+            q.put(('status', "Checking the journal for finished files..."))
+            pending = []
+            for i, pdf_file in enumerate(pdf_files_paths):
+                try:
+                    content_hashes[i] = (file_digest(pdf_file), pdf_file.stat().st_size)
+                except OSError:
+                    pending.append(i)  # Fails again, and is reported, when processed
+                    continue
+                outcome = journal.lookup(pdf_file, content_hashes[i][0], output_paths[i])
+                if outcome is None:
+                    pending.append(i)
+                else:
+                    resumed += 1
+                    on_done(i, {**outcome, 'resumed': True})
+
+        schedule = params.get('schedule') or SCHEDULE_INPUT
+        if schedule != SCHEDULE_INPUT and len(pending) > 1:
+            q.put(('status', f"Ordering {len(pending)} files ({schedule} first)..."))
+            pending = order_jobs(pdf_files_paths, pending, schedule, params)
+
+        try:
+            if _batch_worker_count(params, len(pending)) > 1:
+                _run_batch_in_pool(params, optimizer, pdf_files_paths, output_paths, pending, q, on_done,
+                                   estimate, budget)
+            else:
+                for i in pending:
+                    if cancel is not None and cancel.cancelled:
+                        break
+                    pdf_file = pdf_files_paths[i]
+                    q.put(('status', f"Processing {pdf_file.name} ({i+1}/{total_files})..."))
+                    on_done(i, _compress_measured(params, optimizer, pdf_file, output_paths[i], q))
+        finally:
+            if journal: journal.close()
+            for index in sorted(unreported):  # Only left when the batch stopped early
+                report(index, unreported.pop(index))
 
         final_message = "Processing complete."
         if errors_occurred > 0:
@@ -372,12 +625,63 @@ def run_compress_task(params, mode, q):
         elif errors_occurred == 0:
             final_message = "Processing complete. Size comparison not available."
 
+        if cancel is not None and cancel.cancelled:
+            # The files never processed would skew the size totals, so only the count is given.
+            final_message = f"Cancelled after {completed - cancelled} of {total_files} file(s)."
+            if errors_occurred > 0:
+                final_message += f" ({errors_occurred} error(s))"
+
         if files_skipped > 0:
             final_message += f" ({files_skipped} file(s) not saved as output was larger)."
 
+        if resumed > 0:
+            final_message += f" ({resumed} file(s) already done in an earlier run, skipped.)"
+
+        triage_summary = optimizer.triage_summary()
+        if triage_summary:
+            final_message += f" ({triage_summary}.)"
+
+        if memory_observed:
+            report = memory_report([(output_paths[i].name, estimates[i], memory_observed[i])
+                                    for i in sorted(memory_observed)], budget)
+            for line in report:
+                logging.info(line)
+            if any(memory_observed.values()):
+                final_message += f" ({report[-1]})"
+
         q.put(('complete', final_message))
 
 
+class _SingleFileOutcome:
+    """Queue stand-in that keeps the per-file outcome and the final message of a one-file batch."""
+
+    def __init__(self):
+        self.file = None
+        self.message = None
+
+    def put(self, message):
+        msg_type, value = message
+        if msg_type == 'file':
+            self.file = value
+        elif msg_type == 'complete':
+            self.message = value
+
+def compress_single_file(params, input_file, output_dir):
+    """Compresses one file as a one-file batch into output_dir and returns its outcome (see _compress_file)."""
+    outcome = _SingleFileOutcome()
+    # Called in pool workers (watch, serve), so libgs is on unless params turn it off.
+    run_compress_task({**params, 'input_files': [str(input_file)], 'output_path': str(output_dir),
+                       'max_workers': 1, 'journal': False, 'gs_library': params.get('gs_library', True)},
+                      "single", outcome)
+    return outcome.file or {'error': outcome.message or "no result"}
+
+def detach_worker():
+    """Pool initializer for long-running services: Ctrl+C in the terminal stops the service, not the jobs in flight."""
+    if sys.platform != "win32":
+        os.setpgrp()  # The tools a worker runs stay out of the terminal's process group too
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
 def run_merge_task(file_list, output_path, q):
     with task_context(q, "Merge complete.", "Merge task failed"):
         with pikepdf.Pdf.new() as pdf:
@@ -534,7 +838,7 @@ def run_pdf_to_image_task(gs_path, pdf_in, out_dir, options, q):
         out_path = output_dir_path / f"{Path(pdf_in).stem}_%d.{fmt}"
         device_map = {'png': 'png16m', 'jpeg': 'jpeg', 'tiff': 'tiffg4'}
         cmd = [gs_path, f"-sDEVICE={device_map.get(fmt, 'png16m')}", f"-r{dpi}", "-dNOPAUSE", "-dBATCH", f"-sOutputFile={str(out_path)}", pdf_in]
-        run_command(cmd)
+        run_ghostscript(cmd)
 
 def run_repair_task(pdf_in, pdf_out, q):
     with task_context(q, "Repair attempt finished.", "Repair task failed"):
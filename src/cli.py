@@ -0,0 +1,297 @@
+# cli.py
+"""Headless batch compression, without the GUI.
+
+Usage (run from src/):
+    python -m cli compress [options] INPUT [INPUT ...] -o OUTPUT_DIR
+    python -m cli watch [options] FOLDER -o OUTPUT_DIR
+    python -m cli serve [--host HOST] [--port PORT] [-j WORKERS]
+
+INPUT is a PDF, a directory (searched recursively) or a glob, where ** matches any depth.
+Each file's result is printed to stdout as a JSON line; compress ends with a summary line.
+Exit codes: 0 every file done, 1 some files failed, 2 bad arguments or no input, 3 the
+batch failed, 130 cancelled with Ctrl+C (which lets the files in progress stop cleanly; a
+second Ctrl+C stops at once). watch and serve run until Ctrl+C; serve takes POST /compress?mode=...&dpi=...
+with the PDF as the body and answers with the compressed PDF.
+"""
+import os
+import sys
+import glob
+import json
+import signal
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+from constants import ToolNotFound
+from schedule import SCHEDULES, SCHEDULE_INPUT
+from utils import find_ghostscript, find_cpdf, find_pngquant, find_jpegoptim, find_ect, find_oxipng, CancelToken
+
+EXIT_OK = 0
+EXIT_FILE_ERRORS = 1
+EXIT_USAGE = 2
+EXIT_FAILED = 3
+EXIT_CANCELLED = 130
+
+# CLI mode names and the GUI's compress_mode values they stand for.
+MODES = {'lossy': 'Compression', 'lossless': 'Lossless', 'pdfa': 'PDF/A', 'remove-images': 'Remove Images'}
+
+TOOLS = (('gs_path', find_ghostscript, "Ghostscript"), ('cpdf_path', find_cpdf, "cpdf"),
+         ('pngquant_path', find_pngquant, "pngquant"), ('jpegoptim_path', find_jpegoptim, "jpegoptim"),
+         ('ect_path', find_ect, "ECT"), ('oxipng_path', find_oxipng, "oxipng"))
+
+# (param, type, default, help) for the compress options; booleans get --x/--no-x switches.
+# Defaults are those of the GUI's CompressSettings.
+OPTIONS = (
+    ('dpi', int, 72, "target image resolution for the lossy mode"),
+    ('pdfa_dpi', int, 300, "image resolution for compressed PDF/A output"),
+    ('use_bicubic', bool, False, "bicubic downsampling"),
+    ('safe_mode', bool, False, "let Ghostscript choose JPEG or Flate per image"),
+    ('downsample_threshold_enabled', bool, True, "downsample every image above the target DPI, not only those 1.5x above"),
+    ('detect_duplicate_images', bool, True, "store identical images once"),
+    ('quantize_colors', bool, False, "posterize colours"),
+    ('quantize_level', int, 4, "posterize level"),
+    ('convert_to_grayscale', bool, False, "convert to grayscale"),
+    ('convert_to_cmyk', bool, False, "convert to CMYK"),
+    ('darken_text', bool, False, "darken text"),
+    ('strip_metadata', bool, False, "remove document metadata"),
+    ('remove_interactive', bool, False, "remove annotations and form fields"),
+    ('remove_open_action', bool, False, "remove the document's /OpenAction"),
+    ('fast_web_view', bool, False, "linearize the output"),
+    ('only_if_smaller', bool, False, "don't save outputs that aren't smaller"),
+    ('fast_mode', bool, False, "quicker, less thorough image passes"),
+    ('true_lossless', bool, False, "lossless mode leaves JPEGs untouched"),
+    ('pdfa_compression', bool, False, "compress PDF/A output"),
+    ('lossless_encoding', bool, False, "Flate instead of JPEG for images in the lossy mode"),
+    ('preserve_ocr', bool, True, "keep marked content and embed all fonts"),
+    ('delete_original', bool, False, "delete each input once a smaller output is saved"),
+    ('best_of', bool, False, "race the lossless, lossy and preset strategies and keep the smallest"),
+    ('preflight', bool, False, "profile lossy inputs and skip Ghostscript where it can't help"),
+    ('jpeg_ssim_target', float, None, "re-encode JPEGs down to this SSIM (e.g. 0.98); lossy mode only"),
+    ('placement_dpi', int, None, "downsample images drawn above this DPI in the lossy mode's pikepdf passes"),
+    ('effort', int, None, "image tool effort, 1 to 3"),
+    ('time_budget', float, None, "seconds of image work per document"),
+    ('batch_time_budget', float, None, "seconds of image work for the whole batch"),
+    ('image_workers', int, 1, "image worker processes per document (0: one per core)"),
+    ('gs_workers', int, 1, "Ghostscript page-range workers per document (0: one per core)"),
+    ('image_cache', bool, False, "reuse optimized images across runs"),
+    ('image_cache_dir', str, None, "image cache folder"),
+    ('image_triage', bool, True, "skip images unlikely to shrink"),
+    ('telemetry_sidecar', bool, False, "write a .telemetry.json report next to each output"),
+    ('journal', bool, False, "record finished files in the output folder and skip them on a rerun"),
+    ('document_timeout', float, None, "seconds a document may take before its original is kept instead"),
+    ('memory_budget_mb', float, None, "start files only while their estimated peak memory fits in this many MB (0: 80%% of free RAM)"),
+)
+
+# Allowed values of the OPTIONS that take only a few.
+CHOICES = {'effort': (1, 2, 3)}
+
+def _walk_pdfs(folder):
+    for root, dirs, names in os.walk(folder):
+        dirs.sort()
+        for name in sorted(names):
+            if name.lower().endswith('.pdf'):
+                yield Path(root) / name
+
+def iter_pdf_files(inputs):
+    """Yields the PDFs named by inputs (files, directories searched recursively, globs), each once, as found."""
+    seen = set()
+    for item in inputs:
+        if glob.has_magic(item):
+            candidates = (Path(p) for p in glob.iglob(item, recursive=True) if p.lower().endswith('.pdf'))
+        elif os.path.isdir(item):
+            candidates = _walk_pdfs(item)
+        else:
+            # Named explicitly, so it is yielded even if missing and reported as that file's error.
+            candidates = [Path(item)]
+        for path in candidates:
+            key = os.path.normcase(os.path.abspath(path))
+            if key not in seen and (path.is_file() or not path.exists()):
+                seen.add(key)
+                yield path
+
+def _tool_timeout_arg(text):
+    """'SECONDS' (any tool) or 'TOOL=SECONDS' (e.g. gs=600) to a (tool, seconds) pair."""
+    tool, _, seconds = text.rpartition('=')
+    try:
+        return (tool.strip().lower() or '*', float(seconds))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected SECONDS or TOOL=SECONDS, got {text!r}")
+
+def _add_tool_options(command):
+    for tool, _, name in TOOLS:
+        command.add_argument(f"--{tool.replace('_', '-')}", dest=tool, help=f"{name} executable (default: bundled or on PATH)")
+    command.add_argument('--tool-timeout', type=_tool_timeout_arg, action='append', metavar='[TOOL=]SECONDS',
+                         help="stop an external tool after this long and fall back to the next strategy; "
+                              "repeat for per-tool limits, e.g. --tool-timeout 120 --tool-timeout gs=600")
+
+def _add_compress_options(command):
+    command.add_argument('-o', '--output', required=True, help="output folder")
+    command.add_argument('-m', '--mode', choices=MODES, default='lossy', help="compression mode (default: lossy)")
+    command.add_argument('-j', '--workers', type=int, default=1, help="files processed in parallel (0: one per core)")
+    command.add_argument('-v', '--verbose', action='store_true', help="progress messages and warnings on stderr")
+    _add_tool_options(command)
+    for param, kind, default, help_text in OPTIONS:
+        flag = f"--{param.replace('_', '-')}"
+        if kind is bool:
+            command.add_argument(flag, dest=param, action=argparse.BooleanOptionalAction, default=default, help=help_text)
+        else:
+            command.add_argument(flag, dest=param, type=kind, default=default, choices=CHOICES.get(param), help=help_text)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli", description="MinimalPDF batch compression without the GUI.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    compress = commands.add_parser('compress', help="compress PDFs into an output folder")
+    compress.add_argument('inputs', nargs='+', metavar='INPUT', help="PDF files, directories or globs (** recurses)")
+    _add_compress_options(compress)
+    compress.add_argument('--schedule', choices=SCHEDULES, default=SCHEDULE_INPUT,
+                          help="order files start in: input order, largest or smallest file first, or highest "
+                               "estimated cost first (results are printed in input order either way)")
+
+    watch = commands.add_parser('watch', help="compress every PDF dropped into a folder, until Ctrl+C")
+    watch.add_argument('folder', help="hot folder to watch")
+    _add_compress_options(watch)
+    watch.add_argument('--quarantine', help="folder for inputs that fail (default: OUTPUT/quarantine)")
+    watch.add_argument('--queue-size', type=int, help="files claimed beyond those being compressed (default: one per worker)")
+    watch.add_argument('--settle', type=float, default=2.0, help="seconds a file's size must stay unchanged (default: 2)")
+    watch.add_argument('--poll-interval', type=float, default=2.0, help="seconds between scans without inotify (default: 2)")
+
+    serve = commands.add_parser('serve', help="compress PDFs posted to a local HTTP endpoint, until Ctrl+C")
+    serve.add_argument('--host', default="127.0.0.1", help="address to bind (default: 127.0.0.1)")
+    serve.add_argument('--port', type=int, default=8765, help="port (default: 8765)")
+    serve.add_argument('-j', '--workers', type=int, default=1, help="requests compressed in parallel (0: one per core)")
+    serve.add_argument('--queue-size', type=int, help="requests waiting beyond those being compressed (default: one per worker)")
+    serve.add_argument('--max-upload-mb', type=float, default=512, help="largest accepted upload (default: 512)")
+    serve.add_argument('-v', '--verbose', action='store_true', help="request log and warnings on stderr")
+    _add_tool_options(serve)
+    return parser
+
+def tool_paths(args):
+    """Tool paths from the --*-path arguments, the rest found as the GUI finds them."""
+    paths = {}
+    for tool, finder, name in TOOLS:
+        paths[tool] = getattr(args, tool)
+        if paths[tool] is None:
+            try:
+                paths[tool] = finder()
+            except ToolNotFound as e:
+                logging.warning(f"{name} not found: {e}")
+    return paths
+
+def compress_params(args, input_files):
+    """The params dict run_compress_task takes, as the GUI builds it, from parsed arguments."""
+    params = {param: getattr(args, param) for param, _, _, _ in OPTIONS}
+    params.update(tool_paths(args))
+    params['tool_timeouts'] = dict(args.tool_timeout or ())
+    params.update(mode=MODES[args.mode], output_path=args.output, max_workers=args.workers,
+                  schedule=getattr(args, 'schedule', SCHEDULE_INPUT), input_files=[str(f) for f in input_files])
+    return params
+
+class ResultPrinter:
+    """Stands in for the GUI's progress queue: prints per-file results as JSON lines as they arrive."""
+
+    def __init__(self, verbose=False, stream=None):
+        self.verbose = verbose
+        self.stream = stream or sys.stdout
+        self.files = self.errors = 0
+        self.summary = None
+        self._lock = threading.Lock()  # Pool batches report from a forwarding thread too
+
+    def put(self, message):
+        msg_type, value = message
+        with self._lock:
+            if msg_type == 'file':
+                self.files += 1
+                self.errors += ('error' in value or 'fallback' in value) and not value.get('cancelled')
+                print(json.dumps(self._file_result(value)), file=self.stream, flush=True)
+            elif msg_type == 'status' and self.verbose:
+                print(value, file=sys.stderr, flush=True)
+            elif msg_type == 'complete':
+                self.summary = value
+
+    @staticmethod
+    def _file_result(outcome):
+        if outcome.get('cancelled'):
+            status = 'cancelled'
+        elif 'error' in outcome:
+            status = 'error'
+        elif outcome.get('resumed'):
+            status = 'resumed'
+        elif 'fallback' in outcome:
+            status = 'original_copied'
+        else:
+            status = 'not_saved' if outcome['skipped'] else 'done'
+        result = {'input': outcome['input'], 'status': status, 'output': outcome.get('output'),
+                  'bytes_in': outcome.get('bytes_in'), 'bytes_out': outcome.get('size')}
+        if 'error' in outcome or 'fallback' in outcome:
+            result['error'] = outcome.get('error') or outcome['fallback']
+        if 'memory' in outcome:
+            result['memory'] = outcome['memory']
+        return result
+
+def run_compress(args):
+    # Imported here so argument errors and --help don't pay for loading the optimizer.
+    from backend import run_compress_task
+
+    input_files = list(iter_pdf_files(args.inputs))
+    if not input_files:
+        print("No PDF files found.", file=sys.stderr)
+        return EXIT_USAGE
+    printer = ResultPrinter(verbose=args.verbose)
+    cancel = CancelToken()
+
+    def on_interrupt(signum, frame):
+        print("Cancelling... (Ctrl+C again to stop at once)", file=sys.stderr, flush=True)
+        cancel.cancel()
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    previous_handler = signal.signal(signal.SIGINT, on_interrupt)
+    try:
+        run_compress_task(compress_params(args, input_files), "batch", printer, cancel)
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
+
+    failed = printer.summary is None or printer.summary.startswith("Error:")
+    print(json.dumps({'summary': printer.summary, 'files': printer.files, 'errors': printer.errors}), flush=True)
+    if cancel.cancelled:
+        return EXIT_CANCELLED
+    if failed:
+        return EXIT_FAILED
+    return EXIT_FILE_ERRORS if printer.errors else EXIT_OK
+
+def run_watch(args):
+    from watch import HotFolder
+
+    def on_result(result):
+        print(json.dumps(result), flush=True)
+
+    hot_folder = HotFolder(args.folder, args.output, args.quarantine or Path(args.output) / "quarantine",
+                           compress_params(args, []), workers=args.workers, queue_size=args.queue_size,
+                           settle_seconds=args.settle, poll_interval=args.poll_interval, on_result=on_result)
+    stats = hot_folder.run()
+    return EXIT_FILE_ERRORS if stats['failed'] else EXIT_OK
+
+def run_serve(args):
+    from server import serve
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)  # The request log
+    base_params = {**tool_paths(args), 'tool_timeouts': dict(args.tool_timeout or ())}
+    serve(base_params, host=args.host, port=args.port, workers=args.workers,
+          queue_size=args.queue_size, max_upload_mb=args.max_upload_mb)
+    return EXIT_OK
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.ERROR,
+                        format='%(levelname)s - %(message)s', stream=sys.stderr)
+    if args.command == 'compress':
+        return run_compress(args)
+    if args.command == 'watch':
+        return run_watch(args)
+    if args.command == 'serve':
+        return run_serve(args)
+    return EXIT_USAGE
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,9 @@ APP_VERSION = "1.10.0"
 
 class ToolNotFound(Exception): pass
 class ProcessingError(Exception): pass
+class ProcessingTimeout(ProcessingError): pass
+# A BaseException, like KeyboardInterrupt, so the `except Exception` fallbacks let it through.
+class TaskCancelled(BaseException): pass
 
 SPLIT_SINGLE = "Split to Single Pages"
 SPLIT_EVERY_N = "Split Every N Pages"
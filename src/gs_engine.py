@@ -0,0 +1,155 @@
+# gs_engine.py
+import sys
+import ctypes
+import ctypes.util
+import logging
+import threading
+import subprocess
+from pathlib import Path
+
+from constants import ProcessingError
+from utils import run_command
+
+# gsapi return codes: e_Quit is a normal end (-dBATCH, 'quit'), e_Info follows -h/--version.
+_GS_QUIT = -101
+_GS_INFO = -110
+_GS_ARG_ENCODING_UTF8 = 1
+
+# int (*fn)(void *caller_handle, char *buf, int len), used for stdin, stdout and stderr alike.
+_STDIO_FN = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(ctypes.c_char), ctypes.c_int)
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+def _library_candidates(gs_path):
+    """Shared library locations for a gs executable: next to it, in ../lib, then the loader's search path."""
+    if sys.platform == "win32":
+        names = ["gsdll64.dll", "gsdll32.dll"]
+    elif sys.platform == "darwin":
+        names = ["libgs.dylib", "libgs.10.dylib", "libgs.9.dylib"]
+    else:
+        names = ["libgs.so", "libgs.so.10", "libgs.so.9"]
+
+    if gs_path:
+        exe_dir = Path(gs_path).parent
+        for folder in (exe_dir, exe_dir.parent / "lib"):
+            for name in names:
+                if (folder / name).exists():
+                    yield str(folder / name)
+    found = ctypes.util.find_library("gsdll64" if sys.platform == "win32" else "gs")
+    if found:
+        yield found
+    yield from names
+
+class GhostscriptLibrary:
+    """ctypes binding to libgs.
+
+    The library is loaded once per process and kept for every later job. Ghostscript
+    cannot re-initialise an instance after gsapi_exit and most builds allow only one live
+    instance per process, so jobs run one at a time, each on a short-lived instance.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        loader = ctypes.WinDLL if sys.platform == "win32" else ctypes.CDLL
+        self._lib = loader(path)
+        self._lock = threading.Lock()
+
+        lib = self._lib
+        lib.gsapi_new_instance.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p]
+        lib.gsapi_new_instance.restype = ctypes.c_int
+        lib.gsapi_set_stdio.argtypes = [ctypes.c_void_p, _STDIO_FN, _STDIO_FN, _STDIO_FN]
+        lib.gsapi_set_stdio.restype = ctypes.c_int
+        lib.gsapi_init_with_args.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_char_p)]
+        lib.gsapi_init_with_args.restype = ctypes.c_int
+        lib.gsapi_exit.argtypes = [ctypes.c_void_p]
+        lib.gsapi_exit.restype = ctypes.c_int
+        lib.gsapi_delete_instance.argtypes = [ctypes.c_void_p]
+        lib.gsapi_delete_instance.restype = None
+        # Older builds lack it and take arguments in the local code page.
+        self._set_arg_encoding = getattr(lib, "gsapi_set_arg_encoding", None)
+        if self._set_arg_encoding is not None:
+            self._set_arg_encoding.argtypes = [ctypes.c_void_p, ctypes.c_int]
+            self._set_arg_encoding.restype = ctypes.c_int
+
+    def run(self, args):
+        """Runs one job with argv (program name first); returns (exit code, stdout, stderr)."""
+        stdout, stderr = [], []
+
+        def _stdin(handle, buf, length):
+            return 0
+
+        def _writer(chunks):
+            def write(handle, buf, length):
+                chunks.append(ctypes.string_at(buf, length))
+                return length
+            return write
+
+        # Keep the callbacks referenced for the whole call; libgs holds raw pointers to them.
+        callbacks = (_STDIO_FN(_stdin), _STDIO_FN(_writer(stdout)), _STDIO_FN(_writer(stderr)))
+        encoding = 'utf-8' if self._set_arg_encoding is not None else sys.getfilesystemencoding()
+        argv = (ctypes.c_char_p * len(args))(*[str(a).encode(encoding) for a in args])
+
+        with self._lock:
+            instance = ctypes.c_void_p()
+            code = self._lib.gsapi_new_instance(ctypes.byref(instance), None)
+            if code < 0:
+                raise ProcessingError(f"Could not create a Ghostscript instance (error {code}).")
+            try:
+                if self._set_arg_encoding is not None:
+                    self._set_arg_encoding(instance, _GS_ARG_ENCODING_UTF8)
+                self._lib.gsapi_set_stdio(instance, *callbacks)
+                code = self._lib.gsapi_init_with_args(instance, len(args), argv)
+                exit_code = self._lib.gsapi_exit(instance)
+                if code in (0, _GS_QUIT, _GS_INFO):
+                    code = exit_code
+            finally:
+                self._lib.gsapi_delete_instance(instance)
+
+        decode = lambda chunks: b''.join(chunks).decode('utf-8', 'ignore')
+        return (0 if code in (_GS_QUIT, _GS_INFO) else code), decode(stdout), decode(stderr)
+
+def load_library(gs_path=None):
+    """Returns the process-wide GhostscriptLibrary for gs_path, or None when libgs can't be loaded."""
+    key = str(gs_path or "")
+    with _libraries_lock:
+        if key in _libraries:
+            return _libraries[key]
+        library = None
+        for candidate in _library_candidates(gs_path):
+            try:
+                library = GhostscriptLibrary(candidate)
+                logging.info(f"Using Ghostscript library: {candidate}")
+                break
+            except (OSError, AttributeError):
+                continue
+        if library is None:
+            logging.info("Ghostscript shared library not found, using the executable.")
+        _libraries[key] = library
+        return library
+
+def run_ghostscript(command, use_library=False, timeout=None, cancel=None):
+    """Runs a gs command line (executable first), in-process through libgs with use_library.
+
+    A fault in libgs ends the process it runs in, so use_library is for worker processes
+    only, never the GUI's. Falls back to run_command and the executable when the shared
+    library is missing, and returns a CompletedProcess either way. An in-process run
+    can't be stopped, so runs with a timeout use the executable, and cancel is only
+    checked before and after.
+    """
+    library = load_library(command[0]) if use_library and timeout is None else None
+    if library is None:
+        return run_command(command, timeout=timeout, cancel=cancel)
+
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+    logging.info(f"Executing via libgs: {command}")
+    code, stdout, stderr = library.run(["gs"] + [str(a) for a in command[1:]])
+    if cancel is not None:
+        cancel.raise_if_cancelled()
+    if code != 0:
+        logging.error(f"Ghostscript failed.\nSTDOUT: {stdout}\nSTDERR: {stderr}")
+        raise ProcessingError(f"Tool failed: {stderr.strip() or stdout.strip() or f'Ghostscript error {code}'}")
+    if stderr.strip() and "warning" not in stderr.lower():
+        logging.warning(f"Command stderr: {stderr.strip()}")
+    return subprocess.CompletedProcess(command, code, stdout, stderr)
@@ -31,6 +31,7 @@ from constants import (APP_VERSION, ROTATION_MAP, PDF_FONTS, SPLIT_MODES, SPLIT_
 from ui_components import (ScrolledFrame, FileSelector, Tooltip, ModernToggle,
                            CompressionGauge, DropZone, PositionSelector, CustomSlider)
 from tooltips import TOOLTIP_TEXT
+from utils import CancelToken
 
 IS_WINDOWS = sys.platform == "win32"
 if IS_WINDOWS:
@@ -224,6 +225,7 @@ class GhostscriptGUI:
         self.toggles = []
         self.gs_path, self.cpdf_path, self.pngquant_path, self.jpegoptim_path, self.ect_path, self.oxipng_path = None, None, None, None, None, None
         self.active_process_button = None
+        self.active_button_label = None
         self.tab_frames = {}
         self.drop_zones = {}
         self.progress_queue = queue.Queue()
@@ -1336,7 +1338,7 @@ class GhostscriptGUI:
                 self.compress_settings.preserve_ocr.set(True)
 
         if hasattr(self, 'downsample_threshold_check'): self.downsample_threshold_check.config(state=lossy_state)
-        if hasattr(self, 'detect_duplicate_images_check'): self.detect_duplicate_images_check.config(state=lossy_state)
+        if hasattr(self, 'detect_duplicate_images_check'): self.detect_duplicate_images_check.config(state="disabled" if is_pdfa else "normal")
         if hasattr(self, 'grayscale_check'): self.grayscale_check.config(state=lossy_state)
         if hasattr(self, 'cmyk_check'): self.cmyk_check.config(state=lossy_state)
         if hasattr(self, 'quantize_toggle'):
@@ -1459,12 +1461,17 @@ class GhostscriptGUI:
                     logging.warning(f"{name} not found: {e}")
 
 
-    def start_task(self, button, target_func, args, status_var):
+    def start_task(self, button, target_func, args, status_var, cancel=None):
+        """Runs target_func on a thread; with a cancel token the button turns into a Cancel button meanwhile."""
         if self.active_process_button:
             messagebox.showwarning("Busy", "A process is already running.", parent=self.root)
             return
         self.active_process_button = button
-        button.config(state="disabled")
+        if cancel is None:
+            button.config(state="disabled")
+        else:
+            self.active_button_label = (button.cget('text'), button.cget('command'))
+            button.config(text="CANCEL", command=lambda: self._cancel_task(button, cancel))
 
         self.active_status_var = status_var
         self.active_status_var.set("Starting...")
@@ -1498,8 +1505,17 @@ class GhostscriptGUI:
 
         if self.active_process_button:
             self.active_process_button.config(state="normal")
+            if self.active_button_label:
+                text, command = self.active_button_label
+                self.active_process_button.config(text=text, command=command)
+                self.active_button_label = None
             self.active_process_button = None
 
+    def _cancel_task(self, button, cancel):
+        cancel.cancel()
+        button.config(state="disabled")
+        self.active_status_var.set("Cancelling...")
+
     def _update_preview(self, pdf_path, canvas, page_num=0, rotate_angle=0, page_number_options=None):
         if not pdf_path:
             canvas.delete("all")
@@ -1759,7 +1775,9 @@ class GhostscriptGUI:
             'input_files': self.compress_settings.files
         }
 
-        self.start_task(self.compress_button, backend.run_compress_task, args=(params, "batch", self.progress_queue), status_var=self.compress_progress_status)
+        cancel = CancelToken()
+        self.start_task(self.compress_button, backend.run_compress_task, args=(params, "batch", self.progress_queue, cancel),
+                        status_var=self.compress_progress_status, cancel=cancel)
 
     def process_merge(self):
         s = self.merge_settings
@@ -0,0 +1,116 @@
+# image_cache.py
+import os
+import sys
+import json
+import time
+import logging
+import sqlite3
+import hashlib
+from pathlib import Path
+
+def default_cache_dir():
+    if sys.platform == "win32":
+        base = Path(os.environ.get('LOCALAPPDATA') or Path.home() / "AppData" / "Local")
+    else:
+        base = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / ".cache")
+    return base / "MinimalPDF" / "image_cache"
+
+def _encode_entries(entries):
+    """JSON-encodes stream dictionary entries, tagging bytes values (e.g. palettes) as hex."""
+    def default(value):
+        if isinstance(value, (bytes, bytearray)):
+            return {'$bytes': bytes(value).hex()}
+        raise TypeError(f"Cannot cache entry value of type {type(value).__name__}")
+    return json.dumps(entries, default=default)
+
+def _decode_entries(text):
+    def hook(d):
+        return bytes.fromhex(d['$bytes']) if set(d) == {'$bytes'} else d
+    return json.loads(text, object_hook=hook)
+
+class ImageCache:
+    """Content-addressed store of optimized image streams with LRU eviction.
+
+    A row holds the optimized payload and its dictionary entries (plus an optional
+    SMask), or NULL data when optimization gained nothing, so repeats skip the tools either way.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.cache_dir / "images.sqlite3"), timeout=30)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS images (
+            key TEXT PRIMARY KEY, data BLOB, entries TEXT, smask_data BLOB, smask_entries TEXT,
+            size INTEGER NOT NULL, last_used REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS images_last_used ON images(last_used)")
+        self._db.commit()
+
+    @staticmethod
+    def make_key(raw_bytes, fingerprint, settings):
+        h = hashlib.sha256()
+        h.update(raw_bytes)
+        h.update(json.dumps([fingerprint, settings], sort_keys=True, default=str).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """Returns (found, result); result is None for a cached 'no gain' outcome."""
+        try:
+            row = self._db.execute("SELECT data, entries, smask_data, smask_entries FROM images WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self._db.execute("UPDATE images SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Image cache lookup failed: {e}")
+            self.misses += 1
+            return False, None
+
+        self.hits += 1
+        data, entries, smask_data, smask_entries = row
+        if data is None:
+            return True, None
+        result = {'data': bytes(data), 'entries': _decode_entries(entries), 'smask': None}
+        if smask_data is not None:
+            result['smask'] = {'data': bytes(smask_data), 'entries': _decode_entries(smask_entries)}
+        return True, result
+
+    def put(self, key, result):
+        data = entries = smask_data = smask_entries = None
+        if result:
+            data, entries = result['data'], _encode_entries(result.get('entries', {}))
+            if result.get('smask'):
+                smask_data, smask_entries = result['smask']['data'], _encode_entries(result['smask']['entries'])
+        size = len(key) + len(data or b'') + len(smask_data or b'') + len(entries or '') + len(smask_entries or '')
+        try:
+            self._db.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (key, data, entries, smask_data, smask_entries, size, time.time()))
+            self._db.commit()
+            self._evict()
+        except (sqlite3.Error, TypeError) as e:
+            logging.warning(f"Could not store image in cache: {e}")
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Trim to 90% of the cap so a full cache doesn't evict on every insert.
+        target = int(self.max_bytes * 0.9)
+        doomed = []
+        for key, size in self._db.execute("SELECT key, size FROM images ORDER BY last_used"):
+            if total <= target: break
+            doomed.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM images WHERE key = ?", doomed)
+        self._db.commit()
+        logging.info(f"Image cache evicted {len(doomed)} entries.")
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        try: self._db.close()
+        except sqlite3.Error: pass
@@ -0,0 +1,583 @@
+# image_optimizer.py
+import logging
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+from io import BytesIO
+from pathlib import Path
+from PIL import Image, JpegImagePlugin
+
+# Try to import oxipng, but handle the failure gracefully if DLLs are missing
+HAS_OXIPNG_LIB = False
+try:
+    import oxipng
+    HAS_OXIPNG_LIB = True
+except ImportError:
+    logging.warning("Python 'oxipng' library not found or DLL failed to load. Will attempt to use external executable if available.")
+
+HAS_NUMPY = False
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    logging.warning("Python 'numpy' library not found. Images will not be reduced to fewer channels before optimization.")
+
+from constants import ProcessingError, ProcessingTimeout
+from utils import run_command, tool_timeout
+
+# Bump whenever the output of the pipeline changes so cached results are not reused.
+PIPELINE_VERSION = 8
+
+# Effort levels: 3 runs every tool at full strength, 2 drops ECT and lowers oxipng,
+# 1 is the quickest oxipng pass (fast mode) and 0 leaves the image untouched.
+EFFORT_MAX = 3
+_OXIPNG_LEVELS = {1: 2, 2: 4, 3: 6}
+
+# Target-quality JPEG re-encoding: qualities searched and, per effort level, the width of
+# the quality interval at which the binary search stops.
+_JPEG_QUALITY_RANGE = (20, 95)
+_JPEG_QUALITY_STEP = {1: 8, 2: 4, 3: 2}
+_SSIM_WINDOW = 8
+# YCbCr channel weights for colour SSIM; chroma errors are far less visible than luma.
+_SSIM_WEIGHTS = (0.8, 0.1, 0.1)
+# Quality for downsampled JPEGs when no SSIM target is set (Ghostscript's -dJPEGQ at high DPI).
+_DOWNSAMPLED_JPEG_QUALITY = 85
+# Modes Pillow resamples directly; palette, bilevel and 16-bit images keep their resolution.
+_RESAMPLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK')
+
+# Image jobs only carry picklable data (raw JPEG bytes or a decoded PIL image plus
+# tool settings), so they can run in the main process or in a worker process alike.
+# Results are handed back to PdfOptimizer, which writes them into the pikepdf objects.
+# Payloads stay in memory between tools; temp files are only used for tools without
+# stdin/stdout support (ECT, the oxipng executable) or when a pipe fails.
+
+def job_effort(opts):
+    """Effort allowed for work starting now, lowered as the time budget's deadline approaches."""
+    effort, deadline = opts['effort'], opts.get('deadline')
+    if deadline is None:
+        return effort
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        return 0
+    share = remaining / opts['budget'] if opts.get('budget') else 1.0
+    if share < 0.25:
+        return min(effort, 1)
+    if share < 0.5:
+        return min(effort, 2)
+    return effort
+
+@contextmanager
+def _timed(opts, tool):
+    """Adds the time spent in a tool to the job's 'timings' dict, if it has one."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = opts.get('timings')
+        if timings is not None:
+            timings[tool] = timings.get(tool, 0.0) + time.perf_counter() - started
+
+def _seconds_left(opts):
+    """Whole seconds (at least 1) before the deadline, for tools that stop early with their best result."""
+    if opts.get('deadline') is None:
+        return None
+    return max(1, int(opts['deadline'] - time.time()))
+
+def _limits(opts, cmd):
+    """run_command arguments for the job's tool timeouts, document deadline and cancellation token."""
+    return {'timeout': tool_timeout(cmd, opts.get('tool_timeouts'), opts.get('document_deadline')),
+            'cancel': opts.get('cancel')}
+
+def _run_piped(cmd, data, name, tool, opts):
+    """Runs a tool over stdin/stdout; returns its output bytes, or None if the pipe route failed."""
+    try:
+        result = run_command(cmd, check=False, input_data=data, **_limits(opts, cmd))
+    except ProcessingTimeout:
+        raise  # The temp file route would only time out again
+    except Exception as e:
+        logging.info(f"{tool} pipe failed for image {name}, falling back to temp files: {e}")
+        return None
+    if result.returncode == 0 and result.stdout:
+        return result.stdout
+    if result.returncode not in (0, 98, 99):
+        logging.info(f"{tool} pipe failed for image {name} ({result.returncode}), falling back to temp files: {result.stderr.strip()}")
+        return None
+    return b''
+
+def _run_on_temp_file(cmd_for_path, data, path, opts):
+    """Temp-file fallback for tools that only work in place on a file."""
+    path.write_bytes(data)
+    try:
+        cmd = cmd_for_path(path)
+        result = run_command(cmd, check=False, **_limits(opts, cmd))
+        return result, (path.read_bytes() if path.exists() else b'')
+    finally:
+        if path.exists(): path.unlink()
+
+def _block_stats(x, y):
+    """Means, variances and covariance of x and y over non-overlapping 8x8 blocks."""
+    h, w = (x.shape[0] // _SSIM_WINDOW) * _SSIM_WINDOW, (x.shape[1] // _SSIM_WINDOW) * _SSIM_WINDOW
+    def blocks(a):
+        return a[:h, :w].reshape(h // _SSIM_WINDOW, _SSIM_WINDOW, w // _SSIM_WINDOW, _SSIM_WINDOW).swapaxes(1, 2).reshape(-1, _SSIM_WINDOW * _SSIM_WINDOW)
+    bx, by = blocks(x), blocks(y)
+    mx, my = bx.mean(axis=1), by.mean(axis=1)
+    return mx, my, bx.var(axis=1), by.var(axis=1), ((bx - mx[:, None]) * (by - my[:, None])).mean(axis=1)
+
+def _ssim_channel(x, y):
+    if x.shape[0] < _SSIM_WINDOW or x.shape[1] < _SSIM_WINDOW:
+        return 1.0 if np.array_equal(x, y) else 0.0
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mx, my, vx, vy, cov = _block_stats(x, y)
+    return float((((2 * mx * my + c1) * (2 * cov + c2)) / ((mx * mx + my * my + c1) * (vx + vy + c2))).mean())
+
+def ssim(a, b):
+    """Mean structural similarity (0..1) of two same-size L or RGB images.
+
+    Windows are the 8x8 blocks JPEG itself codes, so blocking artifacts weigh fully.
+    Colour images are compared in YCbCr, weighted towards luma.
+    """
+    if a.mode == 'RGB':
+        pairs, weights = zip(a.convert('YCbCr').split(), b.convert('YCbCr').split()), _SSIM_WEIGHTS
+    else:
+        pairs, weights = [(a.convert('L'), b.convert('L'))], (1.0,)
+    return sum(w * _ssim_channel(np.asarray(x, dtype=np.float32), np.asarray(y, dtype=np.float32))
+               for w, (x, y) in zip(weights, pairs))
+
+def _resample(image, size):
+    """Downsamples to size: reduce() takes out the integer part of the factor with a box filter, a Lanczos resize the rest."""
+    factor = min(image.width // size[0], image.height // size[1])
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image if image.size == tuple(size) else image.resize(tuple(size), Image.LANCZOS)
+
+def _encode_jpeg(image, quality, subsampling, final=False):
+    buffer = BytesIO()
+    # Entropy coding options don't change the pixels, so only the kept encode pays for them.
+    image.save(buffer, 'JPEG', quality=quality, subsampling=subsampling, optimize=final, progressive=final)
+    return buffer.getvalue()
+
+def _search_jpeg_quality(image, target, effort, subsampling):
+    """Smallest Pillow encode of image whose SSIM against it reaches target, or None.
+
+    Binary-searches the quality setting.
+    """
+    def passes(quality):
+        return ssim(image, Image.open(BytesIO(_encode_jpeg(image, quality, subsampling)))) >= target
+
+    lo, hi = _JPEG_QUALITY_RANGE
+    step = _JPEG_QUALITY_STEP.get(effort, _JPEG_QUALITY_STEP[EFFORT_MAX])
+    best = None
+    while hi - lo > step:
+        mid = (lo + hi) // 2
+        if passes(mid):
+            best, hi = mid, mid
+        else:
+            lo = mid
+    if best is None and passes(hi):
+        best = hi
+    return _encode_jpeg(image, best, subsampling, final=True) if best is not None else None
+
+def _open_jpeg(data):
+    """Opens a JPEG for re-encoding; returns (image, subsampling) or (None, None) for CMYK and other modes."""
+    image = Image.open(BytesIO(data))
+    if image.mode not in ('L', 'RGB'):
+        return None, None  # CMYK JPEGs carry Adobe inversion conventions Pillow would not write back
+    return image, (JpegImagePlugin.get_sampling(image) if image.mode == 'RGB' else -1)
+
+def _reencode_jpeg(data, target, effort):
+    """Smallest Pillow re-encode whose SSIM against the original reaches target, or None.
+
+    The original's chroma subsampling is kept.
+    """
+    original, subsampling = _open_jpeg(data)
+    if original is None:
+        return None
+    original.load()
+    return _search_jpeg_quality(original, target, effort, subsampling)
+
+def _downsample_jpeg(data, size, opts):
+    """Decodes a JPEG at size and encodes it again, or returns None.
+
+    libjpeg's draft mode does the power-of-two part of the scaling while decoding. With an
+    SSIM target the encode is measured against the resampled image, not the original.
+    """
+    image, subsampling = _open_jpeg(data)
+    if image is None:
+        return None
+    image.draft(image.mode, tuple(size))
+    image = _resample(image, size)
+    if opts.get('jpeg_ssim_target') and HAS_NUMPY:
+        return _search_jpeg_quality(image, opts['jpeg_ssim_target'], opts['effort'], subsampling)
+    return _encode_jpeg(image, _DOWNSAMPLED_JPEG_QUALITY, subsampling, final=True)
+
+def _optimize_jpeg(job, opts, temp_dir):
+    name = job['name']
+    data = job['payload']
+
+    optimized = False
+    entries = {'/Filter': '/DCTDecode'}
+    if job.get('target_size') and job.get('reencode'):
+        with _timed(opts, 'resample'):
+            try:
+                resampled = _downsample_jpeg(data, job['target_size'], opts)
+            except Exception as e:
+                logging.info(f"Could not downsample JPEG {name}: {e}")
+                resampled = None
+        if resampled and len(resampled) < len(data):
+            data = resampled
+            entries.update({'/Width': job['target_size'][0], '/Height': job['target_size'][1]})
+            optimized = True
+    elif opts.get('jpeg_ssim_target') and job.get('reencode') and HAS_NUMPY:
+        with _timed(opts, 'jpeg_ssim'):
+            try:
+                reencoded = _reencode_jpeg(data, opts['jpeg_ssim_target'], opts['effort'])
+            except Exception as e:
+                logging.info(f"Could not re-encode JPEG {name} to a target quality: {e}")
+                reencoded = None
+        if reencoded and len(reencoded) < len(data):
+            data = reencoded
+            optimized = True
+
+    # A tool that times out is skipped; the image keeps what the steps before it achieved.
+    if opts['jpegoptim_path']:
+        base_cmd = [opts['jpegoptim_path'], "--strip-all", "-q"]
+        try:
+            with _timed(opts, 'jpegoptim'):
+                piped = _run_piped(base_cmd + ["--stdin", "--stdout"], data, name, "jpegoptim", opts)
+                if piped is None:
+                    result, piped = _run_on_temp_file(lambda p: base_cmd + [str(p)], data, temp_dir / f"img_{name}.jpg", opts)
+                    if result.returncode != 0:
+                        raise ProcessingError(f"jpegoptim failed: {result.stderr.strip()}")
+            if piped and len(piped) < len(data):
+                data = piped
+            optimized = True
+        except ProcessingTimeout as e:
+            logging.info(f"Skipped jpegoptim for image {name}: {e}")
+
+    # ECT has no stdin/stdout mode, so it always works on a temp file.
+    if opts['ect_path'] and job_effort(opts) >= EFFORT_MAX:
+        try:
+            with _timed(opts, 'ect'):
+                result, ect_bytes = _run_on_temp_file(lambda p: [opts['ect_path'], "-quiet", "-strip", "-progressive", "-3", str(p)], data, temp_dir / f"img_{name}.jpg", opts)
+            if result.returncode != 0:
+                raise ProcessingError(f"ECT failed: {result.stderr.strip()}")
+            if ect_bytes and len(ect_bytes) < len(data):
+                data = ect_bytes
+            optimized = True
+        except ProcessingTimeout as e:
+            logging.info(f"Skipped ECT for image {name}: {e}")
+
+    if optimized and 0 < len(data) < job['original_size']:
+        return {'data': data, 'entries': entries, 'smask': None}
+    return None
+
+def _encode_png(image, **params):
+    buffer = BytesIO()
+    image.save(buffer, "png", **params)
+    return buffer.getvalue()
+
+def _oxipng_color_type(image):
+    if image.mode == 'RGB': return oxipng.ColorType.rgb()
+    if image.mode == 'RGBA': return oxipng.ColorType.rgba()
+    if image.mode in ('L', '1'): return oxipng.ColorType.grayscale()
+    if image.mode == 'LA': return oxipng.ColorType.grayscale_alpha()
+    return None
+
+def _oxipng_raw_image(image):
+    """Wraps a PIL image's pixels for oxipng, or returns None for modes it can't take raw."""
+    color_type = _oxipng_color_type(image)
+    if color_type is None:
+        return None
+    # Mode '1' rows are packed 1 bit per pixel, padded to a byte, just like a 1-bit PNG.
+    return oxipng.RawImage(image.tobytes(), image.width, image.height, color_type=color_type,
+                           bit_depth=1 if image.mode == '1' else 8)
+
+def reduce_channels(image):
+    """Losslessly drops what a decoded image doesn't use: an opaque alpha channel, colour
+    in a gray image, gray levels in a black-and-white one and the low byte of 16-bit gray
+    samples that are exact 8-bit values."""
+    if not HAS_NUMPY:
+        return image
+    if image.mode in ('RGBA', 'LA') and np.asarray(image.getchannel('A')).min() == 255:
+        image = image.convert(image.mode[:-1])
+    if image.mode == 'I;16':
+        samples = np.asarray(image)
+        if np.all(samples % 257 == 0):
+            image = Image.fromarray((samples // 257).astype(np.uint8), 'L')
+    if image.mode in ('RGB', 'RGBA'):
+        pixels = np.asarray(image)
+        if np.array_equal(pixels[..., 0], pixels[..., 1]) and np.array_equal(pixels[..., 1], pixels[..., 2]):
+            image = image.convert('L' if image.mode == 'RGB' else 'LA')
+    if image.mode == 'L':
+        pixels = np.asarray(image)
+        if np.all((pixels == 0) | (pixels == 255)):
+            image = image.convert('1')
+    return image
+
+def exact_8bit_image(samples, size, mode):
+    """Builds an 8-bit image from big-endian 16-bit samples when every sample is an exact
+    8-bit value (v * 257); returns None when the low bytes carry real precision."""
+    if not HAS_NUMPY:
+        return None
+    values = np.frombuffer(samples, dtype='>u2')
+    if not np.all(values % 257 == 0):
+        return None
+    return Image.frombytes(mode, size, (values // 257).astype(np.uint8).tobytes())
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# PNG colour type -> (samples per pixel, PDF colour space) for types a PDF image can take verbatim.
+_PNG_COLOR_SPACES = {0: (1, '/DeviceGray'), 2: (3, '/DeviceRGB')}
+
+def _parse_png(png_bytes):
+    """Reads the IHDR fields, PLTE, tRNS and the concatenated IDAT payload of a PNG."""
+    if not png_bytes.startswith(_PNG_SIGNATURE):
+        raise ValueError("Not a PNG stream.")
+    png, idat, pos = {}, bytearray(), len(_PNG_SIGNATURE)
+    while pos + 8 <= len(png_bytes):
+        length, chunk_type = struct.unpack('>I4s', png_bytes[pos:pos + 8])
+        body = png_bytes[pos + 8:pos + 8 + length]
+        if chunk_type == b'IHDR':
+            width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', body)
+            png.update(width=width, height=height, bit_depth=bit_depth, color_type=color_type, interlace=interlace)
+        elif chunk_type == b'PLTE':
+            png['palette'] = body
+        elif chunk_type == b'tRNS':
+            png['trns'] = body
+        elif chunk_type == b'IDAT':
+            idat += body
+        elif chunk_type == b'IEND':
+            break
+        pos += length + 12
+    png['idat'] = bytes(idat)
+    return png
+
+def _predictor_stream(png, color_space=None):
+    """Turns a non-interlaced gray/RGB PNG into PDF stream data and entries without recompressing.
+
+    IDAT is a zlib stream of PNG-filtered rows, which is exactly what /FlateDecode with
+    /Predictor 15 decodes, so oxipng's filter choices and deflate effort are kept.
+    """
+    colors, default_space = _PNG_COLOR_SPACES.get(png['color_type'], (1, None))
+    bpc = png['bit_depth']
+    entries = {
+        '/Filter': '/FlateDecode', '/ColorSpace': color_space or default_space, '/BitsPerComponent': bpc,
+        '/Width': png['width'], '/Height': png['height'],
+        '/DecodeParms': {'/Predictor': 15, '/Colors': colors, '/BitsPerComponent': bpc, '/Columns': png['width']},
+    }
+    if 'trns' in png and png['color_type'] in _PNG_COLOR_SPACES:
+        # A single transparent colour becomes a colour-key mask.
+        key = struct.unpack(f'>{colors}H', png['trns'][:2 * colors])
+        entries['/Mask'] = [v for value in key for v in (value, value)]
+    return {'data': png['idat'], 'entries': entries}
+
+def _indexed_streams(png, png_bytes, opts):
+    """Keeps a palette PNG as an /Indexed image at its own bit depth instead of expanding it to RGB.
+
+    Palette transparency becomes a /Mask index range when the transparent entries are
+    fully transparent and contiguous, and an SMask otherwise.
+    """
+    palette = png['palette']
+    entry_count = len(palette) // 3
+    alphas = list(png.get('trns', b''))[:entry_count]
+    alphas += [255] * (entry_count - len(alphas))
+
+    result = {**_predictor_stream(png, color_space=['/Indexed', '/DeviceRGB', entry_count - 1, palette]), 'smask': None}
+    transparent = [i for i, a in enumerate(alphas) if a != 255]
+    if not transparent:
+        return result
+    if all(alphas[i] == 0 for i in transparent) and transparent[-1] - transparent[0] + 1 == len(transparent):
+        result['entries']['/Mask'] = [transparent[0], transparent[-1]]
+        return result
+
+    with Image.open(BytesIO(png_bytes)) as image:
+        # Pillow unpacks 1/2/4-bit palette PNGs to one index per byte.
+        indices = Image.frombytes('L', image.size, image.tobytes())
+    alpha_image = indices.point(alphas + [255] * (256 - entry_count))
+    result['smask'] = _predictor_stream(_parse_png(_png_for_stream(reduce_channels(alpha_image), opts)))
+    return result
+
+def _png_for_stream(image, opts):
+    """Deflates an RGB, L or 1 image as a non-interlaced PNG, keeping its colour type and depth."""
+    if HAS_OXIPNG_LIB:
+        raw = _oxipng_raw_image(image)
+        options = {"level": _OXIPNG_LEVELS[max(1, opts['effort'])]}
+        if _seconds_left(opts) is not None:
+            options["timeout"] = _seconds_left(opts)
+        with _timed(opts, 'oxipng'):
+            return raw.create_optimized_png(interlace=None, color_type_reduction=False, grayscale_reduction=False,
+                                            palette_reduction=False, bit_depth_reduction=False, **options)
+    with _timed(opts, 'pillow'):
+        return _encode_png(image, compress_level=9)
+
+def _streams_from_image(image, opts):
+    """Builds the image stream, plus an SMask from any alpha channel, from a decoded image."""
+    if image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    alpha_image = None
+    if 'A' in image.mode:
+        if image.mode not in ('RGBA', 'LA'):
+            image = image.convert('RGBA')
+        alpha_image = image.getchannel('A')
+        # The SMask does the blending, so colour stays unpremultiplied; only pixels that are
+        # fully transparent, whose colour never shows, are blanked to white to compress better.
+        base_mode = image.mode[:-1]
+        image = image.convert(base_mode)
+        image.paste(255 if base_mode == 'L' else (255, 255, 255), mask=alpha_image.point(lambda a: 255 if a == 0 else 0))
+    elif image.mode not in ('RGB', 'L', '1'):
+        image = image.convert('RGB')
+
+    result = {**_predictor_stream(_parse_png(_png_for_stream(reduce_channels(image), opts))), 'smask': None}
+    if alpha_image is not None:
+        # An SMask has to stay DeviceGray, so the alpha plane only drops to 1 bit when it is binary.
+        result['smask'] = _predictor_stream(_parse_png(_png_for_stream(reduce_channels(alpha_image), opts)))
+    return result
+
+def _quantize(png_bytes, name, dpi, opts, temp_dir):
+    quality_str = "80-95"
+    if dpi <= 100:
+        quality_str = "40-60"
+    elif dpi <= 200:
+        quality_str = "65-80"
+    base_cmd = [opts['pngquant_path'], "--force", "--skip-if-larger", f"--quality={quality_str}"]
+
+    try:
+        quantized = _run_piped(base_cmd + ["256", "-"], png_bytes, name, "pngquant", opts)
+    except ProcessingTimeout as e:
+        logging.info(f"Skipped pngquant for image {name}: {e}")
+        return None
+    if quantized is not None:
+        return quantized or None
+
+    source_path, quant_path = temp_dir / f"img_{name}.png", temp_dir / f"img_{name}.quant.png"
+    source_path.write_bytes(png_bytes)
+    try:
+        cmd = base_cmd + ["--output", str(quant_path), "256", str(source_path)]
+        result = run_command(cmd, check=False, **_limits(opts, cmd))
+        if result and result.returncode == 0 and quant_path.exists() and quant_path.stat().st_size > 0:
+            return quant_path.read_bytes()
+        elif result and result.returncode != 0 and result.returncode != 99:
+             logging.warning(f"Pngquant failed for image {name}: {result.stderr.strip()}")
+    finally:
+        for path in (source_path, quant_path):
+            if path.exists(): path.unlink()
+    return None
+
+def _optimize_flate(job, opts, temp_dir):
+    name, mode, dpi = job['name'], job['mode'], job['dpi']
+    level = _OXIPNG_LEVELS[opts['effort']]
+    image = job['payload']
+    if job.get('target_size') and image.mode in _RESAMPLE_MODES:
+        with _timed(opts, 'resample'):
+            image = _resample(image, job['target_size'])
+    with _timed(opts, 'channel_analysis'):
+        image = reduce_channels(image)
+
+    # Soft masks must stay DeviceGray, so they are never quantized or turned into palettes.
+    is_smask = job.get('smask', False)
+    if is_smask and image.mode not in ('1', 'L', 'I;16'):
+        image = image.convert('L')
+
+    png_bytes = None
+    if mode == 'lossy' and opts['pngquant_path'] and not is_smask:
+        with _timed(opts, 'pngquant'):
+            png_bytes = _quantize(_encode_png(image), name, dpi, opts, temp_dir)
+
+    # Oxipng Optimization (Library or Executable). The library takes raw pixels or PNG
+    # bytes straight from memory; only the executable needs files on disk.
+    try:
+        if HAS_OXIPNG_LIB:
+            options = {"level": level, "strip": oxipng.StripChunks.all()}
+            if mode == 'lossy':
+                options["optimize_alpha"] = True
+                options["scale_16"] = True
+            if _seconds_left(opts) is not None:
+                options["timeout"] = _seconds_left(opts)
+            if is_smask:
+                options.update(color_type_reduction=False, palette_reduction=False)
+            raw = _oxipng_raw_image(image) if png_bytes is None else None
+            with _timed(opts, 'oxipng'):
+                if raw is not None:
+                    png_bytes = raw.create_optimized_png(**options)
+                else:
+                    png_bytes = oxipng.optimize_from_memory(png_bytes or _encode_png(image), **options)
+        elif opts['oxipng_path']:
+            # Fallback to executable
+            source = png_bytes or _encode_png(image)
+            source_path, out_path = temp_dir / f"img_{name}.png", temp_dir / f"img_{name}.oxipng.png"
+            source_path.write_bytes(source)
+            try:
+                cmd_oxipng = [opts['oxipng_path'], "-o", str(level), "--strip", "all", str(source_path), "--out", str(out_path)]
+                if _seconds_left(opts) is not None:
+                    cmd_oxipng[1:1] = ["--timeout", str(_seconds_left(opts))]
+                if is_smask:
+                    cmd_oxipng[1:1] = ["--nc", "--np"]
+                with _timed(opts, 'oxipng'):
+                    run_command(cmd_oxipng, check=False, **_limits(opts, cmd_oxipng))
+                png_bytes = out_path.read_bytes() if out_path.exists() and out_path.stat().st_size > 0 else source
+            finally:
+                for path in (source_path, out_path):
+                    if path.exists(): path.unlink()
+    except Exception as e:
+        logging.warning(f"Could not process PNG with oxipng for {name}: {e}")
+
+    if png_bytes is None:
+        png_bytes = _encode_png(image)
+
+    # A pass that has already run is kept; ECT only starts if the budget still allows full effort.
+    if opts['ect_path'] and job_effort(opts) >= EFFORT_MAX:
+        try:
+            with _timed(opts, 'ect'):
+                result_ect, ect_bytes = _run_on_temp_file(lambda p: [opts['ect_path'], "-S2", "-strip", "-quiet", str(p)], png_bytes, temp_dir / f"img_{name}.ect.png", opts)
+            if result_ect and result_ect.returncode == 0 and ect_bytes and len(ect_bytes) < len(png_bytes):
+                png_bytes = ect_bytes
+            elif result_ect and result_ect.returncode != 0:
+                logging.warning(f"ECT failed for image {name}: {result_ect.stderr.strip()}")
+        except ProcessingTimeout as e:
+            logging.info(f"Skipped ECT for image {name}: {e}")
+
+    png = _parse_png(png_bytes)
+    if is_smask and (png['interlace'] != 0 or png['color_type'] != 0):
+        result = {**_predictor_stream(_parse_png(_png_for_stream(reduce_channels(image), opts))), 'smask': None}
+    elif png['interlace'] == 0 and png['color_type'] == 3:
+        result = _indexed_streams(png, png_bytes, opts)
+    elif png['interlace'] == 0 and png['color_type'] in _PNG_COLOR_SPACES:
+        result = {**_predictor_stream(png), 'smask': None}
+    else:
+        # Alpha and interlaced PNGs have to be rearranged before they map onto a PDF image.
+        result = _streams_from_image(Image.open(BytesIO(png_bytes)), opts)
+
+    if result_size(result) >= job['original_size']:
+        return None
+    return result
+
+def result_size(result):
+    return len(result['data']) + (len(result['smask']['data']) if result.get('smask') else 0)
+
+def process_image_job(job, opts, temp_dir=None, timings=None):
+    """Runs the external tool chain for one image job.
+
+    Returns None when nothing smaller was found, {'error': ...} when the chain failed,
+    otherwise a dict with the new stream 'data', its dictionary 'entries' (names as
+    '/Name' strings) and an optional 'smask' of the same shape. The effort level is fixed
+    when the job starts, from opts['effort'] and the time left before opts['deadline'].
+    Seconds spent per tool are added to 'timings' when a dict is passed. Tools are held to
+    opts['tool_timeouts'] and opts['document_deadline'], and opts['cancel'] stops the job.
+    """
+    try:
+        if temp_dir is None:
+            with tempfile.TemporaryDirectory() as own_temp_dir:
+                return process_image_job(job, opts, Path(own_temp_dir), timings)
+        if opts.get('cancel') is not None:
+            opts['cancel'].raise_if_cancelled()
+        opts = {**opts, 'effort': job_effort(opts), 'timings': timings}
+        if opts['effort'] == 0:
+            logging.info(f"Time budget exhausted, leaving image {job['name']} as it is.")
+            return None
+        if job['kind'] == 'jpeg':
+            return _optimize_jpeg(job, opts, Path(temp_dir))
+        return _optimize_flate(job, opts, Path(temp_dir))
+    except Exception as e:
+        logging.warning(f"Could not process image stream {job['name']}: {e}", exc_info=True)
+        return {'error': str(e)}
@@ -0,0 +1,77 @@
+# journal.py
+import json
+import time
+import logging
+import sqlite3
+import hashlib
+from pathlib import Path
+
+JOURNAL_NAME = ".minimalpdf-journal.sqlite3"
+
+# Params that change how a batch runs but not what it writes, so they don't invalidate entries.
+_RUN_ONLY_PARAMS = ('input_files', 'output_path', 'journal', 'max_workers', 'image_workers', 'gs_workers',
+                    'image_cache', 'image_cache_dir', 'image_cache_max_mb', 'gs_library', 'memory_budget_mb',
+                    'schedule')
+
+def file_digest(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+def settings_fingerprint(params):
+    """Hash of the compress params that affect the output."""
+    relevant = {key: value for key, value in params.items() if key not in _RUN_ONLY_PARAMS}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+class BatchJournal:
+    """Record of finished files kept in a batch's output folder, so a rerun can resume.
+
+    An entry matches when the input's content hash, the settings fingerprint and the output
+    name are unchanged and that output (if any) still exists; failed files never match.
+    """
+
+    def __init__(self, output_path, params):
+        self.output_path = Path(output_path)
+        self.settings = settings_fingerprint(params)
+        self._db = sqlite3.connect(str(self.output_path / JOURNAL_NAME), timeout=30)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS files (
+            input TEXT PRIMARY KEY, content_hash TEXT NOT NULL, settings TEXT NOT NULL, status TEXT NOT NULL,
+            output TEXT, bytes_in INTEGER, bytes_out INTEGER, error TEXT, finished REAL NOT NULL)""")
+        self._db.commit()
+
+    def lookup(self, input_file, content_hash, output_file):
+        """The finished outcome recorded for input_file, or None when it has to be (re)processed."""
+        try:
+            row = self._db.execute("SELECT content_hash, settings, status, output, bytes_in, bytes_out FROM files WHERE input = ?",
+                                   (str(Path(input_file).resolve()),)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Journal lookup failed: {e}")
+            return None
+        if row is None:
+            return None
+        recorded_hash, settings, status, output, bytes_in, bytes_out = row
+        if recorded_hash != content_hash or settings != self.settings or status == 'error':
+            return None
+        if status == 'done' and (output != Path(output_file).name or not (self.output_path / output).is_file()):
+            return None
+        return {'size': bytes_out, 'output': output, 'skipped': status == 'skipped', 'bytes_in': bytes_in}
+
+    def record(self, input_file, content_hash, bytes_in, outcome):
+        """Stores a file's outcome as returned by the batch; committed at once so a crash loses nothing."""
+        if 'error' in outcome or 'fallback' in outcome:
+            status = 'error'  # A copied original failed too, so a resumed batch retries it
+        else:
+            status = 'skipped' if outcome['skipped'] else 'done'
+        try:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (str(Path(input_file).resolve()), content_hash, self.settings, status, outcome.get('output'),
+                              bytes_in, outcome.get('size'), outcome.get('error') or outcome.get('fallback'), time.time()))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logging.warning(f"Could not record {Path(input_file).name} in the journal: {e}")
+
+    def close(self):
+        try: self._db.close()
+        except sqlite3.Error: pass
@@ -1,6 +1,7 @@
 # main.py
 import sys
 import ctypes
+import multiprocessing
 import tkinter as tk
 import logging
 from pathlib import Path
@@ -24,6 +25,7 @@ def set_dpi_awareness():
                 logging.warning(f"Failed to set DPI awareness: {e}")
 
 def main():
+    multiprocessing.freeze_support()
     setup_logging()
     set_dpi_awareness()
     try:
@@ -0,0 +1,170 @@
+# memory.py
+import os
+import sys
+import logging
+import pikepdf
+
+from pdf_optimizer import image_decoded_size
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+
+# Peak memory model, fitted on the pikepdf and Ghostscript passes: a worker's baseline
+# (interpreter and imports), the document held by pikepdf and written back out, per-page
+# structures, the largest decoded image, which exists several times over while
+# as_pil_image, the image tools and the re-encode hold it at once, and a share of all the
+# decoded images (more when Ghostscript keeps them in its own process).
+_BASE_BYTES = 60 * MB
+_FILE_FACTOR = 2.0
+_PAGE_BYTES = 64 * 1024
+_LARGEST_IMAGE_FACTOR = 5.0
+_ALL_IMAGES_FACTOR = 0.1
+_GS_IMAGE_FACTOR = 0.1
+_GS_MODES = ('Compression', 'PDF/A')
+
+def decoded_image_bytes(pdf):
+    """(total, largest) size in bytes of the image XObjects once decoded, from their dictionaries only."""
+    total = largest = 0
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Stream) or obj.get('/Subtype') != '/Image':
+            continue
+        try:
+            size = image_decoded_size(obj)
+        except Exception:
+            continue
+        total += size
+        largest = max(largest, size)
+    return total, largest
+
+def estimate_peak_memory(path, params):
+    """Estimated peak resident memory in bytes of compressing the file at path with params.
+
+    Reads only the xref and object dictionaries, not stream data. A file pikepdf can't
+    open is estimated from its size alone.
+    """
+    file_bytes = os.path.getsize(path)
+    pages = total_images = largest_image = 0
+    try:
+        with pikepdf.open(path) as pdf:
+            pages = len(pdf.pages)
+            total_images, largest_image = decoded_image_bytes(pdf)
+    except Exception as e:
+        logging.info(f"Memory estimate for {os.path.basename(path)} from its size only: {e}")
+    image_workers = params.get('image_workers', 1) or (os.cpu_count() or 1)
+    estimate = (_BASE_BYTES + _FILE_FACTOR * file_bytes + _PAGE_BYTES * pages
+                + _LARGEST_IMAGE_FACTOR * largest_image * min(image_workers, 4) + _ALL_IMAGES_FACTOR * total_images)
+    if params.get('mode') in _GS_MODES:
+        estimate += _GS_IMAGE_FACTOR * total_images
+    return int(estimate)
+
+def memory_budget(params):
+    """The batch's RAM budget in bytes from params['memory_budget_mb'] (0: 80% of the memory available now), or None."""
+    budget_mb = params.get('memory_budget_mb')
+    if budget_mb is None:
+        return None
+    if budget_mb > 0:
+        return int(budget_mb * MB)
+    available = available_memory()
+    return int(available * 0.8) if available else None
+
+def available_memory():
+    """Memory available to new work in bytes, or None where it can't be read."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def _children_peak():
+    # ru_maxrss is the largest of all waited-for children (Ghostscript, the image tools); kilobytes on Linux.
+    maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+class PeakRss:
+    """Observed peak RSS of the code run inside the block, this process and its tool subprocesses.
+
+    On Linux the process's high-water mark is reset on entry, so it is exact for the block;
+    elsewhere it is the process's lifetime peak. None where it can't be measured (Windows).
+    """
+
+    def __enter__(self):
+        self.peak = None
+        self._reset = False
+        if resource is None:
+            return self
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')  # Resets VmHWM
+            self._reset = True
+        except OSError:
+            pass
+        self._children_before = _children_peak()
+        return self
+
+    def __exit__(self, *exc):
+        if resource is None:
+            return False
+        own = None
+        if self._reset:
+            try:
+                with open('/proc/self/status') as f:
+                    own = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM:'))
+            except (OSError, StopIteration):
+                pass
+        if own is None:
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            own = maxrss if sys.platform == 'darwin' else maxrss * 1024
+        children = _children_peak()
+        # The children's figure only says something about this block when one of them set a new record in it.
+        self.peak = max(own, children) if children > self._children_before else own
+        return False
+
+class MemoryAdmission:
+    """Admits batch jobs while their estimated peak memory fits in a budget.
+
+    Jobs start in the order they are offered; when the next one doesn't fit, the ones after
+    it wait too, so a large file isn't overtaken forever. A job larger than the whole
+    budget runs alone.
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.in_use = 0
+        self.running = 0
+
+    def fits(self, estimate):
+        return self.running == 0 or self.in_use + estimate <= self.budget
+
+    def start(self, estimate):
+        self.in_use += estimate
+        self.running += 1
+
+    def finish(self, estimate):
+        self.in_use -= estimate
+        self.running -= 1
+
+def memory_report(records, budget=None):
+    """Lines comparing estimated and observed peak RSS for [(name, estimated, observed or None)]."""
+    lines = [f"{name}: estimated {estimated / MB:.0f} MB, observed "
+             + (f"{observed / MB:.0f} MB ({observed / estimated:.2f}x)" if observed and estimated else "n/a")
+             for name, estimated, observed in records]
+    measured = [(estimated, observed) for _, estimated, observed in records if observed and estimated]
+    if measured:
+        ratios = sorted(observed / estimated for estimated, observed in measured)
+        under = sum(ratio > 1 for ratio in ratios)
+        summary = (f"Memory: observed/estimated peak RSS median {ratios[len(ratios) // 2]:.2f}x, "
+                   f"max {ratios[-1]:.2f}x; {under} of {len(ratios)} files above their estimate")
+        if budget:
+            summary += f" (budget {budget / MB:.0f} MB)"
+        lines.append(summary + ".")
+    return lines
@@ -5,22 +5,122 @@ from pathlib import Path
 import tempfile
 import shutil
 import pikepdf
-from PIL import Image
 from io import BytesIO
 import sys
 import os
+import functools
+import hashlib
+import time
 import zlib
-
-# Try to import oxipng, but handle the failure gracefully if DLLs are missing
-HAS_OXIPNG_LIB = False
-try:
-    import oxipng
-    HAS_OXIPNG_LIB = True
-except ImportError:
-    logging.warning("Python 'oxipng' library not found or DLL failed to load. Will attempt to use external executable if available.")
-
-from constants import ProcessingError
-from utils import resource_path, run_command
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from constants import ProcessingError, ProcessingTimeout
+from utils import resource_path, run_command, tool_timeout
+from gs_engine import run_ghostscript
+from image_optimizer import process_image_job, result_size, exact_8bit_image, PIPELINE_VERSION, HAS_OXIPNG_LIB, EFFORT_MAX
+from image_cache import ImageCache
+from telemetry import DocumentTelemetry, file_size
+from preflight import preflight, DEFAULT_DPI_MARGIN, STRATEGY_SKIP, STRATEGY_PIKEPDF, STRATEGY_GS_PRESET
+from placement import downsample_sizes
+
+# Dictionary entries that affect how an image decodes, and therefore its cache key.
+_IMAGE_DECODE_KEYS = ('/Width', '/Height', '/BitsPerComponent', '/ColorSpace', '/Decode',
+                      '/DecodeParms', '/Filter', '/ImageMask')
+
+# Objects that must stay distinct even when identical: page tree and document structure,
+# annotations and form fields (bound to one page or parent), and optional content groups.
+_UNSHAREABLE_TYPES = {'/Catalog', '/Pages', '/Page', '/Annot', '/Outlines', '/StructTreeRoot',
+                      '/StructElem', '/OCG', '/OCMD', '/Sig', '/ObjStm', '/XRef'}
+_UNSHAREABLE_KEYS = ('/Parent', '/P', '/Kids', '/First', '/Rect', '/FT')
+# Merging objects can make the objects that refer to them identical, so squeeze repeats.
+_SQUEEZE_PASSES = 4
+
+# Ghostscript chunks are at least this many pages; smaller ones lose more to startup than they gain.
+_GS_MIN_CHUNK_PAGES = 16
+
+# Triage estimates: lossless JPEG passes typically win a few percent (re-encoding to a target
+# quality about a fifth), and the PNG tools usually beat a plain zlib probe of the same
+# pixels by about this factor.
+_TRIAGE_JPEG_GAIN = 0.04
+_TRIAGE_JPEG_REENCODE_GAIN = 0.2
+_TRIAGE_FLATE_FACTOR = 0.8
+_TRIAGE_PROBE_BYTES = 256 * 1024
+
+# Samples per pixel of the device and CIE colour spaces; other spaces are read from their array.
+_COMPONENTS = {'/DeviceGray': 1, '/CalGray': 1, '/DeviceRGB': 3, '/CalRGB': 3, '/Lab': 3, '/DeviceCMYK': 4}
+
+def _components(image):
+    cs = image.get('/ColorSpace')
+    if isinstance(cs, pikepdf.Array) and len(cs) > 0:
+        if cs[0] == '/ICCBased':
+            try:
+                return int(cs[1].get('/N', 3))
+            except Exception:
+                return 3
+        if cs[0] in ('/Indexed', '/Separation'):
+            return 1
+        if cs[0] == '/DeviceN':
+            return len(cs[1]) if isinstance(cs[1], pikepdf.Array) else 4
+        cs = cs[0]
+    return _COMPONENTS.get(str(cs), 3)
+
+def image_decoded_size(image):
+    """Size in bytes of an image XObject's samples once decoded, from its dictionary only."""
+    if image.get('/ImageMask', False):
+        bits = 1
+    else:
+        bits = int(image.get('/BitsPerComponent', 8)) * _components(image)
+    return int(image.Width) * int(image.Height) * bits // 8
+
+# Cancellation token of the task an image worker process serves, set by _init_image_worker.
+_image_worker_cancel = None
+
+def _init_image_worker(cancel):
+    global _image_worker_cancel
+    _image_worker_cancel = cancel
+
+def _timed_image_job(job, opts, temp_dir=None):
+    """Runs an image job and returns (result, seconds, per-tool seconds) so pool workers can report their cost."""
+    if _image_worker_cancel is not None:
+        opts = {**opts, 'cancel': _image_worker_cancel}
+    started, timings = time.perf_counter(), {}
+    result = process_image_job(job, opts, temp_dir, timings)
+    return result, time.perf_counter() - started, timings
+
+def _fingerprint(value):
+    """Plain, document-independent description of a PDF value; indirect streams are hashed."""
+    if isinstance(value, pikepdf.Stream):
+        return hashlib.sha256(value.read_raw_bytes()).hexdigest()
+    if isinstance(value, pikepdf.Array):
+        return [_fingerprint(v) for v in value]
+    if isinstance(value, pikepdf.Dictionary):
+        return {str(k): _fingerprint(v) for k, v in value.items()}
+    return None if value is None else str(value)
+
+def _object_fingerprint(value, aliases):
+    """Like _fingerprint, but indirect objects stay references (through aliases, {objgen: objgen}),
+    so cyclic structures can be described."""
+    if isinstance(value, pikepdf.Object) and value.is_indirect:
+        return ('ref', aliases.get(value.objgen, value.objgen))
+    if isinstance(value, pikepdf.Array):
+        return [_object_fingerprint(v, aliases) for v in value]
+    if isinstance(value, pikepdf.Dictionary):
+        return sorted((str(k), _object_fingerprint(v, aliases)) for k, v in value.items())
+    return None if value is None else str(value)
+
+def _to_pdf_object(value):
+    """Converts the plain values used in image job results back into pikepdf objects."""
+    if isinstance(value, str) and value.startswith('/'):
+        return pikepdf.Name(value)
+    if isinstance(value, (bytes, bytearray)):
+        return pikepdf.String(bytes(value))
+    if isinstance(value, (list, tuple)):
+        return pikepdf.Array([_to_pdf_object(v) for v in value])
+    if isinstance(value, dict):
+        return pikepdf.Dictionary({k: _to_pdf_object(v) for k, v in value.items()})
+    return value
 
 class PdfOptimizer:
     _blank_image_data = b'\xff\xff\xff'
@@ -53,34 +153,80 @@ class PdfOptimizer:
         self.quantize_level = kwargs.get('quantize_level', 4)
         self.pdfa_compression = kwargs.get('pdfa_compression', False)
         self.pdfa_dpi = kwargs.get('pdfa_dpi', 300)
-
-
-
-    def _apply_flate_image(self, pdf, obj, rgb_data, width, height, alpha_data=None):
-        """Helper to update a pikepdf stream with Flate compressed image data."""
-        for key in list(obj.keys()): del obj[key]
-        obj.write(rgb_data)
-        obj.update({
-            pikepdf.Name.Type: pikepdf.Name.XObject,
-            pikepdf.Name.Subtype: pikepdf.Name.Image,
-            pikepdf.Name.Filter: pikepdf.Name.FlateDecode,
-            pikepdf.Name.Width: width,
-            pikepdf.Name.Height: height,
-            pikepdf.Name.ColorSpace: pikepdf.Name.DeviceRGB,
-            pikepdf.Name.BitsPerComponent: 8
-        })
-        if alpha_data:
-            smask = pdf.new_stream(alpha_data)
-            smask.update({
-                pikepdf.Name.Type: pikepdf.Name.XObject,
-                pikepdf.Name.Subtype: pikepdf.Name.Image,
-                pikepdf.Name.Filter: pikepdf.Name.FlateDecode,
-                pikepdf.Name.Width: width,
-                pikepdf.Name.Height: height,
-                pikepdf.Name.ColorSpace: pikepdf.Name.DeviceGray,
-                pikepdf.Name.BitsPerComponent: 8
-            })
-            obj.SMask = smask
+        # Run Ghostscript in-process through libgs when the shared library is available; only
+        # in worker processes, as a libgs fault ends the process it runs in.
+        self.gs_library = kwargs.get('gs_library', False)
+        # 1 runs lossy Ghostscript as one process; 0/None splits large documents into a page range per core.
+        self.gs_workers = kwargs.get('gs_workers', 1)
+        # Finish documents with pikepdf in the open session; False keeps the cpdf -squeeze pass.
+        self.native_finalize = kwargs.get('native_finalize', True)
+        # Profile lossy inputs first and skip Ghostscript when it can't pay off.
+        self.preflight = kwargs.get('preflight', False)
+        # SSIM (e.g. 0.98) that JPEGs are re-encoded down to in the pikepdf image pass; None keeps them lossless.
+        self.jpeg_ssim_target = kwargs.get('jpeg_ssim_target')
+        # DPI that images drawn larger than needed are downsampled to in the pikepdf image pass,
+        # judged by their largest placement; None keeps every image's resolution.
+        self.placement_dpi = kwargs.get('placement_dpi')
+        # 1 keeps image optimization serial; 0/None sizes the worker pool to the machine.
+        self.image_workers = kwargs.get('image_workers', 1)
+        self.use_image_cache = kwargs.get('image_cache', False)
+        self.image_cache_dir = kwargs.get('image_cache_dir')
+        self.image_cache_max_mb = kwargs.get('image_cache_max_mb', 512)
+        self._image_cache = None
+        # Skip images whose estimated saving doesn't justify running the external tools.
+        self.image_triage = kwargs.get('image_triage', True)
+        self.triage_min_pixels = kwargs.get('triage_min_pixels', 1024)
+        self.triage_min_gain = kwargs.get('triage_min_gain', 512)
+        self.triage_stats = {'skipped': 0, 'fastest_job_seconds': None}
+        # Effort 1..3 for the image tools (fast mode is 1); time budgets in seconds lower it
+        # per image as the document's or the whole batch's deadline approaches.
+        self.effort = kwargs.get('effort')
+        if self.effort is None:
+            self.effort = 1 if self.fast_mode else EFFORT_MAX
+        elif self.effort not in range(1, EFFORT_MAX + 1):
+            raise ValueError(f"effort must be between 1 and {EFFORT_MAX}, got {self.effort}")
+        self.time_budget = kwargs.get('time_budget')
+        self.batch_time_budget = kwargs.get('batch_time_budget')
+        # Parallel batches hand every worker the same absolute deadline for batch_time_budget.
+        self._batch_deadline = kwargs.get('batch_deadline')
+        self._deadline = None
+        self._budget_window = None
+        # Images used as another image's /SMask in the current pass; they must stay DeviceGray.
+        self._smask_objgens = set()
+        # Target pixel sizes by objgen for the images downsampled in the current pass.
+        self._downsample_sizes = {}
+        # jpeg_ssim_target and placement_dpi change pixels, so only lossy documents apply them.
+        self._lossy_images = False
+        self._telemetry = None
+        # Token that stops the current task and the tools it runs (see utils.CancelToken).
+        self.cancel = kwargs.get('cancel')
+        # Seconds each external tool may run, by executable name ('gs', 'ect'...) with '*' for
+        # any other; a tool that runs over is stopped and the step falls back to the next strategy.
+        self.tool_timeouts = kwargs.get('tool_timeouts') or {}
+        # Seconds a whole document may take before the optimizer gives up on it.
+        self.document_timeout = kwargs.get('document_timeout')
+        self._document_deadline = None
+
+
+
+    def _apply_flate_image(self, pdf, obj, data, entries, smask=None):
+        """Helper to replace a pikepdf image stream with Flate compressed data and its dictionary entries."""
+        new_entries = {key: _to_pdf_object(value) for key, value in entries.items()}
+        smask_obj = None
+        if smask:
+            smask_obj = pdf.make_stream(smask['data'])
+            smask_obj.update({pikepdf.Name.Type: pikepdf.Name.XObject, pikepdf.Name.Subtype: pikepdf.Name.Image})
+            for key, value in smask['entries'].items():
+                smask_obj[key] = _to_pdf_object(value)
+
+        for key in list(obj.keys()):
+            if key != '/Length': del obj[key]
+        obj.write(data)
+        obj.update({pikepdf.Name.Type: pikepdf.Name.XObject, pikepdf.Name.Subtype: pikepdf.Name.Image})
+        for key, value in new_entries.items():
+            obj[key] = value
+        if smask_obj is not None:
+            obj.SMask = smask_obj
 
     def _replace_image_stream(self, obj):
         try:
@@ -88,7 +234,8 @@ class PdfOptimizer:
                 return
 
             essential_keys = {pikepdf.Name.Type, pikepdf.Name.Subtype, pikepdf.Name.Width,
-                            pikepdf.Name.Height, pikepdf.Name.ColorSpace, pikepdf.Name.BitsPerComponent}
+                            pikepdf.Name.Height, pikepdf.Name.ColorSpace, pikepdf.Name.BitsPerComponent,
+                            pikepdf.Name.Length}
             for key in list(obj.keys()):
                 if key not in essential_keys:
                     del obj[key]
@@ -105,165 +252,734 @@ class PdfOptimizer:
         except Exception as e:
             logging.warning(f"Could not replace image {obj.objgen}: {e}")
 
-    def _lossless_optimize_jpeg_stream(self, obj, temp_dir):
-        if not (self.jpegoptim_path or self.ect_path):
+    def _tool_options(self):
+        """Picklable snapshot of the tool settings needed by image jobs."""
+        return {
+            'pngquant_path': self.pngquant_path,
+            'jpegoptim_path': self.jpegoptim_path,
+            'ect_path': self.ect_path,
+            'oxipng_path': self.oxipng_path,
+            'effort': self.effort,
+            'jpeg_ssim_target': self._ssim_target,
+            'deadline': self._deadline,
+            'budget': self._budget_window,
+            'tool_timeouts': self.tool_timeouts,
+            'document_deadline': self._document_deadline,
+        }
+
+    def _limits(self, command):
+        """run_command/run_ghostscript arguments that hold command to its timeout and the cancel token."""
+        self._check_interrupted()
+        return {'timeout': tool_timeout(command, self.tool_timeouts, self._document_deadline), 'cancel': self.cancel}
+
+    def _check_interrupted(self):
+        """Raises TaskCancelled once the task is cancelled, ProcessingTimeout once the document is out of time."""
+        if self.cancel is not None:
+            self.cancel.raise_if_cancelled()
+        if self._document_deadline is not None and time.time() >= self._document_deadline:
+            raise ProcessingTimeout(f"Document time limit of {self.document_timeout:g}s reached.")
+
+    def _start_document(self, input_file, mode):
+        """Starts the telemetry report and sets the image deadline for the document about to be optimized."""
+        self._telemetry = DocumentTelemetry(input_file, mode)
+        self._lossy_images = mode == 'lossy'
+        if not self._lossy_images and mode != 'lossy_preset' and (self.jpeg_ssim_target or self.placement_dpi):
+            logging.info(f"jpeg_ssim_target and placement_dpi only apply to lossy compression; ignored in {mode} mode.")
+        now = time.time()
+        self._document_deadline = now + self.document_timeout if self.document_timeout else None
+        if self.batch_time_budget and self._batch_deadline is None:
+            self._batch_deadline = now + self.batch_time_budget
+        deadlines = [d for d in (now + self.time_budget if self.time_budget else None, self._batch_deadline) if d]
+        self._deadline = min(deadlines) if deadlines else None
+        self._budget_window = self._deadline - now if self._deadline else None
+
+    def _finish_document(self, output_file):
+        """Returns the telemetry report for the document that was just optimized."""
+        report = self._telemetry.report(output_file)
+        stages = ", ".join(f"{st['stage']} {st['wall_seconds']:.2f}s" for st in report['stages'])
+        logging.info(f"Optimized {Path(report['file']).name} in {report['wall_seconds']:.2f}s ({stages}).")
+        return report
+
+    def _stage(self, name, bytes_in=None):
+        """Context manager timing one stage of the current document; yields a record for extra counters."""
+        if self._telemetry is None:
+            return nullcontext({})
+        return self._telemetry.stage(name, bytes_in)
+
+    def _target_size(self, obj):
+        """Pixel size an image is downsampled to in this pass, or None to keep its resolution."""
+        # Colour-key masks match exact sample values, which resampling would blend away.
+        if isinstance(obj.get('/Mask'), pikepdf.Array):
+            return None
+        return self._downsample_sizes.get(obj.objgen)
+
+    @property
+    def _ssim_target(self):
+        """jpeg_ssim_target for the current document, None outside lossy compression."""
+        return self.jpeg_ssim_target if self._lossy_images else None
+
+    def _extract_image_job(self, obj, kind, mode='lossless', dpi=150):
+        """Reads everything an image job needs out of the pikepdf object, or returns None to skip it."""
+        if not isinstance(obj, pikepdf.Stream) or obj.get("/Subtype") != "/Image":
+            return None
+        name = f"{obj.objgen[0]}_{obj.objgen[1]}"
+        target_size = self._target_size(obj)
+
+        if kind == 'jpeg':
+            if not (self.jpegoptim_path or self.ect_path or self._ssim_target or target_size):
+                return None
+            original_data = obj.read_raw_bytes()
+            if len(original_data) == 0:
+                return None
+            # /ColorTransform and friends would not survive a re-encode, so only plain JPEGs are re-encoded.
+            return {'name': name, 'kind': kind, 'payload': original_data, 'original_size': len(original_data),
+                    'reencode': '/DecodeParms' not in obj, 'target_size': target_size}
+
+        if mode == 'lossless':
+            try:
+                color_space = obj.get('/ColorSpace')
+                if color_space == '/DeviceCMYK' or (isinstance(color_space, pikepdf.Array) and color_space[0] == '/ICCBased'):
+                    logging.info(f"Skipping CMYK image {obj.objgen} in lossless mode to preserve it.")
+                    return None
+            except Exception:
+                pass
+
+        original_size = len(obj.read_raw_bytes())
+        if original_size == 0:
+            return None
+
+        try:
+            if obj.get('/BitsPerComponent') == 16 and obj.get('/ColorSpace') == '/DeviceRGB' and '/Decode' not in obj:
+                # Pillow has no 16-bit RGB mode, so pikepdf would silently drop the low bytes.
+                pil_image = exact_8bit_image(obj.read_bytes(), (int(obj.Width), int(obj.Height)), 'RGB')
+                if pil_image is None:
+                    if mode == 'lossless':
+                        logging.info(f"Skipping 16-bit RGB image {obj.objgen} in lossless mode to preserve its precision.")
+                        return None
+                    pil_image = pikepdf.PdfImage(obj).as_pil_image()
+            else:
+                pil_image = pikepdf.PdfImage(obj).as_pil_image()
+        except Exception as e:
+            logging.warning(f"Could not extract image {obj.objgen} for optimization (possibly masked or unsupported format): {e}")
+            return None
+        return {'name': name, 'kind': kind, 'payload': pil_image, 'original_size': original_size, 'mode': mode, 'dpi': dpi,
+                'smask': obj.objgen in self._smask_objgens, 'target_size': target_size}
+
+    def _apply_image_result(self, pdf, obj, kind, original_size, result):
+        """Writes a winning image job result back into its pikepdf object and returns the bytes saved."""
+        if not result or 'error' in result:
             return 0
+        try:
+            saved = original_size - result_size(result)
+            if kind == 'jpeg':
+                obj.write(result['data'])
+                for key, value in result['entries'].items():
+                    obj[key] = _to_pdf_object(value)
+                if '/DecodeParms' in obj:
+                    del obj['/DecodeParms']
+                logging.info(f"Optimized JPEG {obj.objgen}, saved {saved} bytes.")
+                return saved
 
+            self._apply_flate_image(pdf, obj, result['data'], result['entries'], result.get('smask'))
+            logging.info(f"Optimized Flate image {obj.objgen}, saved {saved} bytes.")
+            return saved
+        except Exception as e:
+            logging.warning(f"Could not write optimized image {obj.objgen}: {e}")
+        return 0
+
+    def _drop_opaque_smasks(self, tasks):
+        """Removes /SMask entries whose samples are all fully opaque, along with their own image tasks."""
+        dropped = set()
+        for obj, _ in tasks:
+            smask = obj.get('/SMask')
+            if not isinstance(smask, pikepdf.Stream) or '/Decode' in smask or '/Matte' in smask:
+                continue
+            try:
+                opaque = not smask.read_bytes().strip(b'\xff')
+            except Exception:
+                continue
+            if opaque:
+                del obj['/SMask']
+                dropped.add(smask.objgen)
+                logging.info(f"Removed fully opaque SMask from image {obj.objgen}.")
+        return [(obj, kind) for obj, kind in tasks if obj.objgen not in dropped]
+
+    def _expected_image_gain(self, obj, kind):
+        """Rough bytes an image is expected to save; None when there is no cheap way to tell."""
+        raw_size = len(obj.read_raw_bytes())
+        target_size = self._target_size(obj)
+        if target_size:
+            return int(raw_size * (1 - target_size[0] * target_size[1] / (int(obj.Width) * int(obj.Height))))
+        if kind == 'jpeg':
+            return int(raw_size * (_TRIAGE_JPEG_REENCODE_GAIN if self._ssim_target else _TRIAGE_JPEG_GAIN))
+        filters = obj.get('/Filter')
+        filters = list(filters) if isinstance(filters, pikepdf.Array) else [filters] if filters else []
+        # Only a bounded prefix is inflated, so probing a large scan costs no more than a small image.
+        # A blank top margin makes the prefix compress better than the rest; that overstates the
+        # gain, so the error is towards processing an image rather than skipping it.
         try:
-            original_data = obj.read_raw_bytes()
-            original_size = len(original_data)
-            if original_size == 0:
-                return 0
-
-            tmp = temp_dir / f"img_{obj.objgen}.jpg"
-            tmp.write_bytes(original_data)
-
-            optimized = False
-            if self.jpegoptim_path:
-                cmd = [self.jpegoptim_path, "--strip-all", "-q", str(tmp)]
-                run_command(cmd)
-                optimized = True
-
-            if self.ect_path and tmp.exists() and not self.fast_mode:
-                cmd = [self.ect_path, "-quiet", "-strip", "-progressive", "-3", str(tmp)]
-                run_command(cmd)
-                optimized = True
-
-            if optimized and tmp.exists():
-                new_bytes = tmp.read_bytes()
-                new_size = len(new_bytes)
-                if 0 < new_size < original_size:
-                    obj.write(new_bytes)
-                    obj.Filter = pikepdf.Name.DCTDecode
-                    if '/DecodeParms' in obj:
-                        del obj['/DecodeParms']
-                    logging.info(f"Losslessly optimized JPEG {obj.objgen}, saved {original_size - new_size} bytes.")
-                    return original_size - new_size
+            if filters == ['/FlateDecode']:
+                sample = zlib.decompressobj().decompress(obj.read_raw_bytes(), _TRIAGE_PROBE_BYTES)
+            elif not filters:
+                sample = obj.read_raw_bytes()[:_TRIAGE_PROBE_BYTES]
+            else:
+                return None  # LZW, CCITT, JBIG2 and similar filters can't be probed without decoding the image
+            decoded_size = image_decoded_size(obj)
+        except Exception:
+            return None
+        if not sample or not decoded_size:
+            return 0
+        # Deflate the sample to estimate what the tools will reach on the whole image.
+        ratio = len(zlib.compress(sample, 6)) / len(sample)
+        return int(raw_size - decoded_size * ratio * _TRIAGE_FLATE_FACTOR)
+
+    def _triage_images(self, tasks):
+        """Ranks (obj, kind) tasks by expected gain, largest first, so a time budget goes where it
+        pays most; with image_triage on, tasks below the triage thresholds are dropped."""
+        ranked, skipped = [], 0
+        for obj, kind in tasks:
+            try:
+                pixels = int(obj.get('/Width', 0)) * int(obj.get('/Height', 0))
+                too_small = self.image_triage and pixels < self.triage_min_pixels
+                gain = None if too_small else self._expected_image_gain(obj, kind)
+                if too_small or (self.image_triage and gain is not None and gain < self.triage_min_gain):
+                    skipped += 1
+                    logging.debug(f"Triage skipped image {obj.objgen} ({pixels} px, expected gain {gain}).")
+                    continue
+            except Exception as e:
+                logging.debug(f"Could not triage image {obj.objgen}: {e}")
+                gain = None
+            # Unknown gains rank as if the whole stream could be saved.
+            ranked.append((obj, kind, len(obj.read_raw_bytes()) if gain is None else gain))
+        ranked.sort(key=lambda task: task[2], reverse=True)
+        self.triage_stats['skipped'] += skipped
+        if skipped:
+            logging.info(f"Triage skipped {skipped} of {len(tasks)} images as low-yield.")
+            self._log_status(f"Skipping {skipped} low-yield images...")
+        return [(obj, kind) for obj, kind, _ in ranked]
+
+    def _record_job_time(self, seconds, timings):
+        if self._telemetry is not None:
+            self._telemetry.add_tool_times(timings)
+        fastest = self.triage_stats['fastest_job_seconds']
+        self.triage_stats['fastest_job_seconds'] = seconds if fastest is None else min(fastest, seconds)
+
+    def add_triage_stats(self, stats):
+        """Folds in the triage counts of another optimizer, e.g. one run by a batch worker."""
+        if not stats:
+            return
+        self.triage_stats['skipped'] += stats['skipped']
+        fastest = [t for t in (self.triage_stats['fastest_job_seconds'], stats['fastest_job_seconds']) if t is not None]
+        self.triage_stats['fastest_job_seconds'] = min(fastest) if fastest else None
+
+    def triage_summary(self):
+        """One-line summary of images triaged out so far, or None if there were none."""
+        stats = self.triage_stats
+        if not stats['skipped']:
+            return None
+        summary = f"{stats['skipped']} low-yield image(s) skipped"
+        if stats['fastest_job_seconds'] is not None:
+            # Each skipped image would have cost at least as much as the quickest one that ran.
+            summary += f", saving at least {stats['skipped'] * stats['fastest_job_seconds']:.1f}s"
+        return summary
+
+    def _get_image_cache(self):
+        if self.use_image_cache and self._image_cache is None:
+            try:
+                self._image_cache = ImageCache(self.image_cache_dir, int(self.image_cache_max_mb * 1024 * 1024))
+            except Exception as e:
+                logging.warning(f"Image cache unavailable, continuing without it: {e}")
+                self.use_image_cache = False
+        return self._image_cache
+
+    def _cached_image_result(self, obj, kind, mode, dpi):
+        """Returns (key, found, result) for an image; key is None when caching is off."""
+        cache = self._get_image_cache()
+        if cache is None:
+            return None, False, None
+        tools = [name for name, path in (('pngquant', self.pngquant_path), ('jpegoptim', self.jpegoptim_path),
+                                         ('ect', self.ect_path), ('oxipng', self.oxipng_path)) if path]
+        if HAS_OXIPNG_LIB: tools.append('oxipng-lib')
+        settings = {'pipeline': PIPELINE_VERSION, 'kind': kind, 'mode': mode, 'dpi': dpi,
+                    'effort': self.effort, 'tools': tools, 'smask': obj.objgen in self._smask_objgens,
+                    'jpeg_ssim_target': self._ssim_target if kind == 'jpeg' else None,
+                    'target_size': self._target_size(obj)}
+        fingerprint = {key: _fingerprint(obj.get(key)) for key in _IMAGE_DECODE_KEYS}
+        key = cache.make_key(obj.read_raw_bytes(), fingerprint, settings)
+        found, result = cache.get(key)
+        return key, found, result
+
+    def _store_image_result(self, key, result):
+        # Under a time budget the effort actually used varies, so those results aren't cached.
+        if self._deadline is not None:
+            return
+        if key is not None and self._image_cache is not None and not (result and 'error' in result):
+            self._image_cache.put(key, result)
+
+    def _log_cache_stats(self):
+        if self._image_cache is not None:
+            stats = self._image_cache.stats()
+            logging.info(f"Image cache: {stats['hits']} hits, {stats['misses']} misses.")
+            self._log_status(f"Image cache: {stats['hits']} hits, {stats['misses']} misses")
+
+    def _finish_image_pass(self):
+        self._log_cache_stats()
+        if self._deadline is not None and time.time() > self._deadline:
+            logging.info("Time budget reached; remaining images were kept as they were.")
+            self._log_status("Time budget reached, kept the best results so far")
+
+    def _optimize_single_image(self, pdf, obj, kind, temp_dir, mode='lossless', dpi=150):
+        key, found, result = self._cached_image_result(obj, kind, mode, dpi)
+        if found:
+            return self._apply_image_result(pdf, obj, kind, len(obj.read_raw_bytes()), result)
+        job = self._extract_image_job(obj, kind, mode, dpi)
+        if not job:
+            return 0
+        result, seconds, timings = _timed_image_job(job, {**self._tool_options(), 'cancel': self.cancel}, temp_dir)
+        self._record_job_time(seconds, timings)
+        self._store_image_result(key, result)
+        return self._apply_image_result(pdf, obj, kind, job['original_size'], result)
+
+    def _lossless_optimize_jpeg_stream(self, obj, temp_dir):
+        try:
+            return self._optimize_single_image(None, obj, 'jpeg', temp_dir)
         except Exception as e:
              logging.warning(f"Failed to optimize JPEG stream {obj.objgen}: {e}")
         return 0
 
-
     def _optimize_image_stream(self, pdf, obj, temp_dir, mode='lossless', dpi=150):
         try:
-            if not isinstance(obj, pikepdf.Stream) or obj.get("/Subtype") != "/Image":
-                return 0
-
-            if mode == 'lossless':
-                try:
-                    color_space = obj.get('/ColorSpace')
-                    if color_space == '/DeviceCMYK' or (isinstance(color_space, pikepdf.Array) and color_space[0] == '/ICCBased'):
-                        logging.info(f"Skipping CMYK image {obj.objgen} in lossless mode to preserve it.")
-                        return 0
-                except Exception:
-                    pass
-
-            original_size = len(obj.read_raw_bytes())
-            if original_size == 0:
-                return 0
+            return self._optimize_single_image(pdf, obj, 'flate', temp_dir, mode, dpi)
+        except Exception as e:
+            logging.warning(f"Could not process image stream {obj.objgen}: {e}", exc_info=True)
+        return 0
 
+    def _image_worker_count(self, job_count):
+        workers = self.image_workers if self.image_workers else (os.cpu_count() or 1)
+        return max(1, min(workers, job_count))
+
+    def _optimize_images(self, pdf, temp_dir, tasks, mode='lossless', dpi=150):
+        """Optimizes (obj, kind) image tasks, serially or in a process pool, and returns the total bytes saved."""
+        with self._stage('images') as stage:
+            saved = self._run_image_pass(pdf, temp_dir, tasks, mode, dpi)
+            stage.update(objects=len(tasks), bytes_saved=saved)
+        return saved
+
+    def _placement_sizes(self, pdf):
+        """Target sizes for the images drawn above placement_dpi, from tracing the page content."""
+        if not self.placement_dpi or not self._lossy_images:
+            return {}
+        margin = 1.0 if self.downsample_threshold_enabled else DEFAULT_DPI_MARGIN
+        try:
+            sizes = downsample_sizes(pdf, self.placement_dpi, margin)
+        except Exception as e:
+            logging.warning(f"Could not trace image placements, keeping image resolutions: {e}")
+            return {}
+        # Soft masks are sized independently of the images they mask and are never drawn themselves.
+        sizes = {objgen: size for objgen, size in sizes.items() if objgen not in self._smask_objgens}
+        if sizes:
+            self._log_status(f"Downsampling {len(sizes)} images above {self.placement_dpi} DPI...")
+        return sizes
+
+    def _run_image_pass(self, pdf, temp_dir, tasks, mode, dpi):
+        self._smask_objgens = {obj.SMask.objgen for obj in pdf.objects
+                               if isinstance(obj, pikepdf.Stream) and isinstance(obj.get('/SMask'), pikepdf.Stream)}
+        self._downsample_sizes = self._placement_sizes(pdf)
+        tasks = self._triage_images(self._drop_opaque_smasks(tasks))
+        if self._image_worker_count(len(tasks)) <= 1:
+            saved = 0
+            for obj, kind in tasks:
+                self._check_interrupted()
+                if kind == 'jpeg':
+                    saved += self._lossless_optimize_jpeg_stream(obj, temp_dir)
+                else:
+                    saved += self._optimize_image_stream(pdf, obj, temp_dir, mode=mode, dpi=dpi)
+            self._finish_image_pass()
+            return saved
+
+        # Extract every payload up front, fan the tool chains out to worker processes and
+        # write the results back here, in task order, so the output matches the serial path.
+        entries, jobs = [], []
+        for obj, kind in tasks:
             try:
-                pdf_image = pikepdf.PdfImage(obj)
-                pil_image = pdf_image.as_pil_image()
+                key, found, result = self._cached_image_result(obj, kind, mode, dpi)
+                if found:
+                    entries.append((obj, kind, len(obj.read_raw_bytes()), result))
+                    continue
+                job = self._extract_image_job(obj, kind, mode, dpi)
             except Exception as e:
-                logging.warning(f"Could not extract image {obj.objgen} for optimization (possibly masked or unsupported format): {e}")
-                return 0
-
-            temp_img_path = temp_dir / f"img_{obj.objgen}.png"
-            pil_image.save(temp_img_path, "png")
-
-            optimized_path = None
-            if mode == 'lossy' and self.pngquant_path:
-                quality_str = "80-95"
-                if dpi <= 100:
-                    quality_str = "40-60"
-                elif dpi <= 200:
-                    quality_str = "65-80"
-                quant_path = temp_dir / f"img_{obj.objgen}.quant.png"
-                cmd = [self.pngquant_path, "--force", "--skip-if-larger", f"--quality={quality_str}", "--output", str(quant_path), "256", str(temp_img_path)]
-                result = run_command(cmd, check=False)
-                if result and result.returncode == 0 and quant_path.exists() and quant_path.stat().st_size > 0:
-                    optimized_path = quant_path
-                elif result and result.returncode != 0 and result.returncode != 99:
-                     logging.warning(f"Pngquant failed for image {obj.objgen}: {result.stderr.strip()}")
-
-
-            final_optimized_path = optimized_path if optimized_path else temp_img_path
-
-            # Oxipng Optimization (Library or Executable)
+                logging.warning(f"Could not read image {obj.objgen}: {e}")
+                continue
+            if job:
+                entries.append((obj, kind, job['original_size'], None))
+                jobs.append((len(entries) - 1, key, job))
+
+        if jobs:
+            workers = self._image_worker_count(len(jobs))
+            self._log_status(f"Optimizing {len(jobs)} images with {workers} workers...")
+            worker = functools.partial(_timed_image_job, opts=self._tool_options(), temp_dir=str(temp_dir))
             try:
-                oxipng_out_path = temp_dir / f"img_{obj.objgen}.oxipng.png"
-                if HAS_OXIPNG_LIB:
-                    options = {"level": 2 if self.fast_mode else 6, "strip": oxipng.StripChunks.all()}
-                    if mode == 'lossy':
-                        options["optimize_alpha"] = True
-                        options["scale_16"] = True
-                    oxipng.optimize(final_optimized_path, oxipng_out_path, **options)
-                elif self.oxipng_path:
-                    # Fallback to executable
-                    cmd_oxipng = [self.oxipng_path, "-o", "2" if self.fast_mode else "6", "--strip", "all", str(final_optimized_path), "--out", str(oxipng_out_path)]
-                    if mode == 'lossy':
-                         # NOTE: oxipng CLI doesn't have exact equivalents for scale_16/optimize_alpha flags in the same way, but basic optimization works.
-                         pass
-                    run_command(cmd_oxipng, check=False)
-                
-                if oxipng_out_path.exists() and oxipng_out_path.stat().st_size > 0:
-                    final_optimized_path = oxipng_out_path
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=_init_image_worker, initargs=(self.cancel,)) as executor:
+                    results = list(executor.map(worker, [job for _, _, job in jobs]))
             except Exception as e:
-                logging.warning(f"Could not process PNG with oxipng for {obj.objgen}: {e}")
-
-            if self.ect_path and not self.fast_mode and final_optimized_path.exists():
-                ect_target_path = temp_dir / f"img_{obj.objgen}.ect.png"
-                shutil.copy(final_optimized_path, ect_target_path)
-                cmd_ect = [self.ect_path, "-S2", "-strip", "-quiet", str(ect_target_path)]
-                result_ect = run_command(cmd_ect, check=False)
-                if result_ect and result_ect.returncode == 0 and ect_target_path.exists() and ect_target_path.stat().st_size < final_optimized_path.stat().st_size:
-                    final_optimized_path = ect_target_path
-                elif result_ect and result_ect.returncode != 0:
-                    logging.warning(f"ECT failed for image {obj.objgen}: {result_ect.stderr.strip()}")
-
-
-            final_pil_image = Image.open(final_optimized_path)
-            if final_pil_image.mode == 'P':
-                final_pil_image = final_pil_image.convert('RGBA' if 'A' in final_pil_image.info.get('transparency', '') else 'RGB')
-
-            has_transparency = 'A' in final_pil_image.mode
-            total_new_size = float('inf')
-
-            if has_transparency:
-                if final_pil_image.mode != 'RGBA':
-                    final_pil_image = final_pil_image.convert('RGBA')
-                rgb_image = Image.new("RGB", final_pil_image.size, (255, 255, 255))
-                rgb_image.paste(final_pil_image, mask=final_pil_image.split()[3])
-                alpha_image = final_pil_image.split()[3]
-
-                compressed_rgb = zlib.compress(rgb_image.tobytes())
-                compressed_alpha = zlib.compress(alpha_image.tobytes())
-                total_new_size = len(compressed_rgb) + len(compressed_alpha)
-
-                if total_new_size < original_size:
-                    self._apply_flate_image(pdf, obj, compressed_rgb, final_pil_image.width, final_pil_image.height, compressed_alpha)
+                logging.warning(f"Image worker pool failed ({e}), optimizing images serially.")
+                results = [worker(job) for _, _, job in jobs]
+            for (index, key, _), (result, seconds, timings) in zip(jobs, results):
+                self._record_job_time(seconds, timings)
+                self._store_image_result(key, result)
+                obj, kind, original_size, _ = entries[index]
+                entries[index] = (obj, kind, original_size, result)
+
+        self._finish_image_pass()
+        return sum(self._apply_image_result(pdf, obj, kind, original_size, result) for obj, kind, original_size, result in entries)
+
+    @classmethod
+    def _image_identity(cls, obj, memo):
+        """Hash of an image's decoded samples and the dictionary entries that affect rendering.
+
+        Soft masks and stencil masks count by their own identity, so copies whose masks
+        were merely compressed differently still match.
+        """
+        if obj.objgen in memo:
+            return memo[obj.objgen]
+        h = hashlib.sha256()
+        skip = {'/Length'}
+        try:
+            h.update(obj.read_bytes())
+            skip.update(('/Filter', '/DecodeParms'))  # Identical pixels match whatever the encoding
+        except Exception:
+            h.update(obj.read_raw_bytes())  # DCT, JPX, JBIG2...: compare the encoded data instead
+        entries = {}
+        for key, value in obj.items():
+            if key in skip:
+                continue
+            if isinstance(value, pikepdf.Stream) and value.get("/Subtype") == "/Image":
+                entries[str(key)] = cls._image_identity(value, memo)
             else:
-                if final_pil_image.mode != 'RGB':
-                    final_pil_image = final_pil_image.convert('RGB')
-                compressed_rgb = zlib.compress(final_pil_image.tobytes())
-                total_new_size = len(compressed_rgb)
-
-                if total_new_size < original_size:
-                    self._apply_flate_image(pdf, obj, compressed_rgb, final_pil_image.width, final_pil_image.height)
-
+                entries[str(key)] = _fingerprint(value)
+        h.update(repr(sorted(entries.items())).encode('utf-8'))
+        memo[obj.objgen] = h.hexdigest()
+        return memo[obj.objgen]
+
+    def _deduplicate_images(self, pdf):
+        """Points every reference to an image at one canonical copy of identical images.
+
+        Two linear passes over pdf.objects: hash the images, then rewrite indirect references
+        held anywhere in the direct dictionaries and arrays of each object (/XObject
+        resources, /SMask, /Mask, /Thumb...). Unreferenced copies are dropped on save;
+        their objgens are returned so callers can leave them out of later passes.
+        """
+        canonical, replacements, memo = {}, {}, {}
+        for obj in pdf.objects:
+            if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == "/Image":
+                try:
+                    identity = self._image_identity(obj, memo)
+                except Exception as e:
+                    logging.warning(f"Could not hash image {obj.objgen} for deduplication: {e}")
+                    continue
+                if identity in canonical:
+                    replacements[obj.objgen] = canonical[identity]
+                else:
+                    canonical[identity] = obj
+        if not replacements:
+            return set()
+        try:
+            self._relink_references(pdf, replacements)
+        except Exception as e:
+            # References already moved point at identical images, so the document stays valid.
+            logging.warning(f"Image deduplication stopped early: {e}")
+            return set()
+        logging.info(f"Merged {len(replacements)} duplicate images into {len(set(o.objgen for o in replacements.values()))} objects.")
+        self._log_status(f"Merged {len(replacements)} duplicate images...")
+        return set(replacements)
+
+    @staticmethod
+    def _relink_references(pdf, replacements):
+        """Rewrites indirect references held anywhere in the direct dictionaries and arrays
+        of each object, following replacements ({objgen: canonical object})."""
+        def relink(container):
+            items = enumerate(container) if isinstance(container, pikepdf.Array) else container.items()
+            for key, value in list(items):
+                if not isinstance(value, pikepdf.Object):
+                    continue
+                if value.is_indirect:
+                    if value.objgen in replacements:
+                        container[key] = replacements[value.objgen]
+                elif isinstance(value, (pikepdf.Dictionary, pikepdf.Array)):
+                    relink(value)
+
+        for obj in pdf.objects:
+            if isinstance(obj, (pikepdf.Stream, pikepdf.Dictionary, pikepdf.Array)):
+                relink(obj)
+
+    def _deduplicate_font_programs(self, pdf):
+        """Merges byte-identical embedded font programs, e.g. the same subset written by several Ghostscript chunks."""
+        canonical, replacements = {}, {}
+        for obj in pdf.objects:
+            if not (isinstance(obj, pikepdf.Dictionary) and obj.get("/Type") == "/FontDescriptor"):
+                continue
+            for key in ('/FontFile', '/FontFile2', '/FontFile3'):
+                font_file = obj.get(key)
+                if not isinstance(font_file, pikepdf.Stream) or font_file.objgen in replacements:
+                    continue
+                h = hashlib.sha256(font_file.read_raw_bytes())
+                h.update(repr(sorted((str(k), _fingerprint(v)) for k, v in font_file.items() if k != '/Length')).encode('utf-8'))
+                first = canonical.setdefault(h.hexdigest(), font_file)
+                if first.objgen != font_file.objgen:
+                    replacements[font_file.objgen] = first
+        if replacements:
+            self._relink_references(pdf, replacements)
+        return len(replacements)
+
+    @staticmethod
+    def _image_tasks(pdf, kind_for_filter):
+        tasks = []
+        for obj in pdf.objects:
+            if not (isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == "/Image"):
+                continue
+            filt = obj.get("/Filter")
+            if isinstance(filt, pikepdf.Array) and len(filt) > 0: filt = filt[0]
+            kind = kind_for_filter(filt)
+            if kind:
+                tasks.append((obj, kind))
+        return tasks
+
+    @staticmethod
+    def _save_recompressed(pdf, path, **save_kwargs):
+        """Saves with Flate streams recompressed, except predictor images written by the image pass.
+
+        qpdf's recompress_flate would decode those and deflate them again without the PNG
+        predictor, so in that case the other Flate streams are decoded here instead and
+        qpdf compresses them afresh on save.
+        """
+        def is_image(obj): return obj.get("/Subtype") == "/Image"
+        streams = [obj for obj in pdf.objects if isinstance(obj, pikepdf.Stream)]
+        if not any(is_image(obj) and isinstance(obj.get("/DecodeParms"), pikepdf.Dictionary)
+                   and obj.DecodeParms.get("/Predictor", 1) >= 10 for obj in streams):
+            pdf.save(path, recompress_flate=True, **save_kwargs)
+            return
+        for obj in streams:
+            if (not is_image(obj) and obj.get("/Filter") == "/FlateDecode" and "/DecodeParms" not in obj
+                    and obj.get("/Type") not in ("/ObjStm", "/XRef")):
+                obj.write(obj.read_bytes())
+        pdf.save(path, **save_kwargs)
+
+    def _open_pdf(self, path):
+        with self._stage('pikepdf_open', file_size(path)) as stage:
+            pdf = pikepdf.open(path, allow_overwriting_input=True)
+            stage['objects'] = len(pdf.objects)
+        return pdf
+
+    def _save_pdf(self, pdf, path, **save_kwargs):
+        with self._stage('pikepdf_save') as stage:
+            stage['objects'] = len(pdf.objects)
+            self._save_recompressed(pdf, path, **save_kwargs)
+            stage['bytes_out'] = file_size(path)
+
+    def _run_gs(self, cmd, stage_name, input_file, output_file):
+        with self._stage(stage_name, file_size(input_file)) as stage:
+            run_ghostscript(cmd, use_library=self.gs_library, **self._limits(cmd))
+            stage['bytes_out'] = file_size(output_file)
+
+    def _gs_chunk_ranges(self, input_file):
+        """1-based page ranges for a parallel Ghostscript run, or None to run the document in one process."""
+        if self.gs_workers == 1:
+            return None
+        workers = self.gs_workers or os.cpu_count() or 1
+        try:
+            with pikepdf.open(input_file) as pdf:
+                page_count = len(pdf.pages)
+        except Exception as e:
+            logging.warning(f"Could not count pages for chunked Ghostscript, running it whole: {e}")
+            return None
+        chunks = min(workers, page_count // _GS_MIN_CHUNK_PAGES)
+        if chunks < 2:
+            return None
+        size = -(-page_count // chunks)
+        return [(first, min(first + size - 1, page_count)) for first in range(1, page_count + 1, size)]
+
+    def _run_pdfwrite(self, args, stage_name, input_file, output_file):
+        """Runs Ghostscript pdfwrite with args, splitting large documents into page ranges run in parallel."""
+        ranges = self._gs_chunk_ranges(input_file)
+        if not ranges:
+            cmd = [self.gs_path, *args, f'-sOutputFile={output_file}', str(input_file)]
+            self._run_gs(cmd, stage_name, input_file, output_file)
+            return
 
-            if total_new_size < original_size:
-                saved = original_size - total_new_size
-                logging.info(f"Optimized Flate image {obj.objgen}, saved {saved} bytes.")
-                return saved
+        self._log_status(f"Running Ghostscript on {len(ranges)} page ranges in parallel...")
+        # The chunks are linearized, if at all, once they are stitched back together.
+        args = [arg for arg in args if not arg.startswith('-dFastWebView')]
+        with tempfile.TemporaryDirectory() as chunk_dir:
+            chunk_files = [Path(chunk_dir) / f"chunk_{i:04d}.pdf" for i in range(len(ranges))]
+
+            def run_chunk(index):
+                first, last = ranges[index]
+                cmd = [self.gs_path, *args, f'-dFirstPage={first}', f'-dLastPage={last}',
+                       f'-sOutputFile={chunk_files[index]}', str(input_file)]
+                # The in-process engine takes one job at a time, so chunks always use the executable.
+                run_ghostscript(cmd, use_library=False, **self._limits(cmd))
+
+            with self._stage(stage_name, file_size(input_file)) as stage:
+                with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                    list(executor.map(run_chunk, range(len(ranges))))
+                stage['chunks'] = len(ranges)
+                stage['bytes_out'] = sum(file_size(path) or 0 for path in chunk_files)
+            self._stitch_chunks(input_file, chunk_files, output_file)
+
+    @classmethod
+    def _copy_with_page_map(cls, obj, target, page_map, memo):
+        """Copies a document-level object (outline tree, name tree, page labels) into target,
+        pointing page references at the stitched pages instead of dragging the originals along."""
+        if not isinstance(obj, pikepdf.Object):
+            return obj
+        if obj.is_indirect:
+            if obj.objgen in page_map:
+                return page_map[obj.objgen]
+            if obj.objgen in memo:
+                return memo[obj.objgen]
+        if isinstance(obj, pikepdf.Stream):
+            return target.copy_foreign(obj)
+        if isinstance(obj, pikepdf.Dictionary):
+            if obj.get("/Type") == "/Page":
+                return pikepdf.Null()  # A page that is no longer in the document
+            copy = pikepdf.Dictionary()
+            if obj.is_indirect:
+                copy = memo[obj.objgen] = target.make_indirect(copy)
+            for key, value in obj.items():
+                if key != '/SE':  # Structure elements would pull in the whole structure tree
+                    copy[key] = cls._copy_with_page_map(value, target, page_map, memo)
+            return copy
+        if isinstance(obj, pikepdf.Array):
+            copy = pikepdf.Array()
+            if obj.is_indirect:
+                copy = memo[obj.objgen] = target.make_indirect(copy)
+            for value in obj:
+                copy.append(cls._copy_with_page_map(value, target, page_map, memo))
+            return copy
+        return obj
+
+    def _stitch_chunks(self, input_file, chunk_files, output_file):
+        """Joins chunk outputs into output_file, restoring the source's outlines, named destinations and page labels."""
+        chunks = []
+        try:
+            with self._stage('stitch') as stage, pikepdf.open(input_file) as source, pikepdf.Pdf.new() as out:
+                for path in chunk_files:
+                    chunk = pikepdf.open(path)
+                    chunks.append(chunk)
+                    out.pages.extend(chunk.pages)
+                for key, value in chunks[0].docinfo.items():
+                    out.docinfo[key] = value
+
+                if len(out.pages) == len(source.pages):
+                    page_map = {src.obj.objgen: dst.obj for src, dst in zip(source.pages, out.pages)}
+                    memo = {}
+                    for key in ('/Outlines', '/Dests', '/PageLabels', '/PageMode'):
+                        if key in source.Root:
+                            out.Root[key] = self._copy_with_page_map(source.Root[key], out, page_map, memo)
+                    names = source.Root.get('/Names')
+                    if isinstance(names, pikepdf.Dictionary) and '/Dests' in names:
+                        out.Root.Names = pikepdf.Dictionary(Dests=self._copy_with_page_map(names.Dests, out, page_map, memo))
+                else:
+                    logging.warning(f"Ghostscript chunks hold {len(out.pages)} pages, source has {len(source.pages)}; outlines not restored.")
+
+                stage['objects'] = self._deduplicate_font_programs(out)
+                out.save(output_file)
+            stage['bytes_out'] = file_size(output_file)
+        finally:
+            for chunk in chunks:
+                chunk.close()
+
+    def _deduplicate_objects(self, pdf):
+        """Hash-based squeeze: merges identical streams, dictionaries and arrays, returning how many went.
+
+        References hash as the objgen of their canonical copy, so each pass can match objects
+        whose children were merged by the previous one; everything is relinked once at the end.
+        """
+        candidates = []
+        for obj in pdf.objects:
+            if isinstance(obj, (pikepdf.Stream, pikepdf.Dictionary)):
+                if obj.get("/Type") in _UNSHAREABLE_TYPES or any(key in obj for key in _UNSHAREABLE_KEYS):
+                    continue
+            elif not isinstance(obj, pikepdf.Array):
+                continue
+            raw = hashlib.sha256(obj.read_raw_bytes()).digest() if isinstance(obj, pikepdf.Stream) else b''
+            candidates.append((obj, raw))
+
+        aliases, canonical_objects = {}, {}
+        for _ in range(_SQUEEZE_PASSES):
+            canonical, found = {}, False
+            for obj, raw in candidates:
+                if obj.objgen in aliases:
+                    continue
+                if isinstance(obj, pikepdf.Stream):
+                    description = sorted((str(k), _object_fingerprint(v, aliases)) for k, v in obj.items() if k != '/Length')
+                else:
+                    description = (type(obj).__name__, _object_fingerprint(obj, aliases))
+                first = canonical.setdefault(hashlib.sha256(raw + repr(description).encode('utf-8')).digest(), obj)
+                if first.objgen != obj.objgen:
+                    aliases[obj.objgen] = first.objgen
+                    canonical_objects[first.objgen] = first
+                    found = True
+            if not found:
+                break
+        if not aliases:
+            return 0
 
-        except Exception as e:
-            logging.warning(f"Could not process image stream {obj.objgen}: {e}", exc_info=True)
-        return 0
+        def resolve(objgen):
+            while objgen in aliases:
+                objgen = aliases[objgen]
+            return objgen
+        self._relink_references(pdf, {objgen: canonical_objects[resolve(objgen)] for objgen in aliases})
+        return len(aliases)
+
+    def _strip_metadata(self, pdf):
+        for key in list(pdf.docinfo.keys()):
+            del pdf.docinfo[key]
+        if '/Metadata' in pdf.Root:
+            del pdf.Root.Metadata
+
+    def _finalize_pdf(self, pdf, output_path, strip_metadata=False, object_streams=True):
+        """pikepdf replacement for the cpdf pass: squeeze, drop /OpenAction and metadata as requested,
+        then save once with object streams and, for fast web view, linearized."""
+        with self._stage('finalize') as stage:
+            try:
+                stage['objects'] = self._deduplicate_objects(pdf)
+            except Exception as e:
+                # References already moved point at identical objects, so the document stays valid.
+                logging.warning(f"Object deduplication stopped early: {e}")
+            if self.remove_open_action and '/OpenAction' in pdf.Root:
+                del pdf.Root.OpenAction
+            if strip_metadata:
+                self._strip_metadata(pdf)
+        stream_mode = pikepdf.ObjectStreamMode.generate if object_streams else pikepdf.ObjectStreamMode.disable
+        self._save_pdf(pdf, output_path, object_stream_mode=stream_mode, linearize=self.linearize)
+        if self.darken_text:
+            self._darken_text_with_cpdf(output_path)
 
+    def _darken_text_with_cpdf(self, pdf_path):
+        """Text darkening has no pikepdf equivalent, so it still goes through cpdf when cpdf is available."""
+        if not self.cpdf_path:
+            logging.warning("cpdf not found, skipping text darkening.")
+            return
+        temp_path = Path(pdf_path).with_suffix('.blacktext.pdf')
+        try:
+            with self._stage('cpdf', file_size(pdf_path)) as stage:
+                cmd = [self.cpdf_path, str(pdf_path), "-blacktext", "-o", str(temp_path)]
+                run_command(cmd, **self._limits(cmd))
+                stage['bytes_out'] = file_size(temp_path)
+            if temp_path.exists() and temp_path.stat().st_size > 0:
+                shutil.move(temp_path, pdf_path)
+        except ProcessingError as e:
+            logging.warning(f"Text darkening with cpdf failed, keeping the text as is: {e}")
+        finally:
+            if temp_path.exists(): os.remove(temp_path)
 
-    def _post_process_pdf(self, pdf_path_in, pdf_path_out, strip_metadata=False):
+    def _post_process_pdf(self, pdf_path_in, pdf_path_out, strip_metadata=False, object_streams=True):
+        if self.native_finalize:
+            with self._open_pdf(pdf_path_in) as pdf:
+                self._finalize_pdf(pdf, pdf_path_out, strip_metadata, object_streams)
+            return
         if not self.cpdf_path:
             logging.warning("cpdf not found, skipping post-processing.")
             if pdf_path_in != pdf_path_out:
@@ -299,7 +1015,9 @@ class PdfOptimizer:
         cmd.extend(["-o", str(final_out_path)])
 
         try:
-            result = run_command(cmd)
+            with self._stage('cpdf', file_size(final_in_path)) as stage:
+                result = run_command(cmd, **self._limits(cmd))
+                stage['bytes_out'] = file_size(final_out_path)
             if not final_out_path.exists() or final_out_path.stat().st_size == 0:
                  logging.error(f"cpdf processing failed to create output file or file is empty.")
                  if pdf_path_in != pdf_path_out: shutil.copy2(pdf_path_in, pdf_path_out)
@@ -331,14 +1049,19 @@ class PdfOptimizer:
                 shutil.copy2(input_file, internal_temp_pdf)
 
                 self._log_status( (status_msg))
-                with pikepdf.open(internal_temp_pdf, allow_overwriting_input=True) as pdf:
+                with self._open_pdf(internal_temp_pdf) as pdf:
                     process_func(pdf, temp_dir)
 
-                    self._log_status( ("Recompressing streams..."))
-                    pdf.save(internal_temp_pdf, object_stream_mode=pikepdf.ObjectStreamMode.generate, recompress_flate=True)
+                    if self.native_finalize:
+                        self._log_status( ("Recompressing and finalizing..."))
+                        self._finalize_pdf(pdf, temp_output_path, strip_metadata)
+                    else:
+                        self._log_status( ("Recompressing streams..."))
+                        self._save_pdf(pdf, internal_temp_pdf, object_stream_mode=pikepdf.ObjectStreamMode.generate)
 
-            self._log_status( ("Finalizing with cpdf..."))
-            self._post_process_pdf(internal_temp_pdf, temp_output_path, strip_metadata)
+                if not self.native_finalize:
+                    self._log_status( ("Finalizing with cpdf..."))
+                    self._post_process_pdf(internal_temp_pdf, temp_output_path, strip_metadata)
 
         except Exception as e:
             logging.error(f"Optimization failed: {e}", exc_info=True)
@@ -349,40 +1072,53 @@ class PdfOptimizer:
             if internal_temp_pdf and internal_temp_pdf.exists():
                 os.remove(internal_temp_pdf)
 
+    def _deduplicate(self, pdf):
+        with self._stage('deduplicate') as stage:
+            merged = self._deduplicate_images(pdf)
+            stage['objects'] = len(merged)
+        return merged
+
     def _run_lossless_optimization(self, input_file, temp_output_path, strip_metadata, true_lossless=False):
         def processor(pdf, temp_dir):
             msg = "Optimizing non-JPEG images losslessly..." if true_lossless else "Optimizing images losslessly..."
             self._log_status( (msg))
-            image_objects = [obj for obj in pdf.objects if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == "/Image"]
-            for obj in image_objects:
-                filt = obj.get("/Filter")
-                if isinstance(filt, pikepdf.Array) and len(filt) > 0: filt = filt[0]
-                
+            def kind_for_filter(filt):
                 if filt == "/DCTDecode" and not true_lossless:
-                    self._lossless_optimize_jpeg_stream(obj, temp_dir)
-                elif filt not in ("/DCTDecode", "/JPXDecode"):
-                    self._optimize_image_stream(pdf, obj, temp_dir, mode='lossless')
-        
-        msg = "Opening PDF for true lossless..." if true_lossless else "Opening PDF for lossless..."
-        self._process_with_pikepdf(input_file, temp_output_path, strip_metadata, processor, msg)
+                    return 'jpeg'
+                if filt not in ("/DCTDecode", "/JPXDecode"):
+                    return 'flate'
+                return None
+            merged = self._deduplicate(pdf) if self.detect_duplicate_images else set()
+            tasks = [task for task in self._image_tasks(pdf, kind_for_filter) if task[0].objgen not in merged]
+            self._optimize_images(pdf, temp_dir, tasks, mode='lossless')
         
         msg = "Opening PDF for true lossless..." if true_lossless else "Opening PDF for lossless..."
         self._process_with_pikepdf(input_file, temp_output_path, strip_metadata, processor, msg)
 
     def optimize_lossless(self, input_file, temp_output_path, strip_metadata=False):
+        self._start_document(input_file, 'lossless')
         self._run_lossless_optimization(input_file, temp_output_path, strip_metadata, true_lossless=False)
+        return self._finish_document(temp_output_path)
 
     def optimize_true_lossless(self, input_file, temp_output_path, strip_metadata=False):
+        self._start_document(input_file, 'true_lossless')
         self._run_lossless_optimization(input_file, temp_output_path, strip_metadata, true_lossless=True)
+        return self._finish_document(temp_output_path)
 
     def optimize_text_only(self, input_file, temp_output_path, strip_metadata=False):
         def processor(pdf, temp_dir):
             self._log_status( ("Finding images to replace..."))
             image_objects = [obj for obj in pdf.objects if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == "/Image"]
             self._log_status( (f"Replacing {len(image_objects)} images..."))
-            for obj in image_objects:
-                self._replace_image_stream(obj)
+            with self._stage('replace_images') as stage:
+                for obj in image_objects:
+                    self._replace_image_stream(obj)
+                stage['objects'] = len(image_objects)
+            if self.detect_duplicate_images:
+                self._deduplicate(pdf)  # The blank placeholders are all identical now
+        self._start_document(input_file, 'text_only')
         self._process_with_pikepdf(input_file, temp_output_path, strip_metadata, processor, "Opening PDF to remove images...")
+        return self._finish_document(temp_output_path)
 
     def _optimize_lossy_gs_preset_fallback(self, input_file, temp_output_path, dpi, strip_metadata, remove_interactive, use_bicubic):
         self._log_status( ("Fallback: Using GS preset mode..."))
@@ -397,8 +1133,8 @@ class PdfOptimizer:
             elif dpi <= 300: preset = '/printer'
             else: preset = '/prepress'
 
-            cmd = [
-                self.gs_path, '-sDEVICE=pdfwrite', '-dCompatibilityLevel=1.4',
+            args = [
+                '-sDEVICE=pdfwrite', '-dCompatibilityLevel=1.4',
                 '-dNOPAUSE', '-dBATCH', '-dQUIET', '-dSAFER', f'-dPDFSETTINGS={preset}',
                 f'-dPreserveMarkedContent={"true" if self.preserve_ocr else "false"}',
                 '-dPreserveEPSInfo=false',
@@ -413,29 +1149,31 @@ class PdfOptimizer:
             ]
 
             if self.preserve_ocr:
-                cmd.append('-dEmbedAllFonts=true')
-            if self.linearize: cmd.append("-dFastWebView=true")
-            if remove_interactive: cmd.extend(["-dShowAnnots=false", "-dShowAcroForm=false"])
-            if self.convert_to_grayscale: cmd.append('-sColorConversionStrategy=Gray')
-            else: cmd.append('-sColorConversionStrategy=LeaveColorUnchanged')
-            cmd.extend([f'-sOutputFile={gs_output_temp_pdf}', str(input_file)])
+                args.append('-dEmbedAllFonts=true')
+            if self.linearize: args.append("-dFastWebView=true")
+            if remove_interactive: args.extend(["-dShowAnnots=false", "-dShowAcroForm=false"])
+            if self.convert_to_grayscale: args.append('-sColorConversionStrategy=Gray')
+            else: args.append('-sColorConversionStrategy=LeaveColorUnchanged')
 
-            run_command(cmd)
+            self._run_pdfwrite(args, 'ghostscript_preset', input_file, gs_output_temp_pdf)
 
             if not gs_output_temp_pdf.exists() or gs_output_temp_pdf.stat().st_size == 0:
                 raise ProcessingError("Ghostscript preset fallback failed: Output file empty or not created.")
 
             self._log_status( ("Fallback: Finalizing..."))
-            try:
-                 with pikepdf.open(gs_output_temp_pdf, allow_overwriting_input=True) as pdf:
-                     if strip_metadata and pdf.docinfo:
-                         for key in list(pdf.docinfo.keys()): del pdf.docinfo[key]
-                     if strip_metadata and pdf.Root.Metadata: del pdf.Root.Metadata
-                     pdf.save(gs_output_temp_pdf)
-            except Exception as e:
-                logging.warning(f"Pikepdf finalization in fallback failed: {e}")
+            if self.native_finalize:
+                self._post_process_pdf(gs_output_temp_pdf, temp_output_path, strip_metadata)
+            else:
+                try:
+                     with self._open_pdf(gs_output_temp_pdf) as pdf:
+                         if strip_metadata:
+                             self._strip_metadata(pdf)
+                         with self._stage('pikepdf_save'):
+                             pdf.save(gs_output_temp_pdf)
+                except Exception as e:
+                    logging.warning(f"Pikepdf finalization in fallback failed: {e}")
 
-            self._post_process_pdf(gs_output_temp_pdf, temp_output_path, strip_metadata)
+                self._post_process_pdf(gs_output_temp_pdf, temp_output_path, strip_metadata)
 
         except Exception as e:
             logging.error(f"GS preset fallback mode failed: {e}", exc_info=True)
@@ -447,17 +1185,47 @@ class PdfOptimizer:
                 os.remove(gs_output_temp_pdf)
 
 
+    def optimize_lossy_preset(self, input_file, temp_output_path, dpi, strip_metadata=False, remove_interactive=False, use_bicubic=False):
+        """The Ghostscript /PDFSETTINGS preset run on its own, as optimize_lossy uses it for its fallback."""
+        self._start_document(input_file, 'lossy_preset')
+        self._optimize_lossy_gs_preset_fallback(input_file, temp_output_path, dpi, strip_metadata, remove_interactive, use_bicubic)
+        return self._finish_document(temp_output_path)
+
+    def _preflight_strategy(self, input_file, dpi, strip_metadata, remove_interactive):
+        """Profiles the input and returns the pre-flight strategy for the lossy mode, recording why."""
+        ghostscript_required = bool(remove_interactive or self.convert_to_grayscale or self.quantize_colors)
+        rewrite_required = bool(strip_metadata or self.remove_open_action or self.darken_text or self.linearize)
+        with self._stage('preflight', file_size(input_file)):
+            analysis = preflight(input_file, dpi, ghostscript_required, rewrite_required,
+                                 dpi_margin=1.0 if self.downsample_threshold_enabled else DEFAULT_DPI_MARGIN)
+        if self._telemetry is not None:
+            self._telemetry.preflight = analysis
+        logging.info(f"Pre-flight for {Path(input_file).name}: {analysis['strategy']} ({analysis['reason']}).")
+        self._log_status(f"Pre-flight: {analysis['reason']}...")
+        return analysis['strategy']
+
     def optimize_lossy(self, input_file, temp_output_path, dpi, strip_metadata=False, remove_interactive=False, use_bicubic=False):
         gs_output_temp_pdf = None
+        self._start_document(input_file, 'lossy')
+
+        strategy = self._preflight_strategy(input_file, dpi, strip_metadata, remove_interactive) if self.preflight else None
+        if strategy == STRATEGY_SKIP:
+            shutil.copy2(input_file, temp_output_path)
+            return self._finish_document(temp_output_path)
+        if strategy == STRATEGY_PIKEPDF:
+            self._run_lossless_optimization(input_file, temp_output_path, strip_metadata)
+            return self._finish_document(temp_output_path)
+        if strategy == STRATEGY_GS_PRESET:
+            self._optimize_lossy_gs_preset_fallback(input_file, temp_output_path, dpi, strip_metadata, remove_interactive, use_bicubic)
+            return self._finish_document(temp_output_path)
 
         try:
             self._log_status( ("Attempting high-compression mode..."))
             with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_out_gs:
                 gs_output_temp_pdf = Path(temp_out_gs.name)
 
-            cmd = [
-                self.gs_path, '-dNOSAFER', f'-sOutputFile={gs_output_temp_pdf}',
-                '-sDEVICE=pdfwrite', '-dCompatibilityLevel=1.7', '-dNOPAUSE', '-dQUIET', '-dBATCH',
+            args = [
+                '-dNOSAFER', '-sDEVICE=pdfwrite', '-dCompatibilityLevel=1.7', '-dNOPAUSE', '-dQUIET', '-dBATCH',
                 f'-dPreserveMarkedContent={"true" if self.preserve_ocr else "false"}',
                 '-dPreserveEPSInfo=false',
                 '-dPreserveOPIComments=false',
@@ -472,72 +1240,73 @@ class PdfOptimizer:
             ]
 
             if self.preserve_ocr:
-                cmd.append('-dEmbedAllFonts=true')
+                args.append('-dEmbedAllFonts=true')
             
             if not self.lossless_encoding:
-                cmd.append('-dMonoImageFilter=/CCITTFaxEncode')
+                args.append('-dMonoImageFilter=/CCITTFaxEncode')
             
             if self.quantize_colors:
-                cmd.append(f'-dPosterize={self.quantize_level}')
+                args.append(f'-dPosterize={self.quantize_level}')
 
             if self.downsample_threshold_enabled:
-                cmd.extend(['-dColorImageDownsampleThreshold=1.0', '-dGrayImageDownsampleThreshold=1.0', '-dMonoImageDownsampleThreshold=1.0'])
+                args.extend(['-dColorImageDownsampleThreshold=1.0', '-dGrayImageDownsampleThreshold=1.0', '-dMonoImageDownsampleThreshold=1.0'])
 
             jpeg_quality = "50" if self.fast_mode else ("60" if dpi <= 100 else ("75" if dpi <= 200 else "85"))
 
             if self.convert_to_grayscale:
-                cmd.extend(['-sColorConversionStrategy=Gray', '-dProcessColorModel=/DeviceGray', '-dOverrideICC', f'-dJPEGQ={jpeg_quality}'])
+                args.extend(['-sColorConversionStrategy=Gray', '-dProcessColorModel=/DeviceGray', '-dOverrideICC', f'-dJPEGQ={jpeg_quality}'])
             else:
-                cmd.extend(['-sColorConversionStrategy=sRGB', '-dProcessColorModel=/DeviceRGB', f'-dJPEGQ={jpeg_quality}'])
+                args.extend(['-sColorConversionStrategy=sRGB', '-dProcessColorModel=/DeviceRGB', f'-dJPEGQ={jpeg_quality}'])
 
             if self.lossless_encoding:
-                cmd.extend([
+                args.extend([
                     '-dAutoFilterColorImages=false', '-dAutoFilterGrayImages=false',
                     '-sColorImageFilter=FlateEncode', '-sGrayImageFilter=FlateEncode',
                     '-sMonoImageFilter=FlateEncode'
                 ])
             elif self.safe_mode:
-                cmd.extend(['-dAutoFilterColorImages=true', '-dAutoFilterGrayImages=true'])
+                args.extend(['-dAutoFilterColorImages=true', '-dAutoFilterGrayImages=true'])
             else:
-                cmd.extend(['-dColorImageFilter=/DCTEncode', '-dGrayImageFilter=/DCTEncode'])
+                args.extend(['-dColorImageFilter=/DCTEncode', '-dGrayImageFilter=/DCTEncode'])
 
-            cmd.append('-dApplyTrCF=true')
+            args.append('-dApplyTrCF=true')
 
             if use_bicubic:
-                cmd.extend(['-dColorImageDownsampleType=/Bicubic', '-dGrayImageDownsampleType=/Bicubic'])
+                args.extend(['-dColorImageDownsampleType=/Bicubic', '-dGrayImageDownsampleType=/Bicubic'])
             if remove_interactive:
-                cmd.extend(["-dShowAnnots=false", "-dShowAcroForm=false"])
-
-            cmd.append(str(input_file))
+                args.extend(["-dShowAnnots=false", "-dShowAcroForm=false"])
 
-            run_command(cmd)
+            self._run_pdfwrite(args, 'ghostscript', input_file, gs_output_temp_pdf)
 
             if not gs_output_temp_pdf.exists() or gs_output_temp_pdf.stat().st_size == 0:
                 raise ProcessingError("Ghostscript high-compression failed: Output file empty or not created.")
 
+            finalized = False
             with tempfile.TemporaryDirectory() as final_opt_dir_str:
                 final_opt_dir = Path(final_opt_dir_str)
                 try:
                     self._log_status( ("Optimizing images losslessly post-GS..."))
-                    with pikepdf.open(gs_output_temp_pdf, allow_overwriting_input=True) as pdf:
-                        optimized_bytes = 0
-                        image_objects = [obj for obj in pdf.objects if isinstance(obj, pikepdf.Stream) and obj.get("/Subtype") == "/Image"]
-                        for obj in image_objects:
-                            filt = obj.get("/Filter")
-                            if isinstance(filt, pikepdf.Array) and len(filt) > 0: filt = filt[0]
-
-                            if filt == pikepdf.Name.DCTDecode:
-                                optimized_bytes += self._lossless_optimize_jpeg_stream(obj, final_opt_dir)
-                            elif filt == pikepdf.Name.FlateDecode:
-                                optimized_bytes += self._optimize_image_stream(pdf, obj, final_opt_dir, mode='lossless')
+                    with self._open_pdf(gs_output_temp_pdf) as pdf:
+                        def kind_for_filter(filt):
+                            if filt == pikepdf.Name.DCTDecode: return 'jpeg'
+                            if filt == pikepdf.Name.FlateDecode: return 'flate'
+                            return None
+                        tasks = self._image_tasks(pdf, kind_for_filter)
+                        optimized_bytes = self._optimize_images(pdf, final_opt_dir, tasks, mode='lossless')
                         if optimized_bytes > 0:
                             logging.info(f"Post-GS optimization saved an additional {optimized_bytes} bytes.")
-                            pdf.save(gs_output_temp_pdf, recompress_flate=True)
+                        if self.native_finalize:
+                            self._log_status( ("Finalizing..."))
+                            self._finalize_pdf(pdf, temp_output_path, strip_metadata)
+                            finalized = True
+                        elif optimized_bytes > 0:
+                            self._save_pdf(pdf, gs_output_temp_pdf)
                 except Exception as e:
                     logging.warning(f"Post-Ghostscript optimization step failed: {e}")
 
-            self._log_status( ("Finalizing with cpdf..."))
-            self._post_process_pdf(gs_output_temp_pdf, temp_output_path, strip_metadata)
+            if not finalized:
+                self._log_status( ("Finalizing..." if self.native_finalize else "Finalizing with cpdf..."))
+                self._post_process_pdf(gs_output_temp_pdf, temp_output_path, strip_metadata)
 
         except Exception as e:
             logging.warning(f"High-compression mode failed: {e}. Switching to preset fallback mode.")
@@ -552,10 +1321,12 @@ class PdfOptimizer:
         finally:
             if gs_output_temp_pdf and gs_output_temp_pdf.exists():
                 os.remove(gs_output_temp_pdf)
+        return self._finish_document(temp_output_path)
 
     def optimize_pdfa(self, input_file, temp_output_path):
         self._log_status( ("Converting to PDF/A..."))
         gs_output_temp_pdf = None
+        self._start_document(input_file, 'pdfa')
 
         try:
             gs_path_obj = Path(self.gs_path)
@@ -589,14 +1360,15 @@ class PdfOptimizer:
 
             cmd.extend([f'-sOutputFile={gs_output_temp_pdf}', str(input_file)])
 
-            run_command(cmd)
+            self._run_gs(cmd, 'ghostscript_pdfa', input_file, gs_output_temp_pdf)
 
             if not gs_output_temp_pdf.exists() or gs_output_temp_pdf.stat().st_size == 0:
                  raise ProcessingError("Ghostscript PDF/A conversion failed: Output file empty or not created.")
 
             
+            finalized = False
             try:
-                 with pikepdf.open(gs_output_temp_pdf, allow_overwriting_input=True) as pdf:
+                 with self._open_pdf(gs_output_temp_pdf) as pdf:
                     
                      changed_meta = False
                      with pdf.open_metadata(set_pikepdf_as_editor=False) as meta:
@@ -604,15 +1376,21 @@ class PdfOptimizer:
                          meta['pdf:Producer'] += '; MinimalPDF Optimizer'
                          meta['xmp:CreatorTool'] = 'MinimalPDF Optimizer'
                          changed_meta = True
-                     if changed_meta:
+                     if self.native_finalize:
+                         # PDF/A-1 is based on PDF 1.4, which has no object streams.
+                         self._finalize_pdf(pdf, temp_output_path, strip_metadata=False, object_streams=False)
+                         finalized = True
+                     elif changed_meta:
                          
-                         pdf.save(gs_output_temp_pdf, object_stream_mode=pikepdf.ObjectStreamMode.generate, recompress_flate=True)
+                         with self._stage('pikepdf_save'):
+                             pdf.save(gs_output_temp_pdf, object_stream_mode=pikepdf.ObjectStreamMode.generate, recompress_flate=True)
             except Exception as e:
                 logging.warning(f"Pikepdf metadata step for PDF/A failed: {e}")
                 
 
            
-            self._post_process_pdf(gs_output_temp_pdf, temp_output_path, strip_metadata=False)
+            if not finalized:
+                self._post_process_pdf(gs_output_temp_pdf, temp_output_path, strip_metadata=False, object_streams=False)
 
         except Exception as e:
             logging.error(f"PDF/A optimization failed: {e}", exc_info=True)
@@ -621,4 +1399,5 @@ class PdfOptimizer:
             raise
         finally:
              if gs_output_temp_pdf and gs_output_temp_pdf.exists():
-                 os.remove(gs_output_temp_pdf)
\ No newline at end of file
+                 os.remove(gs_output_temp_pdf)
+        return self._finish_document(temp_output_path)
\ No newline at end of file
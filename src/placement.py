@@ -0,0 +1,141 @@
+# placement.py
+import math
+import logging
+import pikepdf
+
+_IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+# Forms nested deeper than this (or drawing themselves) stop being followed.
+_MAX_FORM_DEPTH = 16
+
+def _multiply(m, n):
+    """Concatenates PDF matrices [a b c d e f]: m applied first, then n."""
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (a * A + b * C, a * B + b * D, c * A + d * C, c * B + d * D, e * A + f * C + E, e * B + f * D + F)
+
+def _matrix(value):
+    try:
+        matrix = tuple(float(v) for v in value)
+        return matrix if len(matrix) == 6 else _IDENTITY
+    except (TypeError, ValueError):
+        return _IDENTITY
+
+def _xobjects(resources):
+    xobjects = resources.get('/XObject') if isinstance(resources, pikepdf.Dictionary) else None
+    return xobjects if isinstance(xobjects, pikepdf.Dictionary) else None
+
+def _resource_images(resources, found, depth=0):
+    """Adds the objgens of every image reachable from a resource dictionary, through forms."""
+    xobjects = _xobjects(resources)
+    if xobjects is None or depth > _MAX_FORM_DEPTH:
+        return
+    for _, xobj in xobjects.items():
+        if not isinstance(xobj, pikepdf.Stream):
+            continue
+        if xobj.get('/Subtype') == '/Image':
+            found.add(xobj.objgen)
+        elif xobj.get('/Subtype') == '/Form':
+            _resource_images(xobj.get('/Resources'), found, depth + 1)
+
+class PlacementTracer:
+    """Finds how large each image XObject is drawn, by following the CTM through page content.
+
+    For every image it keeps the largest placed length of each image axis, in points
+    (an image placed several times is judged by its largest placement). Images also used
+    where placements aren't traced (patterns, annotation appearances, Type 3 glyphs, soft
+    mask groups) or on pages whose content can't be parsed are 'pinned'.
+    """
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.placements = {}
+        self.pinned = set()
+        self._traced_forms = set()
+
+    def trace(self):
+        for page in self.pdf.pages:
+            unit = float(page.obj.get('/UserUnit', 1.0))
+            try:
+                operations = pikepdf.parse_content_stream(page)
+            except Exception as e:
+                logging.info(f"Could not parse page content for image placement: {e}")
+                _resource_images(page.obj.get('/Resources'), self.pinned)
+                continue
+            self._trace(operations, page.obj.get('/Resources'), (unit, 0.0, 0.0, unit, 0.0, 0.0), 0)
+        self._pin_untraced()
+        return self
+
+    def _trace(self, operations, resources, ctm, depth):
+        xobjects = _xobjects(resources)
+        stack = []
+        for operands, operator in operations:
+            op = str(operator)
+            if op == 'q':
+                stack.append(ctm)
+            elif op == 'Q':
+                if stack: ctm = stack.pop()
+            elif op == 'cm':
+                ctm = _multiply(_matrix(operands), ctm)
+            elif op == 'Do' and xobjects is not None and operands:
+                xobj = xobjects.get(operands[0])
+                if not isinstance(xobj, pikepdf.Stream):
+                    continue
+                if xobj.get('/Subtype') == '/Image':
+                    self._place(xobj.objgen, ctm)
+                elif xobj.get('/Subtype') == '/Form':
+                    self._trace_form(xobj, resources, ctm, depth)
+
+    def _trace_form(self, form, parent_resources, ctm, depth):
+        if depth >= _MAX_FORM_DEPTH:
+            _resource_images(form.get('/Resources'), self.pinned)
+            return
+        self._traced_forms.add(form.objgen)
+        try:
+            operations = pikepdf.parse_content_stream(form)
+        except Exception as e:
+            logging.info(f"Could not parse form {form.objgen} for image placement: {e}")
+            _resource_images(form.get('/Resources'), self.pinned)
+            return
+        # Forms without their own resources use their parent's (PDF 1.1 style).
+        resources = form.get('/Resources', parent_resources)
+        self._trace(operations, resources, _multiply(_matrix(form.get('/Matrix', _IDENTITY)), ctm), depth + 1)
+
+    def _place(self, objgen, ctm):
+        # The unit square's x and y edges: their lengths are the placed width and height in points.
+        width, height = math.hypot(ctm[0], ctm[1]), math.hypot(ctm[2], ctm[3])
+        known = self.placements.get(objgen, (0.0, 0.0))
+        self.placements[objgen] = (max(known[0], width), max(known[1], height))
+
+    def _pin_untraced(self):
+        for obj in self.pdf.objects:
+            if isinstance(obj, pikepdf.Stream):
+                if obj.objgen in self._traced_forms or obj.get('/Subtype') == '/Image' or '/Resources' not in obj:
+                    continue
+            elif not (isinstance(obj, pikepdf.Dictionary) and obj.get('/Subtype') == '/Type3'):
+                continue
+            _resource_images(obj.get('/Resources'), self.pinned)
+
+def downsample_sizes(pdf, target_dpi, threshold=1.5):
+    """Target pixel sizes {objgen: (width, height)} for images placed above threshold x target_dpi.
+
+    Each image keeps its aspect ratio and gets enough pixels for target_dpi at its largest placement.
+    """
+    tracer = PlacementTracer(pdf).trace()
+    sizes = {}
+    for objgen, (width_pt, height_pt) in tracer.placements.items():
+        if objgen in tracer.pinned:
+            continue
+        image = pdf.get_object(objgen)
+        try:
+            width_px, height_px = int(image.Width), int(image.Height)
+        except Exception:
+            continue
+        if width_pt <= 0 or height_pt <= 0 or width_px <= 0 or height_px <= 0:
+            continue
+        scale = max(width_pt / 72 * target_dpi / width_px, height_pt / 72 * target_dpi / height_px)
+        if scale * threshold > 1:
+            continue
+        sizes[objgen] = (max(1, math.ceil(width_px * scale)), max(1, math.ceil(height_px * scale)))
+    if sizes:
+        logging.info(f"{len(sizes)} images are placed above {target_dpi} DPI and will be downsampled.")
+    return sizes
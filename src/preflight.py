@@ -0,0 +1,156 @@
+# preflight.py
+import logging
+import pikepdf
+
+STRATEGY_SKIP = 'skip'
+STRATEGY_PIKEPDF = 'pikepdf'
+STRATEGY_GS = 'gs'
+STRATEGY_GS_PRESET = 'gs_preset'
+
+# Embedded fonts this large without subsetting are worth a Ghostscript rewrite on their own.
+_FULL_FONT_BYTES_WORTH_GS = 32 * 1024
+# Image bytes above the target DPI that justify running Ghostscript to downsample them.
+_DOWNSAMPLE_BYTES_WORTH_GS = 16 * 1024
+# Ghostscript leaves images alone below this multiple of the target (its DownsampleThreshold default).
+DEFAULT_DPI_MARGIN = 1.5
+_PRINT_COLOR_SPACES = ('/DeviceCMYK', '/Separation', '/DeviceN')
+
+def _stream_length(obj):
+    """Encoded size from the stream dictionary, so no stream data is read."""
+    try:
+        return int(obj.get('/Length', 0))
+    except (TypeError, ValueError):
+        return 0
+
+def _color_space_name(image):
+    cs = image.get('/ColorSpace')
+    if isinstance(cs, pikepdf.Array) and len(cs) > 0:
+        if cs[0] == '/ICCBased':
+            try:
+                return {1: '/DeviceGray', 3: '/DeviceRGB', 4: '/DeviceCMYK'}.get(int(cs[1].get('/N', 3)), '/ICCBased')
+            except Exception:
+                return '/ICCBased'
+        cs = cs[0]
+    return str(cs) if cs is not None else None
+
+def _page_images(page_obj, memo):
+    """Yields the image XObjects drawn by a page, looking into form XObjects once each."""
+    stack = [page_obj]
+    while stack:
+        resources = stack.pop().get('/Resources')
+        xobjects = resources.get('/XObject') if isinstance(resources, pikepdf.Dictionary) else None
+        if not isinstance(xobjects, pikepdf.Dictionary):
+            continue
+        for _, xobj in xobjects.items():
+            if not isinstance(xobj, pikepdf.Stream) or xobj.objgen in memo:
+                continue
+            memo.add(xobj.objgen)
+            if xobj.get('/Subtype') == '/Image':
+                yield xobj
+            elif xobj.get('/Subtype') == '/Form':
+                stack.append(xobj)
+
+def analyze_pdf(pdf, target_dpi, dpi_margin=DEFAULT_DPI_MARGIN):
+    """Cheap structural profile of an open document: bytes by kind, image resolution and producer.
+
+    Image resolution is measured against the page an image is drawn on, as if it filled the
+    page; that is a lower bound on its effective DPI, so 'above target' is never overstated.
+    """
+    analysis = {
+        'pages': len(pdf.pages), 'producer': '', 'image_bytes': 0, 'font_bytes': 0,
+        'full_font_bytes': 0, 'content_bytes': 0, 'other_bytes': 0, 'uncompressed_bytes': 0,
+        'images': 0, 'images_above_target': 0, 'bytes_above_target': 0, 'max_page_dpi': 0,
+        'print_color_images': 0,
+    }
+    try:
+        analysis['producer'] = str(pdf.docinfo.get('/Producer', ''))
+    except Exception:
+        pass
+
+    font_files = {}
+    for obj in pdf.objects:
+        if isinstance(obj, pikepdf.Dictionary) and obj.get('/Type') == '/FontDescriptor':
+            subset = '+' in str(obj.get('/FontName', ''))
+            for key in ('/FontFile', '/FontFile2', '/FontFile3'):
+                font_file = obj.get(key)
+                if isinstance(font_file, pikepdf.Stream):
+                    font_files[font_file.objgen] = subset
+
+    content_streams = set()
+    for page in pdf.pages:
+        contents = page.obj.get('/Contents')
+        for stream in (contents if isinstance(contents, pikepdf.Array) else [contents]):
+            if isinstance(stream, pikepdf.Stream):
+                content_streams.add(stream.objgen)
+
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Stream):
+            continue
+        length = _stream_length(obj)
+        if obj.get('/Filter') is None:
+            analysis['uncompressed_bytes'] += length
+        if obj.get('/Subtype') == '/Image':
+            analysis['image_bytes'] += length
+            analysis['images'] += 1
+            if _color_space_name(obj) in _PRINT_COLOR_SPACES:
+                analysis['print_color_images'] += 1
+        elif obj.objgen in font_files:
+            analysis['font_bytes'] += length
+            if not font_files[obj.objgen]:
+                analysis['full_font_bytes'] += length
+        elif obj.objgen in content_streams or obj.get('/Subtype') == '/Form':
+            analysis['content_bytes'] += length
+        else:
+            analysis['other_bytes'] += length
+
+    seen = set()
+    for page in pdf.pages:
+        try:
+            box = [float(v) for v in page.mediabox]
+            width_in, height_in = abs(box[2] - box[0]) / 72, abs(box[3] - box[1]) / 72
+        except Exception:
+            continue
+        if width_in <= 0 or height_in <= 0:
+            continue
+        for image in _page_images(page.obj, seen):
+            try:
+                dpi = max(int(image.Width) / width_in, int(image.Height) / height_in)
+            except Exception:
+                continue
+            analysis['max_page_dpi'] = max(analysis['max_page_dpi'], round(dpi))
+            if dpi > target_dpi * dpi_margin:
+                analysis['images_above_target'] += 1
+                analysis['bytes_above_target'] += _stream_length(image)
+    return analysis
+
+def choose_strategy(analysis, ghostscript_required=False, rewrite_required=False):
+    """Returns (strategy, reason) for the lossy mode from an analyze_pdf profile.
+
+    ghostscript_required: options only the high-compression run honours (grayscale, posterize,
+    removing interactive elements). rewrite_required: the file must be rewritten even if
+    nothing compresses (metadata stripping, /OpenAction removal, fast web view...).
+    """
+    if analysis['bytes_above_target'] >= _DOWNSAMPLE_BYTES_WORTH_GS:
+        reason = (f"{analysis['images_above_target']} images ({analysis['bytes_above_target'] // 1024} KB) "
+                  f"above the target DPI")
+        if analysis['print_color_images'] and not ghostscript_required:
+            return STRATEGY_GS_PRESET, reason + "; CMYK/spot images keep their colour with the preset"
+        return STRATEGY_GS, reason
+    if ghostscript_required:
+        return STRATEGY_GS, "the selected options need Ghostscript"
+    if analysis['full_font_bytes'] >= _FULL_FONT_BYTES_WORTH_GS:
+        return STRATEGY_GS, f"{analysis['full_font_bytes'] // 1024} KB of fonts embedded without subsetting"
+    if 'ghostscript' in analysis['producer'].lower() and analysis['uncompressed_bytes'] == 0 and not rewrite_required:
+        return STRATEGY_SKIP, "already written by Ghostscript, no image above the target DPI"
+    return STRATEGY_PIKEPDF, "no image above the target DPI; lossless path"
+
+def preflight(path, target_dpi, ghostscript_required=False, rewrite_required=False, dpi_margin=DEFAULT_DPI_MARGIN):
+    """Analyzes the file at path; returns the profile with 'strategy' and 'reason' added."""
+    try:
+        with pikepdf.open(path) as pdf:
+            analysis = analyze_pdf(pdf, target_dpi, dpi_margin)
+    except Exception as e:
+        logging.warning(f"Pre-flight analysis failed, running Ghostscript: {e}")
+        return {'strategy': STRATEGY_GS, 'reason': f"pre-flight failed: {e}"}
+    analysis['strategy'], analysis['reason'] = choose_strategy(analysis, ghostscript_required, rewrite_required)
+    return analysis
@@ -0,0 +1,159 @@
+# race.py
+import os
+import sys
+import time
+import queue
+import shutil
+import logging
+import tempfile
+import multiprocessing
+from pathlib import Path
+import pikepdf
+
+from constants import ProcessingError, TaskCancelled
+from pdf_optimizer import PdfOptimizer
+from preflight import analyze_pdf
+from utils import terminate_tree, keep_tools_in_process_group
+
+CANDIDATES = ('lossless', 'lossy', 'preset')
+
+# Once a candidate has a valid result, the others get this multiple of its time (but at least
+# _MIN_PATIENCE_SECONDS more) before they are cancelled.
+_PATIENCE = 1.5
+_MIN_PATIENCE_SECONDS = 2.0
+_POLL_SECONDS = 0.25
+
+# Conservative lower bounds on output size, as fractions of the bytes they apply to:
+# lossless recompression rarely wins 40% on streams that are already compressed, and
+# Ghostscript rarely gets a document below 5% of its size.
+_LOSSLESS_FLOOR_COMPRESSED = 0.6
+_LOSSLESS_FLOOR_UNCOMPRESSED = 0.1
+_GS_FLOOR = 0.05
+
+def size_floor(name, analysis, input_size):
+    """The smallest output a candidate can plausibly reach; a result at or below it can't be beaten by that candidate."""
+    if analysis is None:
+        return 0
+    if name == 'lossless':
+        uncompressed = min(analysis['uncompressed_bytes'], input_size)
+        return int(_LOSSLESS_FLOOR_UNCOMPRESSED * uncompressed + _LOSSLESS_FLOOR_COMPRESSED * (input_size - uncompressed))
+    return int(_GS_FLOOR * input_size)
+
+def _run_candidate(name, optimizer_options, input_file, output_file, job, results, cancel=None):
+    """Process entry point: runs one strategy and reports (name, report, error)."""
+    if sys.platform != "win32":
+        os.setpgrp()  # Its own process group, so cancelling also stops the tools it spawned
+        keep_tools_in_process_group()
+    try:
+        optimizer = PdfOptimizer(q=None, cancel=cancel, **optimizer_options)
+        if name == 'lossless':
+            report = optimizer.optimize_lossless(input_file, output_file, strip_metadata=job['strip_metadata'])
+        else:
+            method = optimizer.optimize_lossy_preset if name == 'preset' else optimizer.optimize_lossy
+            report = method(input_file, output_file, job['dpi'], strip_metadata=job['strip_metadata'],
+                            remove_interactive=job['remove_interactive'], use_bicubic=job['use_bicubic'])
+        results.put((name, report, None))
+    except (Exception, TaskCancelled) as e:
+        results.put((name, None, str(e)))
+
+def _valid_size(path, page_count):
+    """Size of a candidate's output if it is a readable PDF with every page, else None."""
+    try:
+        if path.stat().st_size == 0:
+            return None
+        with pikepdf.open(path) as pdf:
+            if page_count is not None and len(pdf.pages) != page_count:
+                return None
+        return path.stat().st_size
+    except Exception:
+        return None
+
+def race_candidates(optimizer_options, input_file, output_file, job, q=None, candidates=CANDIDATES, cancel=None):
+    """Runs the candidate strategies in parallel processes and keeps the smallest valid output.
+
+    job holds the lossy arguments (dpi, strip_metadata, remove_interactive, use_bicubic).
+    Candidates are cancelled once the best result is at or below what they could reach, or
+    when they overrun the patience window that starts with the first valid result; a
+    cancelled candidate is stopped with the external tools it spawned, and all of them are
+    when the cancel token is set. Returns the winner's report with a 'race' summary added.
+    """
+    input_file, output_file = Path(input_file), Path(output_file)
+    input_size = input_file.stat().st_size
+    try:
+        with pikepdf.open(input_file) as pdf:
+            page_count = len(pdf.pages)
+            analysis = analyze_pdf(pdf, job['dpi'])
+    except Exception as e:
+        logging.warning(f"Could not profile {input_file.name} before racing: {e}")
+        page_count = analysis = None
+
+    # The race replaces the pre-flight choice; each candidate runs its strategy as is.
+    optimizer_options = {**optimizer_options, 'preflight': False}
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    outcomes, reports = {}, {}
+    best, best_size, deadline = None, None, None
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        processes, outputs = {}, {}
+        started = time.perf_counter()
+        for name in candidates:
+            outputs[name] = Path(temp_dir) / f"{name}.pdf"
+            processes[name] = ctx.Process(target=_run_candidate, args=(
+                name, optimizer_options, str(input_file), str(outputs[name]), job, results, cancel))
+            processes[name].start()
+        if q: q.put(('status', f"Racing {len(candidates)} strategies on {input_file.name}..."))
+
+        def stop_candidate(name, why):
+            terminate_tree(processes[name])
+            outcomes[name] = {'status': 'cancelled', 'reason': why}
+            logging.info(f"Cancelled {name} candidate for {input_file.name}: {why}.")
+
+        pending = set(candidates)
+        try:
+            while pending:
+                try:
+                    name, report, error = results.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    if cancel is not None:
+                        cancel.raise_if_cancelled()  # The finally below stops every candidate
+                    for name in [n for n in pending if not processes[n].is_alive()]:
+                        pending.discard(name)
+                        outcomes[name] = {'status': 'failed', 'reason': f"exited with code {processes[name].exitcode}"}
+                    if deadline is not None and time.perf_counter() >= deadline:
+                        for name in list(pending):
+                            stop_candidate(name, "slower than the patience window")
+                        pending.clear()
+                    continue
+
+                pending.discard(name)
+                seconds = round(time.perf_counter() - started, 3)
+                size = _valid_size(outputs[name], page_count) if error is None else None
+                if size is None:
+                    outcomes[name] = {'status': 'failed', 'reason': error or "invalid output", 'seconds': seconds}
+                    continue
+                outcomes[name] = {'status': 'done', 'bytes': size, 'seconds': seconds}
+                reports[name] = report
+                if best is None or size < best_size:
+                    best, best_size = name, size
+                    if q: q.put(('status', f"{name.capitalize()} candidate: {size} bytes..."))
+                if deadline is None:
+                    deadline = time.perf_counter() + max(seconds * (_PATIENCE - 1), _MIN_PATIENCE_SECONDS)
+                for other in list(pending):
+                    if best_size <= size_floor(other, analysis, input_size):
+                        stop_candidate(other, f"cannot beat {best_size} bytes")
+                        pending.discard(other)
+        finally:
+            for name, process in processes.items():
+                if process.is_alive():
+                    terminate_tree(process)
+                process.join()
+
+        if best is None:
+            raise ProcessingError(f"No strategy produced a valid output for {input_file.name}.")
+        shutil.copy2(outputs[best], output_file)
+
+    logging.info(f"Best of {len(candidates)} for {input_file.name}: {best} ({best_size} bytes); {outcomes}")
+    report = reports[best] or {}
+    report['race'] = {'winner': best, 'candidates': outcomes}
+    return report
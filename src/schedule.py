@@ -0,0 +1,58 @@
+# schedule.py
+import os
+import logging
+import pikepdf
+
+from constants import ProcessingError
+from preflight import analyze_pdf
+from memory import decoded_image_bytes
+
+SCHEDULE_INPUT = 'input'
+SCHEDULE_LARGEST = 'largest'
+SCHEDULE_SMALLEST = 'smallest'
+SCHEDULE_COST = 'cost'
+SCHEDULES = (SCHEDULE_INPUT, SCHEDULE_LARGEST, SCHEDULE_SMALLEST, SCHEDULE_COST)
+
+# Relative cost weights: decoding and re-encoding images dominates, then rewriting the
+# document's bytes (content streams are parsed as well), then per-page overhead.
+_PIXEL_WEIGHT = 1.0
+_FILE_WEIGHT = 2.0
+_CONTENT_WEIGHT = 4.0
+_PAGE_WEIGHT = 64 * 1024
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def estimate_cost(path, params):
+    """Relative processing cost of the file at path, from a preflight profile and its decoded image size."""
+    file_bytes = _file_size(path)
+    try:
+        with pikepdf.open(path) as pdf:
+            analysis = analyze_pdf(pdf, params.get('dpi', 72))
+            total_images, _ = decoded_image_bytes(pdf)
+    except Exception as e:
+        logging.info(f"Cost estimate for {os.path.basename(path)} from its size only: {e}")
+        return _FILE_WEIGHT * file_bytes
+    return (_PIXEL_WEIGHT * total_images + _FILE_WEIGHT * file_bytes
+            + _CONTENT_WEIGHT * analysis['content_bytes'] + _PAGE_WEIGHT * analysis['pages'])
+
+def order_jobs(paths, indices, policy, params):
+    """indices (into paths) in the order to start them under policy.
+
+    largest: biggest files first (LPT), so a big file at the end of the list doesn't run
+    alone while the other workers idle. smallest: shortest first, for the quickest first
+    results. cost: highest estimated cost first. Ties keep the input order.
+    """
+    if policy in (None, SCHEDULE_INPUT):
+        return list(indices)
+    if policy == SCHEDULE_LARGEST:
+        return sorted(indices, key=lambda i: -_file_size(paths[i]))
+    if policy == SCHEDULE_SMALLEST:
+        return sorted(indices, key=lambda i: _file_size(paths[i]))
+    if policy == SCHEDULE_COST:
+        costs = {i: estimate_cost(paths[i], params) for i in indices}
+        return sorted(indices, key=lambda i: -costs[i])
+    raise ProcessingError(f"Unknown schedule: {policy}")
@@ -0,0 +1,304 @@
+# server.py
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import threading
+import multiprocessing
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from backend import compress_single_file, detach_worker
+from cli import OPTIONS, MODES, CHOICES
+
+_CHUNK_BYTES = 1024 * 1024
+# Options a client may not set: they name paths on the server, act on files outside the
+# request, or size the processes and caches a job uses beyond the server's bounded pool.
+_SERVER_ONLY_OPTIONS = ('image_cache_dir', 'journal', 'delete_original', 'telemetry_sidecar',
+                        'image_workers', 'gs_workers', 'image_cache', 'memory_budget_mb')
+_TRUE = ('1', 'true', 'yes', 'on')
+_FALSE = ('0', 'false', 'no', 'off')
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def params_from_query(query, base_params):
+    """Compress params for one request: base_params with the CompressSettings fields given in the query."""
+    params = {param: default for param, _, default, _ in OPTIONS}
+    params.update(base_params)
+    types = {param: kind for param, kind, _, _ in OPTIONS if param not in _SERVER_ONLY_OPTIONS}
+    for key, values in parse_qs(query, keep_blank_values=True).items():
+        value = values[-1]
+        if key == 'mode':
+            if value not in MODES:
+                raise RequestError(400, f"mode must be one of {', '.join(MODES)}")
+            params['mode'] = MODES[value]
+            continue
+        if key not in types:
+            raise RequestError(400, f"unknown or disallowed option: {key}")
+        kind = types[key]
+        if kind is bool:
+            if value.lower() not in _TRUE + _FALSE:
+                raise RequestError(400, f"{key} must be true or false")
+            params[key] = value.lower() in _TRUE
+        else:
+            try:
+                params[key] = kind(value)
+            except ValueError:
+                raise RequestError(400, f"{key} must be a {kind.__name__}")
+            if key in CHOICES and params[key] not in CHOICES[key]:
+                raise RequestError(400, f"{key} must be one of {', '.join(map(str, CHOICES[key]))}")
+    params.setdefault('mode', MODES['lossy'])
+    return params
+
+class _Metrics:
+    """Counters for /metrics, in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {'requests_total': 0, 'completed_total': 0, 'failed_total': 0, 'rejected_total': 0,
+                         'bytes_in_total': 0, 'bytes_out_total': 0, 'processing_seconds_total': 0.0}
+
+    def add(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self.counters[name] += amount
+
+    def render(self, gauges):
+        with self._lock:
+            values = {**self.counters, **gauges}
+        return "".join(f"minimalpdf_{name} {value}\n" for name, value in values.items())
+
+class CompressionServer(ThreadingHTTPServer):
+    """HTTP front end to the optimizer.
+
+    POST /compress with a PDF body (Content-Length or chunked) and CompressSettings fields
+    as query parameters returns the compressed PDF. Bodies are streamed to a temp file, and
+    jobs run in a pool of worker processes. Once workers + queue_size requests are
+    admitted, further ones get 429 with Retry-After (before the upload, for clients that
+    send Expect: 100-continue).
+    GET /health and GET /metrics report on the service.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, base_params, workers=1, queue_size=None, max_upload_mb=512):
+        super().__init__(address, _Handler)
+        self.base_params = base_params
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.capacity = self.workers + (self.workers if queue_size is None else queue_size)
+        self.max_upload_bytes = int(max_upload_mb * 1024 * 1024)
+        self.metrics = _Metrics()
+        self._admitted = 0
+        self._running = 0
+        self._admission = threading.Lock()
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=detach_worker)
+
+    def admit(self):
+        with self._admission:
+            if self._admitted >= self.capacity:
+                return False
+            self._admitted += 1
+            return True
+
+    def release(self):
+        with self._admission:
+            self._admitted -= 1
+
+    def compress(self, params, input_file, output_dir):
+        """Runs one job in the pool and waits for its outcome."""
+        with self._admission:
+            self._running += 1
+        try:
+            return self.executor.submit(compress_single_file, params, str(input_file), str(output_dir)).result()
+        finally:
+            with self._admission:
+                self._running -= 1
+
+    def gauges(self):
+        with self._admission:
+            return {'in_flight': self._admitted, 'running': self._running, 'capacity': self.capacity,
+                    'workers': self.workers}
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "MinimalPDF"
+    protocol_version = "HTTP/1.1"  # Keep-alive and Expect: 100-continue
+    _params = None
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+    def _send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self._send_json(200, {'status': 'ok', **self.server.gauges()})
+        elif path == '/metrics':
+            data = self.server.metrics.render(self.server.gauges()).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def _admit(self):
+        """Parses the query and takes a slot; raises RequestError (429 when full)."""
+        url = urlsplit(self.path)
+        if url.path != '/compress':
+            raise RequestError(404, "not found")
+        self.server.metrics.add(requests_total=1)
+        params = params_from_query(url.query, self.server.base_params)
+        if not self.server.admit():
+            self.server.metrics.add(rejected_total=1)
+            raise RequestError(429, "too many requests")
+        return params
+
+    def _send_error(self, error):
+        headers = [('Retry-After', '1')] if error.status == 429 else []
+        self._send_json(error.status, {'error': str(error)}, headers)
+
+    def handle_expect_100(self):
+        # Clients sending Expect: 100-continue are turned away before they upload anything.
+        if self.command != 'POST':
+            return super().handle_expect_100()
+        try:
+            self._params = self._admit()
+        except RequestError as e:
+            self.close_connection = True
+            self._send_error(e)
+            return False
+        return super().handle_expect_100()
+
+    def do_POST(self):
+        params = getattr(self, '_params', None)
+        if params is None:
+            try:
+                params = self._admit()
+            except RequestError as e:
+                # Read and drop the body first, so the client gets the answer rather than a reset.
+                try:
+                    self._read_body(None)
+                except RequestError:
+                    self.close_connection = True
+                self._send_error(e)
+                return
+        self._params = None
+        try:
+            with tempfile.TemporaryDirectory(prefix="minimalpdf-http-") as temp_dir:
+                self._compress(params, Path(temp_dir))
+        except RequestError as e:
+            self.close_connection = True
+            self._send_error(e)
+        finally:
+            self.server.release()
+
+    def _read_body(self, f):
+        """Streams the request body to the file f (or drops it when f is None); returns its size."""
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            size = 0
+            while (chunk_size := self._chunk_size()) > 0:
+                size += chunk_size
+                if size > self.server.max_upload_bytes:
+                    raise RequestError(413, "upload too large")
+                self._copy(f, chunk_size)
+                self.rfile.readline()  # CRLF after the chunk
+            while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                pass  # Trailer fields
+            return size
+        if self.headers.get('Content-Length') is None:
+            raise RequestError(411, "Content-Length or chunked transfer encoding required")
+        try:
+            size = int(self.headers['Content-Length'])
+        except ValueError:
+            size = -1
+        if size < 0:
+            raise RequestError(400, "invalid Content-Length")
+        if size > self.server.max_upload_bytes:
+            raise RequestError(413, "upload too large")
+        self._copy(f, size)
+        return size
+
+    def _chunk_size(self):
+        line = self.rfile.readline().split(b';')[0].strip()
+        try:
+            size = int(line or b'0', 16)
+        except ValueError:
+            size = -1
+        if size < 0:
+            raise RequestError(400, "invalid chunk size")
+        return size
+
+    def _copy(self, f, remaining):
+        while remaining > 0:
+            chunk = self.rfile.read(min(_CHUNK_BYTES, remaining))
+            if not chunk:
+                raise RequestError(400, "request body ended early")
+            if f is not None:
+                f.write(chunk)
+            remaining -= len(chunk)
+
+    def _compress(self, params, temp_dir):
+        input_file, output_dir = temp_dir / "input.pdf", temp_dir / "output"
+        output_dir.mkdir()
+        with open(input_file, 'wb') as f:
+            bytes_in = self._read_body(f)
+        if bytes_in == 0:
+            raise RequestError(400, "empty body")
+
+        started = time.perf_counter()
+        outcome = self.server.compress(params, input_file, output_dir)
+        seconds = time.perf_counter() - started
+        self.server.metrics.add(processing_seconds_total=seconds)
+
+        error = outcome.get('error') or outcome.get('fallback')
+        if error:
+            self.server.metrics.add(failed_total=1)
+            self._send_json(422, {'error': error})
+            return
+        # Not saved because it didn't get smaller: the original is the answer.
+        result = output_dir / outcome['output'] if outcome.get('output') else input_file
+        bytes_out = result.stat().st_size
+        self.server.metrics.add(completed_total=1, bytes_in_total=bytes_in, bytes_out_total=bytes_out)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(bytes_out))
+        self.send_header('X-Bytes-In', str(bytes_in))
+        self.send_header('X-Bytes-Out', str(bytes_out))
+        self.send_header('X-Status', 'not_saved' if outcome.get('skipped') else 'done')
+        self.send_header('X-Seconds', f"{seconds:.3f}")
+        self.end_headers()
+        with open(result, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, _CHUNK_BYTES)
+
+def serve(base_params, host="127.0.0.1", port=8765, workers=1, queue_size=None, max_upload_mb=512):
+    """Runs the server until Ctrl+C."""
+    server = CompressionServer((host, port), base_params, workers, queue_size, max_upload_mb)
+    logging.warning(f"Serving on http://{host}:{server.server_address[1]} with {server.workers} workers.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
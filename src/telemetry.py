@@ -0,0 +1,82 @@
+# telemetry.py
+import os
+import json
+import time
+import logging
+from pathlib import Path
+from contextlib import contextmanager
+
+def _cpu_seconds():
+    """CPU time of this process plus its reaped children (tool subprocesses, pool workers)."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def file_size(path):
+    try:
+        return Path(path).stat().st_size
+    except (OSError, TypeError):
+        return None
+
+class DocumentTelemetry:
+    """Collects per-stage wall/CPU time, bytes and object counts for one optimize_* call.
+
+    Stages are recorded in the order they ran, so a repeated stage shows up as a repeated
+    entry. Image tool times are summed from the jobs, wherever they ran.
+    """
+
+    def __init__(self, input_file, mode):
+        self.input_file = str(input_file)
+        self.mode = mode
+        self.stages = []
+        self.tools = {}
+        self.preflight = None
+        self._started_wall = time.perf_counter()
+        self._started_cpu = _cpu_seconds()
+
+    @contextmanager
+    def stage(self, name, bytes_in=None):
+        """Times a stage; the yielded record takes optional 'bytes_out', 'objects' and other counters."""
+        record = {'stage': name}
+        if bytes_in is not None:
+            record['bytes_in'] = bytes_in
+        wall, cpu = time.perf_counter(), _cpu_seconds()
+        try:
+            yield record
+        except Exception:
+            record['failed'] = True
+            raise
+        finally:
+            record['wall_seconds'] = round(time.perf_counter() - wall, 4)
+            record['cpu_seconds'] = round(_cpu_seconds() - cpu, 4)
+            self.stages.append(record)
+
+    def add_tool_times(self, timings):
+        for tool, seconds in timings.items():
+            entry = self.tools.setdefault(tool, {'jobs': 0, 'seconds': 0.0})
+            entry['jobs'] += 1
+            entry['seconds'] += seconds
+
+    def report(self, output_file):
+        report = {
+            'file': self.input_file,
+            'mode': self.mode,
+            'bytes_in': file_size(self.input_file),
+            'bytes_out': file_size(output_file),
+            'wall_seconds': round(time.perf_counter() - self._started_wall, 4),
+            'cpu_seconds': round(_cpu_seconds() - self._started_cpu, 4),
+            'stages': self.stages,
+            'tools': {tool: {'jobs': e['jobs'], 'seconds': round(e['seconds'], 4)} for tool, e in self.tools.items()},
+        }
+        if self.preflight is not None:
+            report['preflight'] = self.preflight
+        return report
+
+def write_sidecar(report, output_file):
+    """Writes a report as <output stem>.telemetry.json next to the output file."""
+    sidecar = Path(output_file).with_suffix('.telemetry.json')
+    try:
+        sidecar.write_text(json.dumps(report, indent=2), encoding='utf-8')
+    except OSError as e:
+        logging.warning(f"Could not write telemetry sidecar {sidecar}: {e}")
+        return None
+    return sidecar
@@ -1,13 +1,23 @@
 import os
 import sys
+import time
+import signal
 import shutil
 import logging
 import tempfile
 import subprocess
+import multiprocessing
 from pathlib import Path
 import pikepdf
 
-from constants import ToolNotFound, ProcessingError
+from constants import ToolNotFound, ProcessingError, ProcessingTimeout, TaskCancelled
+
+# How often a running tool is checked for cancellation.
+_CANCEL_POLL_SECONDS = 0.1
+# Executable names whose timeouts are configured under another tool's name.
+_TOOL_ALIASES = {'gswin64c': 'gs', 'gswin32c': 'gs'}
+# Set by keep_tools_in_process_group; inherited by the processes spawned afterwards.
+_TOOLS_IN_GROUP_ENV = 'MINIMALPDF_TOOLS_IN_GROUP'
 
 def resource_path(relative_path):
     try:
@@ -49,13 +59,117 @@ def get_pdf_metadata(file_path):
         logging.warning(f"Could not get metadata for {file_path}: {e}")
         return {'name': Path(file_path).name, 'pages': 'N/A', 'size': 'N/A'}
 
-def run_command(command, check=True):
+def _as_text(output):
+    return output.decode('utf-8', 'ignore') if isinstance(output, bytes) else output
+
+class CancelToken:
+    """Cancellation flag shared by a task, its worker processes and the tools they run.
+
+    cancel() may be called from any thread or process. The token can be handed to new
+    processes (Process args, pool initargs) but not pickled into individual jobs.
+    """
+
+    def __init__(self):
+        self._event = multiprocessing.get_context('spawn').Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TaskCancelled("Cancelled.")
+
+def tool_name(command):
+    """The name a tool's timeout is configured under: its executable's name without extension."""
+    executable = command.split()[0] if isinstance(command, str) else str(command[0])
+    name = Path(executable).stem.lower()
+    return _TOOL_ALIASES.get(name, name)
+
+def tool_timeout(command, timeouts=None, deadline=None):
+    """Seconds command may run: its tool's entry in timeouts (or the '*' entry for any tool),
+    cut short by an absolute deadline; None for no limit. Raises ProcessingTimeout once the deadline has passed."""
+    timeout = (timeouts or {}).get(tool_name(command), (timeouts or {}).get('*'))
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise ProcessingTimeout("Document time limit reached.")
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return timeout
+
+def keep_tools_in_process_group():
+    """Runs the tools of this process, and of the ones it spawns, in its process group rather
+    than in sessions of their own, so stopping the group stops them too. For processes that
+    lead a group of their own (race candidates)."""
+    os.environ[_TOOLS_IN_GROUP_ENV] = '1'
+
+def terminate_tree(process):
+    """Stops a process (Popen or multiprocessing) together with the processes it started."""
+    try:
+        if sys.platform == "win32":
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True,
+                           creationflags=subprocess.CREATE_NO_WINDOW)
+        else:
+            os.killpg(process.pid, signal.SIGKILL if isinstance(process, subprocess.Popen) else signal.SIGTERM)
+    except (OSError, subprocess.SubprocessError):
+        process.terminate()
+
+def _wait_for(process, input_data, timeout, cancel):
+    """communicate() that gives up after timeout seconds or once cancel is set, stopping the tool."""
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    while True:
+        wait = _CANCEL_POLL_SECONDS if cancel is not None else None
+        if deadline is not None:
+            left = max(0.0, deadline - time.monotonic())
+            wait = left if wait is None else min(wait, left)
+        try:
+            return process.communicate(input_data, timeout=wait)
+        except subprocess.TimeoutExpired:
+            input_data = None  # Already being written; communicate resumes with the rest
+        if cancel is not None and cancel.cancelled:
+            terminate_tree(process)
+            process.communicate()
+            raise TaskCancelled("Cancelled.")
+        if deadline is not None and time.monotonic() >= deadline:
+            terminate_tree(process)
+            process.communicate()
+            raise ProcessingTimeout(f"{tool_name(process.args)} did not finish within {round(timeout, 1):g}s.")
+
+def run_command(command, check=True, input_data=None, timeout=None, cancel=None):
+    """Runs a tool and returns the CompletedProcess.
+
+    When input_data (bytes) is given it is piped to stdin and stdout is returned as
+    bytes, so tools that support it can work without temporary files. A tool still
+    running after timeout seconds, or when the cancel token is set, is killed with the
+    processes it started, raising ProcessingTimeout or TaskCancelled.
+    """
     use_shell = isinstance(command, str)
     logging.info(f"Executing command: {command}")
+    if cancel is not None:
+        cancel.raise_if_cancelled()
     try:
-        kwargs = { 'stdin': subprocess.DEVNULL, 'check': check, 'capture_output': True, 'text': True, 'encoding': 'utf-8', 'errors': 'ignore', 'shell': use_shell }
+        kwargs = { 'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE, 'shell': use_shell }
+        if input_data is None:
+            kwargs.update({ 'stdin': subprocess.DEVNULL, 'text': True, 'encoding': 'utf-8', 'errors': 'ignore' })
+        else:
+            kwargs['stdin'] = subprocess.PIPE
         if sys.platform == "win32": kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW
-        result = subprocess.run(command, **kwargs)
+        elif not os.environ.get(_TOOLS_IN_GROUP_ENV):
+            # Its own session: Ctrl+C reaches it only through cancel, and it can be stopped with its children
+            kwargs['start_new_session'] = True
+        with subprocess.Popen(command, **kwargs) as process:
+            try:
+                stdout, stderr = _wait_for(process, input_data, timeout, cancel)
+            except BaseException:
+                if process.poll() is None:
+                    terminate_tree(process)  # Ctrl+C and the like: don't leave the tool running
+                raise
+        result = subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+        if check: result.check_returncode()
+        result.stderr = _as_text(result.stderr)
         if result.stderr:
             stderr_text = result.stderr.strip()
             if "wmic.exe" in stderr_text and "Failed to retrieve time" in stderr_text:
@@ -68,8 +182,12 @@ def run_command(command, check=True):
                 logging.warning(f"Command stderr: {stderr_text}")
         return result
     except subprocess.CalledProcessError as e:
-        logging.error(f"Command failed.\nSTDOUT: {e.stdout}\nSTDERR: {e.stderr}")
-        raise ProcessingError(f"Tool failed: {e.stderr.strip() if e.stderr else 'Unknown Error'}")
+        stderr = _as_text(e.stderr)
+        logging.error(f"Command failed.\nSTDOUT: {e.stdout if input_data is None else '<binary>'}\nSTDERR: {stderr}")
+        raise ProcessingError(f"Tool failed: {stderr.strip() if stderr else 'Unknown Error'}")
+    except ProcessingTimeout as e:
+        logging.warning(f"{e} Stopped it.")
+        raise
     except FileNotFoundError as e:
         logging.error(f"Command not found: {command if use_shell else command[0]}")
         raise ProcessingError(f"Command not found: {e}.")
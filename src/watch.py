@@ -0,0 +1,234 @@
+# watch.py
+import os
+import sys
+import time
+import queue
+import select
+import shutil
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from backend import compress_single_file, detach_worker
+
+# Files being compressed are moved here, inside the watched folder, so they are claimed once
+# and survive a restart; leftovers are picked up again when the watch starts.
+STAGING_NAME = ".processing"
+
+_IN_MODIFY = 0x002
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_INOTIFY_EVENT = struct.Struct('iIII')
+
+# With inotify the folder is still rescanned now and then, for events it can miss (network shares).
+_INOTIFY_RESCAN_SECONDS = 30.0
+# The loop wakes at least this often to hand finished files back and admit new ones.
+_TICK_SECONDS = 0.2
+
+class _Inotify:
+    """Minimal ctypes inotify watch on one folder (Linux only)."""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(str(folder)), mask) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {folder}")
+
+    def read(self, timeout):
+        """Names of the files that changed, waiting up to timeout seconds for the first event."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names, offset = [], 0
+        while offset + _INOTIFY_EVENT.size <= len(data):
+            _, _, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+def _unique_path(folder, name, taken=()):
+    """folder/name, or folder/'stem (n).suffix' when that exists or is in taken."""
+    path, n = Path(folder) / name, 1
+    while path.exists() or path.name.lower() in taken:
+        n += 1
+        path = Path(folder) / f"{Path(name).stem} ({n}){Path(name).suffix}"
+    return path
+
+class HotFolder:
+    """Watches a folder and compresses every PDF dropped into it with a pool of workers.
+
+    A file is claimed once its size and modification time have stayed the same for
+    settle_seconds (so half-written scans are left alone). Results go to output_dir, and
+    inputs that fail are moved to quarantine_dir with a .error.txt note. At most
+    workers + queue_size files are claimed at once; the rest wait in the folder until
+    there is room (backpressure). Files are claimed oldest first.
+    """
+
+    def __init__(self, watch_dir, output_dir, quarantine_dir, params, workers=1, queue_size=None,
+                 settle_seconds=2.0, poll_interval=2.0, on_result=None):
+        self.watch_dir = Path(watch_dir)
+        self.output_dir = Path(output_dir)
+        self.quarantine_dir = Path(quarantine_dir)
+        self.staging_dir = self.watch_dir / STAGING_NAME
+        self.params = params
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.capacity = self.workers + (self.workers if queue_size is None else queue_size)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.on_result = on_result
+        self.stats = {'processed': 0, 'failed': 0}
+        self._pending = {}   # name -> [size, mtime_ns, stable since, first seen]
+        self._in_flight = {}  # staged path -> (original name, first seen)
+        self._done = queue.Queue()
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def _open_watcher(self):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            return _Inotify(self.watch_dir)
+        except OSError as e:
+            logging.warning(f"inotify unavailable, polling {self.watch_dir} instead: {e}")
+            return None
+
+    def _track(self, name, now):
+        """Updates a file's stability record; returns False once it is gone or isn't a PDF."""
+        if not name.lower().endswith('.pdf'):
+            return False
+        try:
+            st = (self.watch_dir / name).stat()
+        except OSError:
+            self._pending.pop(name, None)
+            return False
+        record = self._pending.get(name)
+        if record is None:
+            self._pending[name] = [st.st_size, st.st_mtime_ns, now, now]
+        elif (record[0], record[1]) != (st.st_size, st.st_mtime_ns):
+            record[0], record[1], record[2] = st.st_size, st.st_mtime_ns, now
+        return True
+
+    def _scan(self, now):
+        with os.scandir(self.watch_dir) as entries:
+            names = [entry.name for entry in entries if entry.is_file()]
+        for name in names:
+            self._track(name, now)
+        for name in set(self._pending) - set(names):
+            del self._pending[name]
+
+    def _claim_ready(self, executor, now):
+        ready = sorted((record[3], name) for name, record in self._pending.items()
+                       if record[0] > 0 and now - record[2] >= self.settle_seconds)
+        for first_seen, name in ready:
+            if len(self._in_flight) >= self.capacity:
+                break
+            # Staged names are unique among outputs too, since a one-file batch keeps the input's name.
+            taken = {Path(p).name.lower() for p in self._in_flight}
+            staged = _unique_path(self.staging_dir, _unique_path(self.output_dir, name, taken).name, taken)
+            try:
+                os.replace(self.watch_dir / name, staged)  # Fails while a writer still holds it on Windows
+            except OSError as e:
+                logging.debug(f"Could not claim {name} yet: {e}")
+                continue
+            del self._pending[name]
+            self._submit(executor, staged, name, first_seen)
+
+    def _submit(self, executor, staged, name, first_seen):
+        self._in_flight[str(staged)] = (name, first_seen)
+        future = executor.submit(compress_single_file, self.params, str(staged), str(self.output_dir))
+        future.add_done_callback(lambda f, key=str(staged): self._done.put((key, f)))
+
+    def _finish(self, staged_key, future):
+        name, first_seen = self._in_flight.pop(staged_key)
+        staged = Path(staged_key)
+        try:
+            outcome = future.result()
+        except Exception as e:
+            outcome = {'error': f"worker failed: {e}"}
+
+        error = outcome.get('error') or outcome.get('fallback')
+        if error:
+            # A copied original is a failure here: the input goes to quarantine, not to the output folder.
+            if outcome.get('fallback') and outcome.get('output'):
+                (self.output_dir / outcome['output']).unlink(missing_ok=True)
+            self.stats['failed'] += 1
+            target = _unique_path(self.quarantine_dir, staged.name)
+            if staged.exists():
+                shutil.move(str(staged), target)
+            target.with_name(target.name + ".error.txt").write_text(f"{name}: {error}\n", encoding='utf-8')
+            result = {'input': name, 'status': 'quarantined', 'path': str(target), 'error': error}
+        else:
+            self.stats['processed'] += 1
+            if outcome.get('skipped'):
+                # Not saved because compression didn't help: the original is the result.
+                shutil.move(str(staged), _unique_path(self.output_dir, staged.name))
+            elif staged.exists():
+                staged.unlink()
+            output = str(self.output_dir / outcome['output']) if outcome.get('output') else None
+            result = {'input': name, 'status': 'done', 'path': output,
+                      'bytes_in': outcome.get('bytes_in'), 'bytes_out': outcome.get('size')}
+        result['seconds'] = round(time.time() - first_seen, 3)
+        logging.info(f"Hot folder: {name} {result['status']} in {result['seconds']}s.")
+        if self.on_result:
+            self.on_result(result)
+
+    def run(self):
+        """Watches until stop() (or Ctrl+C), then lets the files already claimed finish."""
+        for folder in (self.output_dir, self.quarantine_dir, self.staging_dir):
+            folder.mkdir(parents=True, exist_ok=True)
+        watcher = self._open_watcher()
+        rescan_every = _INOTIFY_RESCAN_SECONDS if watcher else self.poll_interval
+        logging.info(f"Watching {self.watch_dir} with {self.workers} workers ({'inotify' if watcher else 'polling'}).")
+
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=detach_worker) as executor:
+            # Files claimed by an earlier run that didn't finish go first.
+            for staged in sorted(self.staging_dir.iterdir()):
+                if staged.is_file():
+                    self._submit(executor, staged, staged.name, time.time())
+            next_scan = 0.0
+            try:
+                while not self._stop.is_set():
+                    now = time.time()
+                    if now >= next_scan:
+                        self._scan(now)
+                        next_scan = now + rescan_every
+                    if watcher:
+                        for name in watcher.read(_TICK_SECONDS):
+                            self._track(name, time.time())
+                        for name in list(self._pending):
+                            self._track(name, time.time())
+                    else:
+                        self._stop.wait(_TICK_SECONDS)
+                    while not self._done.empty():
+                        self._finish(*self._done.get())
+                    self._claim_ready(executor, time.time())
+            except KeyboardInterrupt:
+                logging.info("Stopping the hot folder; finishing the files already claimed.")
+            finally:
+                while self._in_flight:
+                    self._finish(*self._done.get())
+                if watcher:
+                    watcher.close()
+        return self.stats